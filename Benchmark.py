@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+
+## @package Benchmark
+#  Benchmarks of BioSystem on scalable synthetic reaction networks.
+#
+#  Four families of networks can be generated at any size:
+#  - chain: a linear chain of first order conversions X0 -> X1 -> ...;
+#  - cascade: an enzyme cascade, every active enzyme activating the next
+#    one by Michaelis-Menten kinetics;
+#  - mass-action: a random network of bimolecular mass-action reactions
+#    with production and degradation of every species;
+#  - gene-regulatory: a ring of repressing genes (a generalized
+#    repressilator) with mRNA and protein species and Hill kinetics.
+#
+#  For every network the phases are timed separately: compilation of the
+#  rates and of the Jacobian, a single right-hand side evaluation, a full
+#  run, a pulsed run and the interpolation of traces. Results are written
+#  as JSON, one record per network, together with the versions of the
+#  libraries and the git commit, so runs of different commits can be
+#  compared:
+#
+#  @code
+# python Benchmark.py --sizes 10 100 1000 --output new.json
+# python Benchmark.py --compare old.json new.json
+#  @endcode
+#
+#  The time to import Biosystem in a fresh interpreter is measured too. It
+#  must stay within IMPORT_BUDGET seconds without importing sympy, which
+#  is only needed to compile models that are not cached:
+#
+#  @code
+# python Benchmark.py --import-budget
+#  @endcode
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+from Biosystem import BioSystem
+from Part import Part
+from Pulse import Pulse
+from Rate import Rate
+
+## Names of the network families and their generators, filled below.
+FAMILIES = {}
+
+## Maximum time in seconds to import Biosystem in a fresh interpreter.
+IMPORT_BUDGET = 0.5
+
+
+## Linear chain of first order conversions with an inflow and an outflow.
+#  @param size Number of species.
+#  @param seed Seed of the random rate constants.
+#  @return BioSystem.
+def chain(size, seed=0):
+    rng = np.random.default_rng(seed)
+    system = BioSystem()
+    system.addConstant('k_in', 1.0)
+    X = [system.addCompositor('X%d' % i, 0.0) for i in range(0, size)]
+    system.addPart(Part('-> X0', [X[0]], [Rate('k_in')]))
+    for i in range(0, size):
+        system.addConstant('k%d' % i, rng.uniform(0.5, 2.0))
+        rate = 'k%d * X%d' % (i, i)
+        if i + 1 < size:
+            system.addPart(Part('X%d -> X%d' % (i, i + 1),
+                                [X[i], X[i + 1]],
+                                [Rate('-' + rate), Rate(rate)]))
+        else:
+            system.addPart(Part('X%d ->' % i, [X[i]], [Rate('-' + rate)]))
+    return system
+
+
+## Enzyme cascade: the active form of every enzyme activates the next one.
+#  @param size Number of species (two per stage).
+#  @param seed Seed of the random rate constants.
+#  @return BioSystem.
+def cascade(size, seed=0):
+    rng = np.random.default_rng(seed)
+    system = BioSystem()
+    system.addConstant('signal', 1.0)
+    stages = max(size // 2, 1)
+    for i in range(0, stages):
+        system.addConstant('kcat%d' % i, rng.uniform(0.5, 2.0))
+        system.addConstant('Km%d' % i, rng.uniform(0.1, 1.0))
+        system.addConstant('kd%d' % i, rng.uniform(0.1, 0.5))
+        S = system.addCompositor('S%d' % i, 1.0)
+        P = system.addCompositor('P%d' % i, 0.0)
+        activator = 'signal' if i == 0 else 'P%d' % (i - 1)
+        rate = 'kcat%d * %s * S%d / (Km%d + S%d)' % (i, activator, i, i, i)
+        system.addPart(Part('S%d -> P%d' % (i, i), [S, P],
+                            [Rate('-' + rate), Rate(rate)]))
+        rate = 'kd%d * P%d' % (i, i)
+        system.addPart(Part('P%d -> S%d' % (i, i), [S, P],
+                            [Rate(rate), Rate('-' + rate)]))
+    return system
+
+
+## Random network of bimolecular mass-action reactions A + B -> C, with
+#  production and degradation of every species.
+#  @param size Number of species.
+#  @param seed Seed of the random network.
+#  @param degree Average number of reactions per species.
+#  @return BioSystem.
+def mass_action(size, seed=0, degree=4):
+    rng = np.random.default_rng(seed)
+    system = BioSystem()
+    system.addConstant('k_prod', 1.0)
+    system.addConstant('k_deg', 0.5)
+    X = [system.addCompositor('X%d' % i, rng.uniform(0.0, 1.0))
+         for i in range(0, size)]
+    for i in range(0, size):
+        system.addPart(Part('<-> X%d' % i, [X[i]],
+                            [Rate('k_prod - k_deg * X%d' % i)]))
+    for j in range(0, degree * size // 3):
+        (a, b, c) = rng.choice(size, 3, replace=(size < 3))
+        system.addConstant('k%d' % j, rng.uniform(0.01, 0.1))
+        rate = 'k%d * X%d * X%d' % (j, a, b)
+        system.addPart(Part('X%d + X%d -> X%d' % (a, b, c),
+                            [X[a], X[b], X[c]],
+                            [Rate('-' + rate), Rate('-' + rate), Rate(rate)]))
+    return system
+
+
+## Ring of genes, each one repressing the next (a generalized
+#  repressilator), with mRNA and protein species.
+#  @param size Number of species (two per gene).
+#  @param seed Seed of the random initial values.
+#  @return BioSystem.
+def gene_regulatory(size, seed=0):
+    rng = np.random.default_rng(seed)
+    system = BioSystem()
+    system.addConstant('alpha', 200.0)
+    system.addConstant('alpha0', 0.2)
+    system.addConstant('beta', 5.0)
+    system.addConstant('n', 2.0)
+    genes = max(size // 2, 1)
+    for i in range(0, genes):
+        m = system.addCompositor('m%d' % i, rng.uniform(0.0, 10.0))
+        p = system.addCompositor('p%d' % i, rng.uniform(0.0, 10.0))
+        repressor = 'p%d' % ((i - 1) % genes)
+        system.addPart(Part('gene %d' % i, [m, p], [
+            Rate('alpha / (1 + %s**n) + alpha0 - m%d' % (repressor, i)),
+            Rate('beta * (m%d - p%d)' % (i, i))]))
+    return system
+
+
+FAMILIES['chain'] = chain
+FAMILIES['cascade'] = cascade
+FAMILIES['mass-action'] = mass_action
+FAMILIES['gene-regulatory'] = gene_regulatory
+
+
+## Time a function.
+#  @param f Function without arguments.
+#  @param repeat Number of repetitions.
+#  @return Tuple (the best time in seconds, the result of the last call).
+def timed(f, repeat=1):
+    best = float('inf')
+    result = None
+    for i in range(0, repeat):
+        start = time.perf_counter()
+        result = f()
+        best = min(best, time.perf_counter() - start)
+    return (best, result)
+
+
+## Benchmark one network.
+#  @param family Name of the network family.
+#  @param size Number of species.
+#  @param tspan Simulated time interval.
+#  @param repeat Number of repetitions of every phase; the best time is
+#  reported.
+#  @param backend Backend of the right-hand side (see BioSystem.setBackend).
+#  @return Dictionary of the network description and the phase times.
+def benchmark(family, size, tspan=(0.0, 10.0), repeat=3, backend='numpy'):
+    system = FAMILIES[family](size)
+    # Compile without the model cache, so compilation is measured.
+    system.model_cache = None
+    system.setBackend(backend)
+    if size > 200:
+        system.setSolver('BDF', sparse=True)
+    record = {'family': family, 'size': size,
+              'species': len(system.compositors),
+              'constants': len(system.constants),
+              'parts': len(system.parts), 'backend': backend,
+              'solver': system.solver}
+    (record['compile_s'], result) = timed(system.determine_rates)
+    (record['jacobian_s'], result) = timed(system.determine_jacobian)
+    record['reactions'] = system.model.S.shape[1]
+
+    y = np.array([c.value for c in system.compositors], dtype=float)
+    p = system.constantValues()
+    calls = 0
+    start = time.perf_counter()
+    while calls < 10 or time.perf_counter() - start < 0.2:
+        system.sys_ode(y, tspan[0], p)
+        calls = calls + 1
+    record['rhs_us'] = 1e6 * (time.perf_counter() - start) / calls
+
+    (record['run_s'], result) = timed(lambda: system.run(list(tspan)),
+                                      repeat)
+    (T, Y) = result
+    record['run_points'] = len(T)
+
+    first = system.compositors[0].name
+    middle = tspan[0] + (tspan[1] - tspan[0]) / 2
+    pulses = [Pulse(tspan[0], '', 0),
+              Pulse(tspan[0] + (tspan[1] - tspan[0]) / 4, first, 1.0,
+                    period=(tspan[1] - tspan[0]) / 4, add=True),
+              Pulse(tspan[1], '', 0)]
+    (record['pulses_s'], result) = timed(
+        lambda: system.run_pulses(pulses), repeat)
+    (T2, Y2) = result
+    record['pulses_points'] = len(T2)
+
+    (record['interpolate_s'], result) = timed(
+        lambda: system.interpolate_traces(T, Y, T2[T2 <= middle],
+                                          Y2[T2 <= middle]), repeat)
+    return record
+
+
+## Measure the time to import Biosystem in fresh interpreters.
+#  @param repeat Number of interpreters started.
+#  @return Dictionary with the best import time in seconds (import_s) and
+#  the modules among sympy, scipy.integrate imported by it (heavy_modules).
+def import_time(repeat=5):
+    code = ('import sys, time\n'
+            'start = time.perf_counter()\n'
+            'import Biosystem\n'
+            'elapsed = time.perf_counter() - start\n'
+            'heavy = [m for m in ("sympy", "scipy.integrate") '
+            'if m in sys.modules]\n'
+            'print(elapsed, " ".join(heavy))\n')
+    best = float('inf')
+    heavy = []
+    for i in range(0, repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', code], capture_output=True, text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+        best = min(best, float(output[0]))
+        heavy = output[1:]
+    return {'import_s': best, 'heavy_modules': heavy}
+
+
+## Describe the environment of a benchmark run.
+#  @return Dictionary of the versions and the git commit.
+def environment():
+    import scipy
+    import sympy
+    commit = None
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        pass
+    return {'python': platform.python_version(),
+            'numpy': np.__version__, 'scipy': scipy.__version__,
+            'sympy': sympy.__version__, 'machine': platform.machine(),
+            'commit': commit or None,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+## Run the benchmarks of several families and sizes.
+#  @param families Names of the network families.
+#  @param sizes Numbers of species.
+#  @param repeat Number of repetitions of every phase.
+#  @param backend Backend of the right-hand side.
+#  @param progress Function called with every record or None.
+#  @return Dictionary with the environment and the list of records.
+def run_benchmarks(families, sizes, repeat=3, backend='numpy',
+                   progress=None):
+    records = []
+    for family in families:
+        for size in sizes:
+            record = benchmark(family, size, repeat=repeat, backend=backend)
+            records.append(record)
+            if progress is not None:
+                progress(record)
+    info = environment()
+    info.update(import_time())
+    return {'environment': info, 'results': records}
+
+
+## Compare the phase times of two benchmark runs.
+#  @param old Results of run_benchmarks of the reference.
+#  @param new Results of run_benchmarks to compare.
+#  @param threshold Ratio of times reported as a regression.
+#  @return List of (family, size, phase, old time, new time, ratio) tuples
+#  with ratio above @p threshold.
+def compare(old, new, threshold=1.2):
+    phases = ('compile_s', 'jacobian_s', 'rhs_us', 'run_s', 'pulses_s',
+              'interpolate_s')
+    reference = {}
+    for record in old['results']:
+        reference[(record['family'], record['size'])] = record
+    regressions = []
+    for record in new['results']:
+        before = reference.get((record['family'], record['size']))
+        if before is None:
+            continue
+        for phase in phases:
+            if before.get(phase) and record.get(phase) is not None:
+                ratio = record[phase] / before[phase]
+                if ratio > threshold:
+                    regressions.append((record['family'], record['size'],
+                                        phase, before[phase], record[phase],
+                                        ratio))
+    return regressions
+
+
+## Command line interface.
+#  @param argv Command line arguments.
+#  @return Exit status: 1 if regressions were found by --compare.
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='BioSystem benchmarks')
+    parser.add_argument('--families', nargs='+', default=sorted(FAMILIES),
+                        choices=sorted(FAMILIES))
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--backend', default='numpy')
+    parser.add_argument('--output', help='JSON file, standard output if '
+                        'not given')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two JSON result files')
+    parser.add_argument('--threshold', type=float, default=1.2)
+    parser.add_argument('--import-budget', nargs='?', type=float,
+                        const=IMPORT_BUDGET, metavar='SECONDS',
+                        help='only check the import time of Biosystem '
+                        '(default budget %g s)' % IMPORT_BUDGET)
+    args = parser.parse_args(argv)
+
+    if args.import_budget is not None:
+        result = import_time()
+        print('import Biosystem: %.3f s (budget %.3f s)%s' % (
+            result['import_s'], args.import_budget,
+            ', imports ' + ', '.join(result['heavy_modules'])
+            if result['heavy_modules'] else ''))
+        if (result['import_s'] > args.import_budget or
+                result['heavy_modules']):
+            return 1
+        return 0
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        regressions = compare(old, new, args.threshold)
+        for r in regressions:
+            print('%s %d %s: %.4g -> %.4g (x%.2f)' % r)
+        return 1 if regressions else 0
+
+    def progress(record):
+        sys.stderr.write('%(family)s %(size)d: compile %(compile_s).3fs, '
+                         'run %(run_s).3fs\n' % record)
+
+    results = run_benchmarks(args.families, args.sizes, args.repeat,
+                             args.backend, progress)
+    text = json.dumps(results, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,30 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
-from sympy import *
-from scipy.integrate import *
 from Compositor import Compositor
 from Const import Const
+from Part import Part
+from Rate import Rate
+from RateKernel import RateKernel
+from CompiledModel import CompiledModel, chunk_sizes
+from Compiler import Compiler, chunked
+from ModelCache import shared_cache
+from ResultCache import ResultCache
+from Result import Result
+from TrajectoryStore import TrajectoryStore
+from StochasticSimulator import StochasticSimulator
+from FitProblem import FitProblem
+from NativeModel import NativeModel
+from Stats import Stats
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import heapq
 import inspect
+import os
+import pickle
+import re
+import tempfile
+import time
 
 ## Biological system to simulate
 #
@@ -75,10 +94,6 @@ class BioSystem:
         self.compositors = []
         ## Constants in a Biosystem.
         self.constants = []
-        ## List of all the Compositor symbols in ths BioSystem
-        #  by initializing symbols with t we allow t to be a variable of
-        #  time that's not a Compositor or Constant.
-        self.symbols = ['t']
         ## A mapping between constant name and its index in @p constants list.
         self.map_constants = {}
         ## A mapping between compositor name and its index in @p constants list.
@@ -86,6 +101,172 @@ class BioSystem:
         ## Flag if function determine_rates was called.
         #  If False we need to call determine_rates again.
         self.rates_determined = False
+        ## Number of parts whose rates were already added to compositors.
+        self.parts_determined = 0
+        ## Structured rates (MassAction, MichaelisMenten, Hill) of the
+        #  determined parts as (Compositor index, Rate) pairs. They are
+        #  evaluated by a RateKernel, not added to the Compositor rates.
+        self.rate_laws = []
+        ## Flag if any rate string was parsed, i.e. adding a name may have
+        #  to invalidate parsed expressions.
+        self.parsed = False
+        ## Compiled right-hand side of the system (CompiledModel), available
+        #  after determine_rates was called.
+        self.model = None
+        ## Cache of compiled models (ModelCache) or None to always compile.
+        self.model_cache = shared_cache
+        ## Cache key of the compiled model or None.
+        self.model_key = None
+        ## Integration method: 'odeint' or a scipy solve_ivp method name
+        #  ('BDF', 'Radau', 'LSODA', ...).
+        self.solver = 'odeint'
+        ## Flag if the analytic Jacobian is passed to the solver.
+        self.use_jacobian = True
+        ## Flag if the Jacobian is passed to solve_ivp as a sparse matrix.
+        self.sparse_jacobian = False
+        ## Extra keyword arguments for the solver (e.g. rtol, atol).
+        self.solver_options = {}
+        ## Flag if only the independent Compositors are integrated, the
+        #  others following from the conservation laws.
+        self.reduce = True
+        ## Backend evaluating the right-hand side and the Jacobian: 'numpy',
+        #  'c' or 'numba'.
+        self.backend = 'numpy'
+        ## Instrumentation (Stats) or None if disabled.
+        self.stats = None
+        ## Cache of simulation results (ResultCache) or None if disabled.
+        self.result_cache = None
+        ## Compiler of the symbolic work in parallel chunks or None to
+        #  compile serially.
+        self.compiler = None
+        ## Generated source of the chunks of the compiled functions (see
+        #  CompiledModel): function names and dictionaries of chunks, so
+        #  only the chunks a change touches are generated again.
+        self.sources = {}
+
+    ## State to pickle. The shared model cache is not pickled along, a
+    #  BioSystem unpickled in another process uses the shared cache there.
+    #  Stats (which may hold hook functions), the result cache, the
+    #  compiler (which may hold a progress callback) and the sources of the
+    #  chunks are not pickled either.
+    #  @param self The object pointer.
+    #  @return Dictionary of attributes.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.model_cache is shared_cache:
+            state['model_cache'] = 'shared'
+        state['stats'] = None
+        state['result_cache'] = None
+        state['compiler'] = None
+        state['sources'] = {}
+        return state
+
+    ## Restore a pickled object.
+    #  @param self The object pointer.
+    #  @param state Dictionary of attributes.
+    #  @return None.
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.model_cache == 'shared':
+            self.model_cache = shared_cache
+        return None
+
+    ## Save the system to a file.
+    #
+    #  The file holds the Constants, Compositors, Parts and Rates, the solver
+    #  and backend settings and the compiled model (generated source of the
+    #  rates and of the Jacobian), but no sympy objects. BioSystem.load
+    #  therefore gives a system ready to run without any symbolic work.
+    #
+    #  @code
+    # sys.save('model.biosystem')
+    # sys = BioSystem.load('model.biosystem')
+    # (T, Y) = sys.run([0, 25])
+    #  @endcode
+    #
+    #  @param self The object pointer.
+    #  @param path File name.
+    #  @return The object pointer.
+    def save(self, path):
+        self.determine_rates()
+        if self.use_jacobian:
+            self.determine_jacobian()
+        index = {}
+        for i in range(0, len(self.compositors)):
+            index[id(self.compositors[i])] = i
+        state = {
+            'constants': [(c.name, c.value) for c in self.constants],
+            'compositors': [(k.name, k.init_value, k.value, k.rate)
+                            for k in self.compositors],
+            'parts': [(p.name, [index[id(k)] for k in p.compositors],
+                       list(p.rates)) for p in self.parts],
+            'parts_determined': self.parts_determined,
+            'rate_laws': self.rate_laws,
+            'solver': (self.solver, self.use_jacobian, self.sparse_jacobian,
+                       self.solver_options, self.reduce),
+            'backend': self.backend,
+            'model': self.model}
+        (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(
+            os.path.abspath(path)))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(SAVE_MAGIC)
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        return self
+
+    ## Load a system saved by save.
+    #  @param path File name.
+    #  @return The BioSystem, with its compiled model.
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            if f.read(len(SAVE_MAGIC)) != SAVE_MAGIC:
+                raise ValueError('Not a saved BioSystem: %s' % path)
+            state = pickle.load(f)
+        system = BioSystem()
+        for (name, value) in state['constants']:
+            system.addConstant(name, value)
+        for (name, init_value, value, rate) in state['compositors']:
+            k = system.addCompositor(name, init_value)
+            k.value = value
+            k.rate = rate
+        for (name, compositors, rates) in state['parts']:
+            system.parts.append(Part(
+                name, [system.compositors[i] for i in compositors], rates))
+        system.parts_determined = state['parts_determined']
+        system.rate_laws = state['rate_laws']
+        (system.solver, system.use_jacobian, system.sparse_jacobian,
+         system.solver_options, system.reduce) = state['solver']
+        system.backend = state['backend']
+        system.model = state['model']
+        system.rates_determined = True
+        if system.model_cache is not None:
+            system.model_key = system.model_cache.key(
+                system.rate_structure(),
+                [k.name for k in system.compositors],
+                [c.name for c in system.constants], system.backend)
+        return system
+
+    ## Write the system as a MATLAB script for the Part-compositor framework
+    #  of biosystem_matlab (see MatlabModel).
+    #  @param self The object pointer.
+    #  @param path File name of the script.
+    #  @return The object pointer.
+    def exportMatlab(self, path):
+        import MatlabModel
+        with open(path, 'w') as f:
+            f.write(MatlabModel.script(self))
+        return self
+
+    ## Read a system from a MATLAB script of the Part-compositor framework
+    #  of biosystem_matlab (see MatlabModel).
+    #  @param path File name of the script.
+    #  @return The BioSystem.
+    @staticmethod
+    def importMatlab(path):
+        import MatlabModel
+        with open(path) as f:
+            return MatlabModel.parse(f.read())
 
     ## Create or add a compositor to the system
     #  @param self The object pointer.
@@ -104,9 +285,19 @@ class BioSystem:
             new_compositor = Compositor(name, init_value)
         self.compositors.append(new_compositor)
         self.map_compositors[new_compositor.name] = len(self.compositors) - 1
-        self.symbols.append(new_compositor.sym)
+        self.name_added(new_compositor.name)
         return new_compositor
 
+    ## List of all the Compositor symbols in ths BioSystem
+    #  by initializing symbols with t we allow t to be a variable of
+    #  time that's not a Compositor or Constant. Symbols are created only
+    #  when needed (see Compositor.sym).
+    #  @param self The object pointer.
+    #  @return List ['t', Compositor symbols].
+    @property
+    def symbols(self):
+        return ['t'] + [c.sym for c in self.compositors]
+
     ## Get compositor index in the @p compositors with name @p name.
     #  @param self The object pointer.
     #  @param name Existing compositor name.
@@ -121,6 +312,7 @@ class BioSystem:
     #  @return Current system object pointer.
     def addPart(self, new_part):
         self.parts.append(new_part)
+        self.rates_determined = False
         return self
 
     ## Create or add a Constant to the system
@@ -139,31 +331,429 @@ class BioSystem:
             new_constant = Const(constant_or_name, init_value)
         self.constants.append(new_constant)
         self.map_constants[new_constant.name] = len(self.constants) - 1
+        self.name_added(new_constant.name)
         return new_constant
 
+    ## Invalidate what depends on a newly added Constant or Compositor name.
+    #  The compiled functions get a new argument, so they are compiled
+    #  again. Only the rates mentioning the name are parsed again, as the
+    #  name might have meant something else before, and only the source of
+    #  the chunks whose expressions changed is generated again.
+    #  @param self The object pointer.
+    #  @param name The added name.
+    #  @return None.
+    def name_added(self, name):
+        self.rates_determined = False
+        if not self.parsed:
+            return None
+        pattern = re.compile(r'\b%s\b' % re.escape(name))
+        for k in self.compositors:
+            if pattern.search(k.rate):
+                k.expr = None
+                k.derivatives = None
+                k.parameter_derivatives = None
+        return None
+
+    ## Symbols to use when parsing rate strings.
+    #  Every Constant and Compositor name (and t) is mapped to its own Symbol,
+    #  so that names like 'E' or 'S' are not read as sympy built-ins.
+    #  @param self The object pointer.
+    #  @return Dictionary of names and symbols.
+    def symbol_table(self):
+        from sympy import Symbol
+        table = {'t': Symbol('t')}
+        for c in self.constants:
+            table[c.name] = c.sym
+        for c in self.compositors:
+            table[c.name] = c.sym
+        return table
+
+    ## Arguments of the compiled functions.
+    #  @param self The object pointer.
+    #  @return List [time symbol, compositor symbols, constant symbols].
+    def arguments(self):
+        if not self.symbolic():
+            # Nothing is compiled from expressions, see CompiledModel.
+            return [None, [], []]
+        from sympy import Symbol
+        return [Symbol('t'),
+                self.symbols[1:],
+                [c.sym for c in self.constants]]
+
+    ## Check if any Compositor rate is a formula to compile, i.e. not only
+    #  structured rates were added.
+    #  @param self The object pointer.
+    #  @return True or False.
+    def symbolic(self):
+        return any([k.rate != '0' for k in self.compositors])
+
+    ## Everything the compiled model depends on besides the names: the
+    #  Compositor rate formulas and the structured rate laws.
+    #  @param self The object pointer.
+    #  @return List of strings.
+    def rate_structure(self):
+        return [k.rate for k in self.compositors] + \
+            ['%d %r' % (i, rate.law() + (rate.coefficient,))
+             for (i, rate) in self.rate_laws]
+
+    ## Current values of all Constants.
+    #  @param self The object pointer.
+    #  @return List of Constant values in the order of @p constants.
+    def constantValues(self):
+        return [c.value for c in self.constants]
+
+    ## Sympy expressions of all compositor rates.
+    #  Rate strings are parsed only when needed, i.e. not at all when the
+    #  compiled model was found in the cache.
+    #  @param self The object pointer.
+    #  @return List of expressions in the order of @p compositors.
+    def expressions(self):
+        with self.phase('parse'):
+            pending = [k for k in self.compositors if k.expr is None]
+            if len(pending) > 0:
+                ## Convert Compositor rate strings/formulas to sympy
+                #  expressions. Constants stay symbolic parameters.
+                exprs = chunked(self.compiler, 'parse', _parse_chunk,
+                                self.symbol_table(),
+                                [k.rate for k in pending])
+                for (k, expr) in zip(pending, exprs):
+                    k.expr = expr
+                self.parsed = True
+        return [k.expr for k in self.compositors]
+
+    ## Chunks of the generated source of the reactions: the reactions
+    #  first changing each Compositor, which keep their source when other
+    #  Compositors change. Common subexpressions are shared within a chunk.
+    #  @param self The object pointer.
+    #  @param S Stoichiometry matrix of reaction_network.
+    #  @return List of the numbers of reactions of the chunks.
+    def reaction_chunks(self, S):
+        from scipy.sparse import csc_matrix
+        S = csc_matrix(S)
+        S.sort_indices()
+        return chunk_sizes(S.indices[S.indptr[:-1]])
+
+    ## Source chunks of a compiled function, see CompiledModel.
+    #  @param self The object pointer.
+    #  @param name Function name.
+    #  @return Dictionary of chunk keys and sources.
+    def chunk_sources(self, name):
+        return self.sources.setdefault(name, {})
+
+    ## Build the reaction network form of the system.
+    #
+    #  Every compositor rate is split into terms c * v, where c is a number.
+    #  Equal terms v of all compositors form one reaction with the rate v,
+    #  and the numbers c are its stoichiometric coefficients. For example
+    #  '-k * A * E' in dA/dt and 'k * A * E' in dB/dt give one reaction of
+    #  rate k*A*E with coefficients -1 (A) and 1 (B). The coefficients of a
+    #  reaction are scaled so that each consumed Compositor X of integer
+    #  order n in v loses n, as in a mass-action reaction, if that holds
+    #  for all of them and leaves integer coefficients: '-2*k*A**2' alone
+    #  is the reaction 2A -> 0 of rate k*A**2, like MassAction('k',
+    #  {'A': 2}, -2). Otherwise the smallest coefficient in magnitude is
+    #  scaled to 1.
+    #
+    #  @param self The object pointer.
+    #  @return Tuple (rates, S) of the list of reaction rate expressions and
+    #  the sparse stoichiometry matrix (compositors x reactions).
+    def reaction_network(self):
+        from scipy.sparse import csr_matrix
+        from sympy import Add
+        exprs = self.expressions()
+        index = {}
+        terms = []
+        coefficients = []
+        for i in range(0, len(exprs)):
+            for arg in Add.make_args(exprs[i]):
+                (c, term) = arg.as_coeff_Mul()
+                if c == 0:
+                    continue
+                if term not in index:
+                    index[term] = len(terms)
+                    terms.append(term)
+                    coefficients.append({})
+                coefficients[index[term]][i] = c
+        rates = []
+        rows = []
+        cols = []
+        values = []
+        state_syms = self.symbols[1:]
+        for j in range(0, len(terms)):
+            scale = _reaction_scale(terms[j], coefficients[j],
+                                    state_syms)
+            rates.append(scale * terms[j])
+            for i in sorted(coefficients[j].keys()):
+                rows.append(i)
+                cols.append(j)
+                values.append(float(coefficients[j][i] / scale))
+        S = csr_matrix((values, (rows, cols)),
+                       shape=(len(exprs), len(rates)))
+        return (rates, S)
+
     ## Determine rates of all compositors unless already determined.
+    #
+    #  Work is incremental: only the parts added since the last call add
+    #  their rates, and only the compositors they touch are parsed again.
+    #  The reaction network is built again, but the source of the reactions
+    #  is generated per Compositor (see reaction_chunks), and only the
+    #  chunks whose reactions changed go through common subexpression
+    #  elimination and code generation again. The source is then compiled
+    #  as a whole, unless the model cache holds it.
+    #
     #  @param self The object pointer.
     #  @return None.
     def determine_rates(self):
         if not self.rates_determined:
-            for i in self.parts:
+            for i in self.parts[self.parts_determined:]:
                 p = i
                 for k in range(0, len(p.compositors)):
-                    p.compositors[k].addRate(p.rates[k])
-            for k in self.compositors:
-                ## All Constant symbols.
-                constant_syms = list( map( (lambda c: c.sym), self.constants))
-                ## All Constant values.
-                constant_vals = list( map( (lambda c: c.value), self.constants))
-                ## Pairs of symbols and its value.
-                substitutions = zip(constant_syms, constant_vals)
-                ## Convert Compositor rate string/formula to sympy expression
-                #  and substitute all constants with its values.
-                symexpr = sympify(k.rate).subs(substitutions)
-                ## Convert sympy expression to python function with arguments:
-                #  time, compositor1_name, compositor2_name, ...
-                k.ratef = lambdify(self.symbols, symexpr)
+                    rate = p.rates[k]
+                    if isinstance(rate, Rate) and rate.law() is not None:
+                        self.rate_laws.append(
+                            (self.map_compositors[p.compositors[k].name],
+                             rate))
+                    else:
+                        p.compositors[k].addRate(rate)
+            self.parts_determined = len(self.parts)
+            self.model = None
+            if self.model_cache is not None:
+                with self.phase('cache'):
+                    self.model_key = self.model_cache.key(
+                        self.rate_structure(),
+                        [k.name for k in self.compositors],
+                        [c.name for c in self.constants], self.backend)
+                    self.model = self.model_cache.get(self.model_key)
+            if self.model is None:
+                ## Compile all the reaction rates into one function of
+                #  time, compositor values and constant values. Without
+                #  rate formulas sympy is not needed at all.
+                rates = []
+                S = np.zeros((len(self.compositors), 0))
+                chunks = []
+                if self.symbolic():
+                    self.expressions()
+                    with self.phase('network'):
+                        (rates, S) = self.reaction_network()
+                        chunks = self.reaction_chunks(S)
+                kernel = None
+                if len(self.rate_laws) > 0:
+                    with self.phase('kernel'):
+                        kernel = RateKernel(self.rate_laws,
+                                            len(self.compositors),
+                                            self.map_compositors,
+                                            self.map_constants)
+                with self.phase('codegen'):
+                    self.model = CompiledModel(
+                        self.arguments(), rates, S, kernel, self.compiler,
+                        chunks, self.chunk_sources('rates'))
+                if self.model_cache is not None:
+                    with self.phase('cache'):
+                        self.model_cache.put(self.model_key, self.model)
             self.rates_determined = True
+        if self.model.backend != self.backend:
+            self.determine_backend()
+        return None
+
+    ## Determine the analytic Jacobian of the system unless already
+    #  determined.
+    #
+    #  Only the structurally nonzero partial derivatives are differentiated
+    #  and compiled, so large sparse networks stay cheap. Derivatives are
+    #  kept per compositor, so after adding a part only the rates it changed
+    #  are differentiated again, and only the source of their rows is
+    #  generated again.
+    #
+    #  @param self The object pointer.
+    #  @return None.
+    def determine_jacobian(self):
+        self.determine_rates()
+        if self.model.jac is None:
+            with self.phase('jacobian'):
+                (rows, cols, entries) = self.jacobian_entries()
+                self.model.setJacobian(self.arguments(), rows, cols,
+                                       entries, self.compiler,
+                                       chunk_sizes(rows),
+                                       self.chunk_sources('jac'))
+            if self.model_cache is not None:
+                # Store the model again, now with its Jacobian.
+                self.model_cache.put(self.model_key, self.model)
+        return None
+
+    ## Structurally nonzero entries of the Jacobian of the system.
+    #  @param self The object pointer.
+    #  @return Tuple (rows, cols, entries) of the row and column indices and
+    #  the sympy expressions of the entries.
+    def jacobian_entries(self):
+        if not self.symbolic():
+            return ([], [], [])
+        state_syms = self.symbols[1:]
+        index = dict(zip(state_syms, range(0, len(state_syms))))
+        exprs = self.expressions()
+        pending = [i for i in range(0, len(exprs))
+                   if self.compositors[i].derivatives is None]
+        derivatives = self.differentiate(exprs, pending, index, 'jacobian')
+        for (i, d) in zip(pending, derivatives):
+            self.compositors[i].derivatives = d
+        rows = []
+        cols = []
+        entries = []
+        for i in range(0, len(exprs)):
+            k = self.compositors[i]
+            for (s, d) in k.derivatives:
+                rows.append(i)
+                cols.append(index[s])
+                entries.append(d)
+        return (rows, cols, entries)
+
+    ## Differentiate Compositor rates by the symbols they contain.
+    #  @param self The object pointer.
+    #  @param exprs Expressions of all Compositor rates.
+    #  @param pending Indices of the Compositors to differentiate.
+    #  @param index Dictionary of the symbols to differentiate by and their
+    #  indices, which order the derivatives.
+    #  @param phase Name of the phase for the progress callback.
+    #  @return List of the nonzero derivatives [(symbol, expression)], one
+    #  list per pending Compositor.
+    def differentiate(self, exprs, pending, index, phase):
+        items = [(exprs[i], sorted([s for s in exprs[i].free_symbols
+                                    if s in index],
+                                   key=lambda s: index[s]))
+                 for i in pending]
+        return chunked(self.compiler, phase, _derivative_chunk, None, items)
+
+    ## Compile the native code of the selected backend unless already
+    #  compiled (see setBackend).
+    #  @param self The object pointer.
+    #  @return None.
+    def determine_backend(self):
+        if self.model.backend == self.backend:
+            return None
+        native = None
+        if self.backend != 'numpy' and self.symbolic():
+            # Structured rates are evaluated by the kernel in any case.
+            (rows, cols, entries) = self.jacobian_entries()
+            if self.model.jac is None:
+                self.model.setJacobian(self.arguments(), rows, cols, entries,
+                                       self.compiler, chunk_sizes(rows),
+                                       self.chunk_sources('jac'))
+            directory = None
+            if self.model_cache is not None:
+                directory = self.model_cache.directory
+            if directory is None:
+                directory = os.path.join(tempfile.gettempdir(),
+                                         'biosystem-native')
+            exprs = self.expressions()
+            with self.phase('backend'):
+                native = NativeModel.build(self.backend, self.arguments(),
+                                           exprs, entries, directory)
+        self.model.setNative(self.backend, native)
+        if self.model_cache is not None:
+            self.model_cache.put(self.model_key, self.model)
+        return None
+
+    ## Determine the Jacobian of the system with respect to the Constants
+    #  unless already determined. Like determine_jacobian, only the
+    #  structurally nonzero derivatives are compiled.
+    #  @param self The object pointer.
+    #  @return None.
+    def determine_parameter_jacobian(self):
+        self.determine_rates()
+        if self.model.pjac is None:
+            rows = []
+            cols = []
+            entries = []
+            exprs = []
+            if self.symbolic():
+                const_syms = [c.sym for c in self.constants]
+                index = dict(zip(const_syms, range(0, len(const_syms))))
+                exprs = self.expressions()
+                pending = [i for i in range(0, len(exprs)) if
+                           self.compositors[i].parameter_derivatives is None]
+                derivatives = self.differentiate(exprs, pending, index,
+                                                 'parameter jacobian')
+                for (i, d) in zip(pending, derivatives):
+                    self.compositors[i].parameter_derivatives = d
+            for i in range(0, len(exprs)):
+                for (s, d) in self.compositors[i].parameter_derivatives:
+                    rows.append(i)
+                    cols.append(index[s])
+                    entries.append(d)
+            self.model.setParameterJacobian(self.arguments(), rows, cols,
+                                            entries, self.compiler,
+                                            chunk_sizes(rows),
+                                            self.chunk_sources('pjac'))
+            if self.model_cache is not None:
+                self.model_cache.put(self.model_key, self.model)
+        return None
+
+    ## Propensities of the reactions of reaction_network for molecule
+    #  counts: every integer power X^n (n >= 2) of a Compositor X in a rate
+    #  is replaced by the falling factorial X (X - 1) ... (X - n + 1), the
+    #  number of ways to pick n molecules of X. Rates are thus read as
+    #  mass-action rates in count units, e.g. k A^2 for the reaction
+    #  A + A -> B; other powers are kept.
+    #  @param self The object pointer.
+    #  @param rates Reaction rate expressions of reaction_network.
+    #  @return Tuple (propensities, changed) of the list of sympy
+    #  expressions and a flag telling if any of them differs from its rate.
+    def propensity_expressions(self, rates):
+        from sympy import Mul, Pow
+        state_syms = set(self.symbols[1:])
+        propensities = []
+        for rate in rates:
+            replacements = {}
+            for power in rate.atoms(Pow):
+                (base, order) = power.args
+                if base in state_syms and order.is_Integer and order >= 2:
+                    replacements[power] = Mul(*[base - k for k in
+                                                range(0, int(order))])
+            propensities.append(rate.xreplace(replacements))
+        return (propensities, propensities != rates)
+
+    ## Compile the propensities of all reactions, used by the stochastic
+    #  simulations, unless already compiled.
+    #  @param self The object pointer.
+    #  @return None.
+    def determine_propensities(self):
+        self.determine_rates()
+        if self.model.propensity_source is None:
+            propensities = None
+            chunks = None
+            if self.symbolic():
+                (rates, S) = self.reaction_network()
+                (propensities, changed) = self.propensity_expressions(rates)
+                chunks = self.reaction_chunks(S)
+                if not changed:
+                    propensities = None
+            self.model.setPropensities(self.arguments(), propensities,
+                                       self.compiler, chunks,
+                                       self.chunk_sources('propensities'))
+            if self.model_cache is not None:
+                self.model_cache.put(self.model_key, self.model)
+        return None
+
+    ## Compile the single reaction propensity functions and the reaction
+    #  dependencies needed by the stochastic next reaction method, unless
+    #  already compiled.
+    #  @param self The object pointer.
+    #  @return None.
+    def determine_reaction_functions(self):
+        self.determine_rates()
+        if self.model.reaction_functions is None:
+            rates = []
+            inputs = []
+            if self.symbolic():
+                (rates, changed) = self.propensity_expressions(
+                    self.reaction_network()[0])
+                state_syms = self.symbols[1:]
+                index = dict(zip(state_syms, range(0, len(state_syms))))
+                inputs = [sorted([index[s] for s in r.free_symbols
+                                  if s in index]) for r in rates]
+            self.model.setReactionFunctions(self.arguments(), rates, inputs,
+                                            self.compiler)
+            if self.model_cache is not None:
+                self.model_cache.put(self.model_key, self.model)
         return None
 
     ## Reset all Compositor rates to '0'.
@@ -171,19 +761,27 @@ class BioSystem:
     #  @return None.
     def reset_rates(self):
         self.rates_determined = False
+        self.model = None
+        self.model_key = None
+        self.parts_determined = 0
+        self.rate_laws = []
+        self.parsed = False
         for i in self.compositors:
             i.rate = '0'
-            i.ratef = None
+            i.expr = None
+            i.derivatives = None
+            i.parameter_derivatives = None
         return None
 
     ## Set Constant value by Constant name.
+    #  Constants are parameters of the compiled rates, so nothing has to be
+    #  recompiled.
     #  @param self The object pointer.
     #  @param name The name of existing Constant.
     #  @param value New value of the Constant.
     #  @return None.
     def changeConstantValue(self, name, value):
         self.constants[self.map_constants[name]].value = value
-        self.reset_rates()
         return None
 
     ## Set Compositor value and initial value by a Compositor name.
@@ -206,34 +804,1168 @@ class BioSystem:
             i.value = i.init_value
         return None
 
+    ## Select the integration method used by run and run_pulses.
+    #
+    #  Example for a stiff system:
+    #
+    #  @code
+    # sys.setSolver('BDF', sparse=True, rtol=1e-8)
+    #  @endcode
+    #
+    #  @param self The object pointer.
+    #  @param method 'odeint' (LSODA from scipy.integrate.odeint) or a
+    #  scipy.integrate.solve_ivp method name: 'BDF', 'Radau', 'LSODA', ...
+    #  @param jacobian If True pass the analytic Jacobian to the solver,
+    #  else let the solver estimate it by finite differences.
+    #  @param sparse If True pass the Jacobian to solve_ivp as a sparse
+    #  matrix (ignored by odeint, which needs a dense one).
+    #  @param reduce If True integrate only the independent Compositors
+    #  (see reduced_system), else all of them.
+    #  @param options Extra keyword arguments passed to the solver.
+    #  @return The object pointer.
+    def setSolver(self, method, jacobian=True, sparse=False, reduce=True,
+                  **options):
+        self.solver = method
+        self.use_jacobian = jacobian
+        self.sparse_jacobian = sparse
+        self.reduce = reduce
+        self.solver_options = options
+        return self
+
+    ## Select the backend evaluating the right-hand side and the Jacobian.
+    #
+    #  With 'c' or 'numba' the rates and the Jacobian are compiled to native
+    #  code (see NativeModel), stored in the model cache directory (or a
+    #  temporary directory), and used by all the simulation methods. Models
+    #  of different backends are cached separately. If no C
+    #  compiler or numba is available, the numpy functions are used.
+    #
+    #  @param self The object pointer.
+    #  @param backend 'numpy', 'c' or 'numba'.
+    #  @return The object pointer.
+    def setBackend(self, backend):
+        if backend not in ('numpy', 'c', 'numba'):
+            raise ValueError('Unknown backend: %s' % backend)
+        if backend != self.backend:
+            self.backend = backend
+            self.rates_determined = False
+        return self
+
+    ## Split the symbolic work of building the model (parsing the rates,
+    #  differentiating them and generating code) into chunks compiled by a
+    #  pool of worker processes (see Compiler). Only the phases run after
+    #  this call are affected.
+    #  @param self The object pointer.
+    #  @param workers Number of worker processes, None for the number of
+    #  CPUs, 1 to compile the chunks in this process.
+    #  @param chunk_size Number of Compositors or expressions per chunk.
+    #  @param progress Function progress(phase, done, total) or None.
+    #  @return The object pointer.
+    def enableParallelCompilation(self, workers=None, chunk_size=1000,
+                                  progress=None):
+        self.compiler = Compiler(workers, chunk_size, progress)
+        return self
+
+    ## Compile serially in this process again (the default).
+    #  @param self The object pointer.
+    #  @return The object pointer.
+    def disableParallelCompilation(self):
+        self.compiler = None
+        return self
+
+    ## Enable instrumentation (see Stats).
+    #  @param self The object pointer.
+    #  @param hook Function hook(event, name, value) called on every phase,
+    #  solver run and buffer allocation, or None.
+    #  @return The Stats object collecting the statistics.
+    def enableStats(self, hook=None):
+        self.stats = Stats(hook)
+        return self.stats
+
+    ## Disable instrumentation.
+    #  @param self The object pointer.
+    #  @return The Stats object collected so far or None.
+    def disableStats(self):
+        stats = self.stats
+        self.stats = None
+        return stats
+
+    ## Enable the cache of simulation results of run and run_pulses (see
+    #  ResultCache).
+    #  @param self The object pointer.
+    #  @param maxsize Maximum number of results kept in memory.
+    #  @param max_bytes Maximum total size of the results kept in memory.
+    #  @param directory Directory to store results in or None for memory
+    #  only.
+    #  @return The ResultCache.
+    def enableResultCache(self, maxsize=64, max_bytes=256 * 2 ** 20,
+                          directory=None):
+        self.result_cache = ResultCache(maxsize, max_bytes, directory)
+        return self.result_cache
+
+    ## Disable the cache of simulation results.
+    #  @param self The object pointer.
+    #  @return The ResultCache used so far or None.
+    def disableResultCache(self):
+        cache = self.result_cache
+        self.result_cache = None
+        return cache
+
+    ## Key of a simulation in the result cache: a hash of the structure of
+    #  the system, the Constant values, the current Compositor values, the
+    #  solver settings and the arguments of the simulation. Rates must be
+    #  determined.
+    #  @param self The object pointer.
+    #  @param kind Name of the simulation method.
+    #  @param arguments Arguments of the simulation.
+    #  @return Hexadecimal key string.
+    def result_key(self, kind, arguments):
+        return self.result_cache.key(
+            kind, arguments,
+            [k.name for k in self.compositors],
+            self.rate_structure(),
+            [c.name for c in self.constants],
+            np.array(self.constantValues(), dtype=float),
+            np.array([k.value for k in self.compositors], dtype=float),
+            [self.solver, self.use_jacobian, self.sparse_jacobian,
+             self.reduce, self.solver_options, self.backend])
+
+    ## Context manager timing a phase if instrumentation is enabled.
+    #  @param self The object pointer.
+    #  @param name Name of the phase.
+    #  @return Context manager.
+    def phase(self, name):
+        if self.stats is None:
+            return _no_timer
+        return self.stats.timer(name)
+
     ## Run a simulation of the Biosystem.
+    #
+    #  By default the values are reported on the fixed grid of time_points.
+    #  For long simulations the output can follow the dynamics instead:
+    #
+    #  @code
+    # # Points chosen by the solver, thinned to changes larger than 1e-3.
+    # result = sys.run([0, 1e6], output='steps', threshold=1e-3)
+    # # Values at the measurement times only.
+    # result = sys.run([0, 25], output=[0, 5, 10, 20])
+    #  @endcode
+    #
     #  @param self The object pointer.
     #  @param tspan Time interval to simulate, for example [t0, t1].
-    #  @return Tuple (T, Y), where T - time point list, Y - matrix consisting
-    #  of Compositor values at a time points.
-    def run(self, tspan):
+    #  @param output Output policy: 'grid' for the fixed grid, 'steps' for
+    #  the time points chosen by the solver (with the 'odeint' solver the
+    #  same LSODA method of solve_ivp is used), or a list of time points.
+    #  @param max_points Maximum number of reported time points or None.
+    #  @param threshold If not None keep only the time points where some
+    #  Compositor changed by more than @p threshold (see Result.decimate).
+    #  @return Result, which unpacks as the tuple (T, Y), where T - time
+    #  point list, Y - matrix consisting of Compositor values at a time
+    #  points.
+    #  @exception ValueError The output policy is unknown or the time
+    #  points are not sorted within @p tspan.
+    def run(self, tspan, output='grid', max_points=None, threshold=None):
         self.determine_rates()
+        key = None
+        if self.result_cache is not None:
+            with self.phase('results'):
+                key = self.result_key('run', [tspan, output, max_points,
+                                              threshold])
+                result = self.result_cache.get(key)
+            if result is not None:
+                return result
         y0 = []
         for c in self.compositors:
             y0.append(c.value)
+        if isinstance(output, str) and output == 'steps':
+            (t, y) = self.integrate_steps(y0, tspan)
+        else:
+            t = self.output_times(tspan, output)
+            if isinstance(output, str):
+                if max_points is not None and len(t) > max_points:
+                    t = np.linspace(tspan[0], tspan[1], max(max_points, 2))
+            if t[0] != tspan[0]:
+                # The solver has to start at the initial time.
+                y = self.integrate(y0, np.concatenate(([tspan[0]], t)))[1:]
+            else:
+                y = self.integrate(y0, t)
+        if self.stats is not None:
+            self.stats.add_buffer('run', y)
+        result = Result(t, y, [c.name for c in self.compositors])
+        if threshold is not None:
+            result = result.decimate(threshold)
+        if max_points is not None:
+            result = result.thin(max_points)
+        if key is not None:
+            self.result_cache.put(key, result)
+        return result
+
+    ## Run a simulation of the Biosystem together with the sensitivities of
+    #  the Compositor values to Constants.
+    #
+    #  The forward sensitivities s_k = dy/dp_k are integrated together with
+    #  the states as ds_k/dt = J s_k + df/dp_k, where J is the analytic
+    #  Jacobian and df/dp_k the analytic derivatives of the rates with
+    #  respect to the Constant p_k, so one integration replaces the
+    #  finite-difference runs with perturbed Constants. Initial values do
+    #  not depend on the Constants, so the sensitivities start at zero. The
+    #  solver is given the block diagonal part of the Jacobian of the
+    #  augmented system.
+    #
+    #  Example:
+    #
+    #  @code
+    # result = sys.run_sensitivities([0, 25], ['k'])
+    # dB_dk = result.sensitivities['k'][:, sys.compositorIndex('B')]
+    #  @endcode
+    #
+    #  @param self The object pointer.
+    #  @param tspan Time interval to simulate, for example [t0, t1].
+    #  @param constants Names of the Constants or None for all of them.
+    #  @param output 'grid' for the fixed grid of time_points or a list of
+    #  time points.
+    #  @return Result with the dictionary @p sensitivities of Constant names
+    #  and matrices dY/dp aligned with Y.
+    #  @exception ValueError The output policy is unknown or the time
+    #  points are not sorted within @p tspan.
+    def run_sensitivities(self, tspan, constants=None, output='grid'):
+        self.determine_jacobian()
+        self.determine_parameter_jacobian()
+        if constants is None:
+            constants = [c.name for c in self.constants]
+        selected = [self.map_constants[name] for name in constants]
+        n = len(self.compositors)
+        m = len(selected)
+        p = self.constantValues()
+        model = self.model
+        t = self.output_times(tspan, output)
+        start = t[0] != tspan[0]
+        if start:
+            t = np.concatenate(([tspan[0]], t))
+
+        # The augmented state is [y, s_1, ..., s_m].
+        def f(z, t):
+            y = z[:n]
+            sens = z[n:].reshape(m, n).T
+            J = model.jacobian(t, y, p, self.sparse_jacobian)
+            P = model.parameter_jacobian(t, y, p)[:, selected]
+            dz = np.empty(len(z))
+            dz[:n] = model.rhs(t, y, p)
+            dz[n:] = (J.dot(sens) + P).T.ravel()
+            return dz
+
+        def jac(z, t, sparse=False):
+            J = model.jacobian(t, z[:n], p, sparse)
+            if sparse:
+                from scipy.sparse import block_diag
+                return block_diag([J] * (m + 1), format='csc')
+            return np.kron(np.eye(m + 1), J)
+
+        z0 = np.zeros(n * (m + 1))
+        z0[:n] = [c.value for c in self.compositors]
+        if self.solver == 'odeint':
+            Dfun = jac if self.use_jacobian else None
+            z = self.call_odeint(f, z0, t, Dfun=Dfun, **self.solver_options)
+        else:
+            sol = self.call_solve_ivp(
+                (lambda t, z: f(z, t)), (t[0], t[-1]), z0, method=self.solver,
+                t_eval=t, jac=((lambda t, z: jac(z, t, self.sparse_jacobian))
+                               if self.use_jacobian else None),
+                **self.solver_options)
+            z = sol.y.T
+        if start:
+            (t, z) = (t[1:], z[1:])
+        sensitivities = {}
+        for k in range(0, m):
+            sensitivities[constants[k]] = z[:, (k + 1) * n:(k + 2) * n]
+        return Result(t, z[:, :n], [c.name for c in self.compositors],
+                      sensitivities)
+
+    ## Run stochastic simulations of the Biosystem.
+    #
+    #  The parts of the system are treated as reactions (see
+    #  reaction_network) and Compositor values as molecule counts (initial
+    #  values are rounded). Rates must be mass-action rates in count units;
+    #  the propensities of reactions of higher order in a reactant count
+    #  the ways to pick its molecules (see propensity_expressions and
+    #  RateKernel). See StochasticSimulator for the methods.
+    #
+    #  Example:
+    #
+    #  @code
+    # result = sys.run_stochastic([0, 25], 1000, seed=1)
+    # plt.plot(result.T, result['A'].mean(axis=0))
+    #  @endcode
+    #
+    #  @param self The object pointer.
+    #  @param tspan Time interval to simulate, for example [t0, t1].
+    #  @param n_trajectories Number of trajectories.
+    #  @param method 'ssa' (Gillespie's direct method, trajectories are
+    #  simulated together), 'nrm' (next reaction method, one trajectory at a
+    #  time, for large networks) or 'tau-leap'.
+    #  @param pulses List of Pulse objects applied during the simulation or
+    #  None.
+    #  @param tau Maximum leap length of 'tau-leap', by default the distance
+    #  of the reported time points.
+    #  @param seed Seed of the random number generator or None.
+    #  @return Result with T - time point list, Y - array of shape
+    #  (trajectories, time points, Compositors).
+    def run_stochastic(self, tspan, n_trajectories=1, method='ssa',
+                       pulses=None, tau=None, seed=None):
+        self.determine_rates()
+        T = self.time_points(tspan)
+        x0 = np.round([c.value for c in self.compositors])
+        events = []
+        for pulse in (pulses or []):
+            i = None
+            if pulse.compositor_name:
+                i = self.map_compositors[pulse.compositor_name]
+            for time in pulse.times(tspan[1]):
+                events.append((time, i, pulse.value, pulse.add))
+        events.sort(key=lambda e: e[0])
+        if method == 'nrm':
+            self.determine_reaction_functions()
+        else:
+            self.determine_propensities()
+        simulator = StochasticSimulator(
+            self.model, self.constantValues(), np.random.default_rng(seed))
+        if method == 'ssa':
+            Y = simulator.direct(x0, T, n_trajectories, events)
+        elif method == 'nrm':
+            Y = np.array([simulator.next_reaction(x0, T, events)
+                          for i in range(0, n_trajectories)])
+        elif method == 'tau-leap':
+            if tau is None:
+                tau = T[1] - T[0]
+            Y = simulator.tau_leap(x0, T, n_trajectories, tau, events)
+        else:
+            raise ValueError('Unknown stochastic method %s' % method)
+        return Result(T, Y, [c.name for c in self.compositors])
+
+    ## Find a steady state of the Biosystem.
+    #
+    #  Newton's method with a damped step is tried first, using the
+    #  compiled rates and analytic Jacobian. If it does not converge, e.g.
+    #  because the Jacobian is singular due to conserved quantities,
+    #  pseudo-transient continuation is used: implicit Euler steps
+    #  (I / dt - J) dy = f(y) with the step dt growing as the rates of
+    #  change fall. It follows the dynamics from the initial guess, so it
+    #  keeps conserved totals and finds the state a long simulation would
+    #  end in.
+    #
+    #  @param self The object pointer.
+    #  @param initial_guess Dictionary of Compositor names and values, list
+    #  of values of all Compositors or None for the current values.
+    #  @param tol Convergence tolerance of the largest rate of change.
+    #  @param max_iter Maximum number of Newton iterations.
+    #  @param max_steps Maximum number of continuation steps.
+    #  @return Array of steady-state Compositor values.
+    def steady_state(self, initial_guess=None, tol=1e-10, max_iter=50,
+                     max_steps=10000):
+        from scipy.sparse import identity
+        from scipy.sparse.linalg import spsolve
+        self.determine_jacobian()
+        y = np.array([c.value for c in self.compositors], dtype=float)
+        if isinstance(initial_guess, dict):
+            for (name, value) in initial_guess.items():
+                y[self.map_compositors[name]] = value
+        elif initial_guess is not None:
+            y = np.array(initial_guess, dtype=float)
+        p = self.constantValues()
+        sparse = len(y) > 500
+        f = (lambda y: self.model.rhs(0.0, y, p))
+        jac = (lambda y: self.model.jacobian(0.0, y, p, sparse))
+        solve = spsolve if sparse else np.linalg.solve
+
+        # Newton's method with step halving. Conserved totals make the
+        # Jacobian singular, so one equation per conservation law is
+        # replaced by the law itself, keeping the totals of the guess.
+        (independent, rows, L) = self.model.reduction()
+        totals = L.dot(y)
+
+        def F(x):
+            fx = f(x)
+            fx[rows] = L.dot(x) - totals
+            return fx
+
+        def JF(x):
+            J = jac(x)
+            if sparse:
+                J = J.tolil()
+            J[rows, :] = L
+            return J.tocsc() if sparse else J
+
+        x = y.copy()
+        fx = F(x)
+        try:
+            for i in range(0, max_iter):
+                if np.max(np.abs(fx), initial=0.0) < tol:
+                    return x
+                dx = solve(JF(x), -fx)
+                if not np.all(np.isfinite(dx)):
+                    break
+                step = 1.0
+                while step > 1e-4:
+                    x_new = x + step * dx
+                    f_new = F(x_new)
+                    if np.linalg.norm(f_new) < np.linalg.norm(fx):
+                        break
+                    step = step / 2
+                else:
+                    break
+                (x, fx) = (x_new, f_new)
+        except (np.linalg.LinAlgError, RuntimeError):
+            pass
+
+        # Pseudo-transient continuation from the initial guess.
+        x = y
+        fx = f(x)
+        dt = 1e-3
+        I = identity(len(x), format='csc') if sparse else np.eye(len(x))
+        for i in range(0, max_steps):
+            if np.max(np.abs(fx), initial=0.0) < tol:
+                return x
+            norm = np.linalg.norm(fx)
+            x_new = x + solve(I / dt - jac(x), fx)
+            f_new = f(x_new)
+            if not np.all(np.isfinite(f_new)):
+                dt = dt / 10
+                continue
+            norm_new = np.linalg.norm(f_new)
+            (x, fx) = (x_new, f_new)
+            # Switched evolution relaxation: grow dt as the residual falls,
+            # at least geometrically, and shrink it when the residual grows.
+            if norm_new < norm:
+                dt = min(dt * max(norm / max(norm_new, 1e-300), 2.0), 1e12)
+            else:
+                dt = max(dt / 2, 1e-12)
+        raise RuntimeError('Steady state not found')
+
+    ## Compute steady states for a series of values of a Constant.
+    #
+    #  Every steady state is searched for starting from the previous one,
+    #  so following a branch of steady states needs only a few iterations
+    #  per value. Points where no steady state is found are NaN.
+    #
+    #  Example (a dose-response curve):
+    #
+    #  @code
+    # doses = np.logspace(-3, 1, 200)
+    # Y = sys.bifurcation_scan('k', doses)
+    # plt.semilogx(doses, Y[:, sys.compositorIndex('B')])
+    #  @endcode
+    #
+    #  @param self The object pointer.
+    #  @param const_name Name of the Constant.
+    #  @param values Values of the Constant.
+    #  @param initial_guess Initial guess for the first value (see
+    #  steady_state).
+    #  @return Array of steady states, one row per value.
+    def bifurcation_scan(self, const_name, values, initial_guess=None):
+        constant = self.constants[self.map_constants[const_name]]
+        old_value = constant.value
+        states = np.full((len(values), len(self.compositors)), np.nan)
+        guess = initial_guess
+        try:
+            for i in range(0, len(values)):
+                constant.value = values[i]
+                try:
+                    states[i] = self.steady_state(guess)
+                except RuntimeError:
+                    continue
+                guess = states[i]
+        finally:
+            constant.value = old_value
+        return states
+
+    ## Run a simulation yielding the results chunk by chunk.
+    #
+    #  Only one chunk is kept in memory at a time, so simulations whose
+    #  results do not fit in memory can be run. The chunks can be written
+    #  to a TrajectoryStore and analysed later without loading them:
+    #
+    #  @code
+    # for chunk in sys.run_stream([0, 1e7], store='run1'):
+    #     print(chunk.T[-1])
+    # (T, Y) = load_trajectory('run1')   # memory-mapped arrays
+    # Y[sys.time_to_index(T, 5e6), sys.compositorIndex('A')]
+    #  @endcode
+    #
+    #  Pulsed simulations are streamed by run_pulses_stream.
+    #
+    #  @param self The object pointer.
+    #  @param tspan Time interval to simulate, for example [t0, t1].
+    #  @param chunk_points Number of time points in a chunk.
+    #  @param output Output policy: 'grid' for the fixed grid of
+    #  time_points (the solver is restarted at every chunk) or 'steps' for
+    #  the time points chosen by the solver.
+    #  @param store TrajectoryStore to append the chunks to, a directory to
+    #  create one in (closed at the end) or None.
+    #  @return Generator of Result chunks.
+    #  @exception ValueError The output policy is unknown.
+    def run_stream(self, tspan, chunk_points=10000, output='grid',
+                   store=None):
+        if output not in ('grid', 'steps'):
+            raise ValueError('Unknown output policy: %r' % (output,))
+        self.determine_rates()
+        y = np.array([c.value for c in self.compositors], dtype=float)
+        if output == 'steps':
+            chunks = self.step_chunks(y, tspan, chunk_points)
+        else:
+            chunks = self.grid_chunks(y, tspan, chunk_points)
+        yield from self.stream(chunks, store)
+
+    ## Run a pulsed simulation (see run_pulses) yielding the results chunk
+    #  by chunk, like run_stream. The values at the pulse times are the
+    #  values after the pulses, as in run_pulses; results are not cached.
+    #  @param self The object pointer.
+    #  @param pulse_series List of pulse objects.
+    #  @param chunk_points Number of time points of the grid in a chunk; the
+    #  pulse times within the chunk are added to them.
+    #  @param store TrajectoryStore to append the chunks to, a directory to
+    #  create one in (closed at the end) or None.
+    #  @return Generator of Result chunks.
+    def run_pulses_stream(self, pulse_series, chunk_points=10000,
+                          store=None):
+        self.determine_rates()
+        y = np.array([c.value for c in self.compositors], dtype=float)
+        chunks = self.pulse_chunks(y, pulse_series, chunk_points)
+        yield from self.stream(chunks, store)
+
+    ## Wrap chunks of results and append them to a store.
+    #  @param self The object pointer.
+    #  @param chunks Generator of (T, Y) chunks.
+    #  @param store TrajectoryStore, a directory to create one in (closed at
+    #  the end) or None.
+    #  @return Generator of Result chunks.
+    def stream(self, chunks, store):
+        names = [c.name for c in self.compositors]
+        owned = isinstance(store, str)
+        if owned:
+            store = TrajectoryStore(store, names)
+        try:
+            for (T, Y) in chunks:
+                if store is not None:
+                    store.append(T, Y)
+                yield Result(T, Y, names)
+        finally:
+            if owned:
+                store.close()
+
+    ## Integrate the system on the grid of time_points chunk by chunk.
+    #  @param self The object pointer.
+    #  @param y Initial Compositor values.
+    #  @param tspan Time interval to simulate, for example [t0, t1].
+    #  @param chunk_points Number of time points in a chunk.
+    #  @return Generator of (T, Y) chunks.
+    def grid_chunks(self, y, tspan, chunk_points):
+        points = max(int(tspan[1] - tspan[0]) * 17, 1000)
+        step = (tspan[1] - tspan[0]) / float(points - 1)
+        for first in range(0, points, chunk_points):
+            last = min(first + chunk_points, points)
+            T = tspan[0] + np.arange(first, last) * step
+            if last == points:
+                T[-1] = tspan[1]
+            if first == 0:
+                Y = self.integrate(y, T)
+            else:
+                Y = self.integrate(y, np.concatenate(([t], T)))[1:]
+            (t, y) = (T[-1], Y[-1])
+            yield (T, Y)
+
+    ## Integrate a pulsed simulation on the grid of time_points and the
+    #  pulse times chunk by chunk.
+    #  @param self The object pointer.
+    #  @param y Initial Compositor values.
+    #  @param pulse_series List of pulse objects, see run_pulses.
+    #  @param chunk_points Number of time points of the grid in a chunk.
+    #  @return Generator of (T, Y) chunks.
+    def pulse_chunks(self, y, pulse_series, chunk_points):
+        (start, stop, pulses, events) = self.pulse_events(pulse_series)
+        if stop <= start:
+            return
+        event_times = np.array([e[0] for e in events], dtype=float)
+        points = max(int(stop - start) * 17, 1000)
+        step = (stop - start) / float(points - 1)
+        k = 0
+        t = None
+        for first in range(0, points, chunk_points):
+            last = min(first + chunk_points, points)
+            T = start + np.arange(first, last) * step
+            upper = start + last * step
+            if last == points:
+                T[-1] = stop
+                upper = np.inf
+            T = np.union1d(T, event_times[(event_times > start) &
+                                          (event_times >= T[0]) &
+                                          (event_times < upper)])
+            Y = np.empty((len(T), len(y)))
+            if t is None:
+                # The values at the start are reported after its pulses.
+                k = self.apply_pulses(y, pulses, events, k, T[0])
+                Y[0] = y
+                (times, offset) = (T, 0)
+            else:
+                (times, offset) = (np.concatenate(([t], T)), 1)
+            i = 0
+            while i < len(times) - 1:
+                if k < len(events) and events[k][0] <= times[-1]:
+                    j = int(np.searchsorted(times, events[k][0]))
+                else:
+                    j = len(times) - 1
+                Y_sim = self.integrate(y, times[i:j + 1])
+                y = np.array(Y_sim[-1])
+                k = self.apply_pulses(y, pulses, events, k, times[j])
+                Y[i + 1 - offset:j + 1 - offset] = Y_sim[1:]
+                Y[j - offset] = y
+                i = j
+            t = T[-1]
+            yield (T, Y)
+
+    ## Integrate the system chunk by chunk reporting the time points chosen
+    #  by the solver.
+    #  @param self The object pointer.
+    #  @param y Initial Compositor values.
+    #  @param tspan Time interval to simulate, for example [t0, t1].
+    #  @param chunk_points Number of time points in a chunk.
+    #  @return Generator of (T, Y) chunks.
+    def step_chunks(self, y, tspan, chunk_points):
+        import scipy.integrate
+        p = self.constantValues()
+        method = self.solver
+        if method == 'odeint':
+            method = 'LSODA'
+        options = dict(self.solver_options)
+        options.pop('full_output', None)
+        use_jacobian = self.use_jacobian and method in ('BDF', 'Radau',
+                                                        'LSODA')
+        if use_jacobian:
+            self.determine_jacobian()
+        (f, jac, x0, expand) = self.reduced_system(y, p,
+                                                   self.sparse_jacobian)
+        if len(x0) == 0:
+            yield (np.array([tspan[0], tspan[1]], dtype=float),
+                   expand(np.zeros((2, 0))))
+            return
+        if use_jacobian:
+            options['jac'] = jac
+        if self.stats is not None:
+            f = self.stats.counted('rhs', f)
+            if 'jac' in options:
+                options['jac'] = self.stats.counted('jacobian',
+                                                    options['jac'])
+        solver = getattr(scipy.integrate, method)(f, tspan[0], x0, tspan[1],
+                                                  **options)
+        T = np.empty(chunk_points)
+        X = np.empty((chunk_points, len(x0)))
+        (T[0], X[0]) = (tspan[0], x0)
+        k = 1
+        # Time spent in the solver, recorded per chunk without the time the
+        # consumer of the chunks takes.
+        elapsed = 0.0
+        while solver.status == 'running':
+            started = time.perf_counter()
+            message = solver.step()
+            elapsed = elapsed + time.perf_counter() - started
+            if solver.status == 'failed':
+                raise RuntimeError(message)
+            (T[k], X[k]) = (solver.t, solver.y)
+            k = k + 1
+            if k == chunk_points:
+                if self.stats is not None:
+                    self.stats.add_time('integrate', elapsed)
+                elapsed = 0.0
+                yield (T.copy(), expand(X.copy()))
+                k = 0
+        if self.stats is not None and elapsed > 0.0:
+            self.stats.add_time('integrate', elapsed)
+        if k > 0:
+            yield (T[:k].copy(), expand(X[:k].copy()))
+        if self.stats is not None:
+            self.stats.add_solver(method, {'nfev': solver.nfev,
+                                           'njev': solver.njev,
+                                           'nlu': solver.nlu})
+
+    ## Time points to report for an output policy.
+    #  @param self The object pointer.
+    #  @param tspan Time interval to simulate, for example [t0, t1].
+    #  @param output 'grid' for the fixed grid of time_points or a list of
+    #  time points.
+    #  @return Array of time points.
+    #  @exception ValueError The output policy is unknown or the time
+    #  points are not sorted within @p tspan.
+    def output_times(self, tspan, output):
+        if isinstance(output, str):
+            if output != 'grid':
+                raise ValueError('Unknown output policy: %r' % (output,))
+            return self.time_points(tspan)
+        t = np.asarray(output, dtype=float)
+        if t.ndim != 1 or len(t) == 0:
+            raise ValueError('Output time points must be a nonempty list')
+        if np.any(np.diff(t) < 0):
+            raise ValueError('Output time points must be sorted')
+        if t[0] < tspan[0] or t[-1] > tspan[1]:
+            raise ValueError('Output time points must lie within %r'
+                             % (list(tspan),))
+        return t
+
+    ## Time points reported by a simulation.
+    #  @param self The object pointer.
+    #  @param tspan Time interval to simulate, for example [t0, t1].
+    #  @return Array of equally spaced time points.
+    def time_points(self, tspan):
         delta = max(int(tspan[1] - tspan[0]) * 17, 1000);
-        t = np.linspace(tspan[0], tspan[1], delta)
-        y = odeint(self.sys_ode, y0, t)
-        return (t, y)
+        return np.linspace(tspan[0], tspan[1], delta)
+
+    ## Run a simulation with some initial and Constant values replaced.
+    #  The values of the system are restored afterwards and nothing is
+    #  recompiled.
+    #  @param self The object pointer.
+    #  @param tspan Time interval to simulate, for example [t0, t1].
+    #  @param initial_values Dictionary of Compositor names and initial
+    #  values, list of initial values of all Compositors or None.
+    #  @param constants Dictionary of Constant names and values or None.
+    #  @return Result as returned by run.
+    def run_with(self, tspan, initial_values=None, constants=None):
+        with self.replaced_values(initial_values, constants):
+            return self.run(tspan)
+
+    ## Context manager replacing some initial and Constant values, which
+    #  are restored on exit.
+    #  @param self The object pointer.
+    #  @param initial_values Dictionary of Compositor names and initial
+    #  values, list of initial values of all Compositors or None.
+    #  @param constants Dictionary of Constant names and values or None.
+    #  @return Context manager.
+    @contextlib.contextmanager
+    def replaced_values(self, initial_values=None, constants=None):
+        values = [c.value for c in self.compositors]
+        constant_values = self.constantValues()
+        try:
+            if isinstance(initial_values, dict):
+                for (name, value) in initial_values.items():
+                    self.compositors[self.map_compositors[name]].value = value
+            elif initial_values is not None:
+                for (c, value) in zip(self.compositors, initial_values):
+                    c.value = value
+            if constants is not None:
+                for (name, value) in constants.items():
+                    self.constants[self.map_constants[name]].value = value
+            yield self
+        finally:
+            for (c, value) in zip(self.compositors, values):
+                c.value = value
+            for (c, value) in zip(self.constants, constant_values):
+                c.value = value
+
+    ## Run an ensemble of simulations in parallel processes.
+    #
+    #  The system is compiled once here and sent once to every worker
+    #  process, which then runs its share of the members. Every member is
+    #  a run_with call, so @p initial_values_list and @p constants_list
+    #  entries may change any subset of the values.
+    #
+    #  Example:
+    #
+    #  @code
+    # ks = np.random.lognormal(np.log(0.05), 0.3, 10000)
+    # runs = sys.run_ensemble([0, 25], None, [{'k': k} for k in ks], workers=32)
+    #  @endcode
+    #
+    #  @param self The object pointer.
+    #  @param tspan Time interval to simulate, for example [t0, t1].
+    #  @param initial_values_list List of initial values (see run_with) for
+    #  each member or None.
+    #  @param constants_list List of Constant values (see run_with) for each
+    #  member or None.
+    #  @param workers Number of worker processes, None for the number of
+    #  CPUs. With 1 the members are run in this process.
+    #  @return List of Results, one for each member.
+    def run_ensemble(self, tspan, initial_values_list=None,
+                     constants_list=None, workers=None):
+        if initial_values_list is None and constants_list is None:
+            raise ValueError('No ensemble members given')
+        if initial_values_list is None:
+            initial_values_list = [None] * len(constants_list)
+        if constants_list is None:
+            constants_list = [None] * len(initial_values_list)
+        if len(initial_values_list) != len(constants_list):
+            raise ValueError('Ensemble member lists differ in length')
+        self.determine_rates()
+        if self.use_jacobian:
+            self.determine_jacobian()
+        members = list(zip(initial_values_list, constants_list))
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers == 1:
+            return [self.run_with(tspan, i, c) for (i, c) in members]
+        chunksize = max(1, len(members) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_ensemble_init,
+                                 initargs=(self,)) as executor:
+            return list(executor.map(_ensemble_run,
+                                     [tspan] * len(members), members,
+                                     chunksize=chunksize))
+
+    ## Fit Constant values to measured Compositor traces.
+    #
+    #  The weighted squared differences of the simulated and the measured
+    #  values at the measurement times are minimized with
+    #  scipy.optimize.least_squares, using the analytic derivatives from the
+    #  sensitivity equations (see FitProblem). With several starts the
+    #  first one is the current Constant values and the others are drawn
+    #  within the bounds (log-uniformly for positive bounds spanning more
+    #  than a decade), and the starts run in parallel worker processes.
+    #  The Constants are set to the best fit found.
+    #
+    #  Example:
+    #
+    #  @code
+    # data = {'B': (times, values, errors)}
+    # fit = sys.fit(data, ['k', 'kd'], ([0, 0], [1, 10]), starts=16)
+    # print(fit.constants, fit.cost)
+    #  @endcode
+    #
+    #  @param self The object pointer.
+    #  @param data Dictionary of Compositor names and tuples (times, values)
+    #  or (times, values, errors) of measurements.
+    #  @param constants Names of the Constants to fit.
+    #  @param bounds Tuple (lower, upper) of bound lists or None.
+    #  @param starts Number of starting points.
+    #  @param workers Number of worker processes, None for the number of
+    #  CPUs. With 1 the starts are run in this process.
+    #  @param seed Seed of the random number generator drawing the starts.
+    #  @param t0 Initial time of the simulations.
+    #  @param gradient If True use the analytic derivatives, else finite
+    #  differences.
+    #  @param options Extra keyword arguments of
+    #  scipy.optimize.least_squares.
+    #  @return scipy.optimize.OptimizeResult of the best start with the
+    #  extra fields constants (dictionary of fitted values) and starts (list
+    #  of the results of all the starts).
+    def fit(self, data, constants, bounds=None, starts=1, workers=None,
+            seed=None, t0=0.0, gradient=True, **options):
+        self.determine_jacobian()
+        if gradient:
+            self.determine_parameter_jacobian()
+        n = len(constants)
+        if bounds is None:
+            bounds = (np.full(n, -np.inf), np.full(n, np.inf))
+        lower = np.broadcast_to(np.asarray(bounds[0], dtype=float), (n,))
+        upper = np.broadcast_to(np.asarray(bounds[1], dtype=float), (n,))
+        x0 = np.array([self.constants[self.map_constants[name]].value
+                       for name in constants], dtype=float)
+        rng = np.random.default_rng(seed)
+        x0_list = [np.clip(x0, lower, upper)]
+        for i in range(1, starts):
+            x0_list.append(_random_start(x0, lower, upper, rng))
+        problem = FitProblem(self, data, constants, t0, gradient)
+        old_values = self.constantValues()
+        if workers is None:
+            workers = min(os.cpu_count() or 1, starts)
+        try:
+            if workers == 1:
+                results = []
+                for x in x0_list:
+                    results.append(_fit_start(problem, x, lower, upper,
+                                              options))
+            else:
+                with ProcessPoolExecutor(max_workers=workers,
+                                         initializer=_fit_init,
+                                         initargs=(problem,)) as executor:
+                    results = list(executor.map(
+                        _fit_run, x0_list, [(lower, upper)] * starts,
+                        [options] * starts))
+        finally:
+            for (c, value) in zip(self.constants, old_values):
+                c.value = value
+        found = [r for r in results if r is not None]
+        if not found:
+            raise RuntimeError('No fit converged')
+        best = min(found, key=lambda r: r.cost)
+        best.starts = results
+        best.constants = dict(zip(constants, [float(x) for x in best.x]))
+        for (name, value) in best.constants.items():
+            self.changeConstantValue(name, value)
+        return best
+
+    ## Integrate the system reporting the time points chosen by the solver.
+    #  @param self The object pointer.
+    #  @param y0 Initial Compositor values.
+    #  @param tspan Time interval to simulate, for example [t0, t1].
+    #  @return Tuple (t, y) of solver time points and Compositor values.
+    def integrate_steps(self, y0, tspan):
+        p = self.constantValues()
+        method = self.solver
+        if method == 'odeint':
+            method = 'LSODA'
+        if self.use_jacobian:
+            self.determine_jacobian()
+        (f, jac, x0, expand) = self.reduced_system(y0, p,
+                                                   self.sparse_jacobian)
+        if len(x0) == 0:
+            return (np.array([tspan[0], tspan[1]], dtype=float),
+                    expand(np.zeros((2, 0))))
+        if not self.use_jacobian:
+            jac = None
+        sol = self.call_solve_ivp(f, (tspan[0], tspan[1]), x0,
+                                  method=method, jac=jac,
+                                  **self.solver_options)
+        return (sol.t, expand(sol.y.T))
+
+    ## Integrate the system with the selected solver.
+    #  @param self The object pointer.
+    #  @param y0 Initial Compositor values.
+    #  @param t Time points to report, t[0] is the initial time.
+    #  @return Matrix of Compositor values at the time points @p t.
+    def integrate(self, y0, t):
+        p = self.constantValues()
+        if self.use_jacobian:
+            self.determine_jacobian()
+        sparse = self.sparse_jacobian and self.solver != 'odeint'
+        (f, jac, x0, expand) = self.reduced_system(y0, p, sparse)
+        if len(x0) == 0:
+            return expand(np.zeros((len(t), 0)))
+        if self.solver == 'odeint':
+            Dfun = None
+            if self.use_jacobian:
+                Dfun = (lambda x, t: jac(t, x))
+            return expand(self.call_odeint((lambda x, t: f(t, x)), x0, t,
+                                           Dfun=Dfun, **self.solver_options))
+        if not self.use_jacobian:
+            jac = None
+        sol = self.call_solve_ivp(f, (t[0], t[-1]), x0, method=self.solver,
+                                  t_eval=t, jac=jac, **self.solver_options)
+        return expand(sol.y.T)
+
+    ## The system reduced by its conservation laws.
+    #
+    #  Weighted sums of Compositors conserved by the reaction network (see
+    #  CompiledModel.conservation_laws), like the total of free and bound
+    #  enzyme, fix one dependent Compositor per law. Only the independent
+    #  Compositors x are integrated; the dependent ones are computed from
+    #  them and the totals of the initial values, which keeps the totals
+    #  exact and makes the Jacobian smaller and better conditioned. Its
+    #  reduced form is J_II - J_ID M_I, with the laws y_D + M_I x = const
+    #  (see CompiledModel.reduction).
+    #
+    #  Without conservation laws, or if the reduction is disabled (see
+    #  setSolver), x is the full state.
+    #
+    #  @param self The object pointer.
+    #  @param y0 Initial Compositor values.
+    #  @param p Constant values.
+    #  @param sparse If True the Jacobian is a scipy.sparse matrix.
+    #  @return Tuple (f, jac, x0, expand) of the right-hand side f(t, x),
+    #  the Jacobian jac(t, x) (available after determine_jacobian), the
+    #  initial independent values and the function expand(X) returning the
+    #  values of all Compositors for the independent values X (one row per
+    #  time point or a single row).
+    def reduced_system(self, y0, p, sparse=False):
+        model = self.model
+        dependent = []
+        if self.reduce:
+            (independent, dependent, M) = model.reduction()
+        if len(dependent) == 0:
+            return ((lambda t, y: model.rhs(t, y, p)),
+                    (lambda t, y: model.jacobian(t, y, p, sparse)),
+                    np.asarray(y0, dtype=float), (lambda Y: Y))
+        from scipy.sparse import csr_matrix
+        y0 = np.asarray(y0, dtype=float)
+        n = len(y0)
+        totals = M.dot(y0)
+        M_I = M[:, independent]
+        # The reduced Jacobian is J[I] Q with Q = dy/dx, which has ones at
+        # the independent Compositors and -M_I at the dependent ones.
+        entries = csr_matrix(M_I).tocoo()
+        Q = csr_matrix((np.concatenate((np.ones(len(independent)),
+                                        -entries.data)),
+                        (np.concatenate((independent,
+                                         dependent[entries.row])),
+                         np.concatenate((np.arange(len(independent)),
+                                         entries.col)))),
+                       shape=(n, len(independent)))
+        if M_I.size > 10000:
+            M_I = csr_matrix(M_I)
+        QT = Q.T.tocsr()
+
+        def full(x):
+            y = np.empty(n)
+            y[independent] = x
+            y[dependent] = totals - M_I.dot(x)
+            return y
+
+        def f(t, x):
+            return model.rhs(t, full(x), p)[independent]
+
+        def jac(t, x):
+            J = model.jacobian(t, full(x), p, sparse)
+            if sparse:
+                return J.tocsr()[independent].dot(Q).tocsc()
+            return QT.dot(J[independent].T).T
+
+        def expand(X):
+            Y = np.empty(X.shape[:-1] + (n,))
+            Y[..., independent] = X
+            Y[..., dependent] = totals - M_I.dot(X.T).T
+            return Y
+
+        return (f, jac, y0[independent], expand)
+
+    ## Call scipy.integrate.odeint, collecting statistics if enabled.
+    #  @param self The object pointer.
+    #  @param f Right-hand side f(y, t, ...).
+    #  @param y0 Initial values.
+    #  @param t Time points.
+    #  @param options Keyword arguments of odeint. The values are always
+    #  returned alone: full_output is ignored, the information of odeint
+    #  goes to the statistics.
+    #  @return Matrix of values at the time points @p t.
+    def call_odeint(self, f, y0, t, **options):
+        from scipy.integrate import odeint
+        options.pop('full_output', None)
+        if self.stats is None:
+            return odeint(f, y0, t, **options)
+        f = self.stats.counted('rhs', f)
+        options['Dfun'] = self.stats.counted('jacobian', options.get('Dfun'))
+        with self.stats.timer('integrate'):
+            (y, info) = odeint(f, y0, t, full_output=True, **options)
+        self.stats.add_solver('odeint', info)
+        return y
+
+    ## Call scipy.integrate.solve_ivp, collecting statistics if enabled.
+    #  @param self The object pointer.
+    #  @param f Right-hand side f(t, y).
+    #  @param t_span Time interval.
+    #  @param y0 Initial values.
+    #  @param options Keyword arguments of solve_ivp; the odeint option
+    #  full_output is ignored.
+    #  @return Solution object of solve_ivp.
+    #  @exception RuntimeError The solver failed.
+    def call_solve_ivp(self, f, t_span, y0, **options):
+        from scipy.integrate import solve_ivp
+        options.pop('full_output', None)
+        if self.stats is None:
+            sol = solve_ivp(f, t_span, y0, **options)
+        else:
+            f = self.stats.counted('rhs', f)
+            options['jac'] = self.stats.counted('jacobian',
+                                                options.get('jac'))
+            with self.stats.timer('integrate'):
+                sol = solve_ivp(f, t_span, y0, **options)
+            self.stats.add_solver(options.get('method', 'RK45'),
+                                  {'nfev': sol.nfev, 'njev': sol.njev,
+                                   'nlu': sol.nlu})
+        if not sol.success:
+            raise RuntimeError(sol.message)
+        return sol
+
+    ## Jacobian of the ordinary diferential equatation of the system.
+    #  @param self The object pointer.
+    #  @param y System compositors values.
+    #  @param t Time point.
+    #  @param p Constant values, current values if None.
+    #  @return Matrix of partial derivatives d(dy_i/dt)/dy_j.
+    def sys_jac(self, y, t, p=None):
+        self.determine_jacobian()
+        if p is None:
+            p = self.constantValues()
+        return self.model.jacobian(t, y, p, self.sparse_jacobian)
 
     ## Ordinary diferential equatation of the system.
     #  @param self The object pointer.
     #  @param y System compositors values.
     #  @param t Time point.
+    #  @param p Constant values, current values if None.
     #  @return change of Compositor values.
-    def sys_ode(self, y, t):
-        dy = np.zeros(len(y))
+    def sys_ode(self, y, t, p=None):
+        if p is None:
+            p = self.constantValues()
+        return self.model.rhs(t, y, p)
 
-        for i in range(0, len(self.compositors)):
-            k = self.compositors[i]
-            arg = [t] + list(y) # Add time component to y
-            dy[i] = k.ratef(*arg) # list as arguments for function
-        return dy
+    ## Simulate the Biosystem for many sets of Constant (or initial
+    #  Compositor) values at once.
+    #
+    #  All the sets are integrated together as one stacked system using the
+    #  compiled rates vectorized over the sets, so nothing is recompiled
+    #  between them. Names not listed in @p values keep their current
+    #  values. The analytic Jacobian of the stacked system is block
+    #  diagonal; 'odeint' gets it banded, the solve_ivp solvers as a sparse
+    #  matrix (without the analytic Jacobian, 'odeint' estimates the blocks
+    #  by finite differences).
+    #
+    #  The sets share one step size and one error control, so the steps
+    #  follow the hardest set, and the result of a set depends (within the
+    #  tolerances) on the other sets swept with it: it differs from run,
+    #  which also integrates the system reduced by its conservation laws,
+    #  by up to about the solver tolerances. Where every set has to be
+    #  reproducible on its own, use run_with or run_ensemble.
+    #
+    #  Example:
+    #
+    #  @code
+    # (T, Y) = sys.sweep([0, 25], {'k': np.linspace(0.01, 0.1, 1000)})
+    # # Y[i, :, sys.compositorIndex('B')] is the B trace for the i-th k.
+    #  @endcode
+    #
+    #  @param self The object pointer.
+    #  @param tspan Time interval to simulate, for example [t0, t1].
+    #  @param values Dictionary of Constant or Compositor names and arrays
+    #  of values. Arrays are broadcast against each other.
+    #  @return Tuple (T, Y), where T - time point list, Y - array of shape
+    #  (number of sets, number of time points, number of Compositors).
+    def sweep(self, tspan, values):
+        self.determine_rates()
+        names = list(values.keys())
+        columns = np.broadcast_arrays(
+            *[np.ravel(np.asarray(values[n], dtype=float)) for n in names])
+        batch = len(columns[0])
+        n = len(self.compositors)
+        p = self.constantValues()
+        Y0 = np.empty((n, batch))
+        for i in range(0, n):
+            Y0[i] = self.compositors[i].value
+        for (name, column) in zip(names, columns):
+            if name in self.map_constants:
+                p[self.map_constants[name]] = column
+            elif name in self.map_compositors:
+                Y0[self.map_compositors[name]] = column
+            else:
+                raise KeyError(name)
+        t = self.time_points(tspan)
+
+        # The stacked state is flattened set by set: y[b * n + i] is the
+        # Compositor i of the set b.
+        def f(y, t):
+            return self.model.rhs_batch(t, y.reshape(batch, n).T, p).T.ravel()
+
+        y0 = Y0.T.ravel()
+        if self.solver == 'odeint':
+            Dfun = None
+            if self.use_jacobian:
+                self.determine_jacobian()
+
+                # The block diagonal Jacobian in the banded form of odeint:
+                # band[mu + i - j, j] is the derivative of y[i] by y[j].
+                def Dfun(y, t):
+                    J = self.model.jacobian_batch(
+                        t, y.reshape(batch, n).T, p).tocoo()
+                    band = np.zeros((2 * n - 1, n * batch))
+                    band[n - 1 + J.row - J.col, J.col] = J.data
+                    return band
+            y = self.call_odeint(f, y0, t, Dfun=Dfun, ml=n - 1, mu=n - 1,
+                                 **self.solver_options)
+        else:
+            jac = None
+            if self.use_jacobian:
+                self.determine_jacobian()
+                jac = (lambda t, y: self.model.jacobian_batch(
+                    t, y.reshape(batch, n).T, p))
+            sol = self.call_solve_ivp((lambda t, y: f(y, t)), (t[0], t[-1]),
+                                      y0, method=self.solver, t_eval=t,
+                                      jac=jac, **self.solver_options)
+            y = sol.y.T
+        return (t, y.reshape(len(t), batch, n).transpose(1, 0, 2))
 
     ## Run simulation given pulse list. Last pulse is not simulated.
     #  Each pulse defines time, Compositor, Compositor value to set at
@@ -244,9 +1976,17 @@ class BioSystem:
     #  there is next Pulse - action repeats.
     #
     #  First Pulse should start at t = 0 time.
-    #  Each next Pulse time should be greater than previous.
     #  Last Pulse is not simulated - it is a stop time.
     #
+    #  The other pulses may come in any order; periodic pulses are repeated
+    #  up to the stop time and pulses at the same time are all applied, in
+    #  list order, before the simulation continues. The solver is restarted
+    #  only at pulse times and the results are written to arrays allocated
+    #  once, so long dosing protocols take time and memory linear in their
+    #  length.
+    #  The reported time points are those of run over the whole simulation
+    #  plus every pulse time, where the values after the pulse are reported.
+    #
     #  Example:
     #
     #  @code
@@ -305,60 +2045,112 @@ class BioSystem:
     #
     #  @param self The object pointer.
     #  @param pulse_series List of pulse objects.
-    #  @return Tuple (T, Y), where T - time point list, Y - matrix consisting
-    #  of Compositor values at a time points.
+    #  @return Result, which unpacks as the tuple (T, Y), where T - time
+    #  point list, Y - matrix consisting of Compositor values at a time
+    #  points.
 
     def run_pulses(self, pulse_series):
-        num_pulses = len(pulse_series)
-
-        T = []
-        Y = []
-
-        prev_start = 0
-        prev_end = 0
-
-        for i in range(0, num_pulses - 1):
-            pulse = pulse_series[i]
-            if pulse.compositor_name:
-                self.compositors[self.map_compositors[pulse.compositor_name]].value = pulse.value
-
-            sim_length = pulse_series[i+1].time - pulse.time
-            tspan = [prev_end, prev_end + sim_length]
-            (T_sim, Y_sim) = self.run(tspan)
-
+        self.determine_rates()
+        key = None
+        if self.result_cache is not None:
+            with self.phase('results'):
+                key = self.result_key('run_pulses', [
+                    (p.time, p.compositor_name, p.value, p.period, p.count,
+                     p.add) for p in pulse_series])
+                result = self.result_cache.get(key)
+            if result is not None:
+                return result
+        started = time.perf_counter()
+        (start, stop, pulses, events) = self.pulse_events(pulse_series)
+        n = len(self.compositors)
+        if stop <= start:
+            return Result(np.zeros(0), np.zeros((0, n)),
+                          [c.name for c in self.compositors])
+        event_times = np.array([e[0] for e in events], dtype=float)
+        T = np.union1d(self.time_points([start, stop]),
+                       event_times[event_times > start])
+        Y = np.empty((len(T), n))
+        y = np.array([c.value for c in self.compositors], dtype=float)
+        if self.stats is not None:
+            self.stats.add_buffer('run_pulses', Y)
 
-            T = T + list(T_sim[2:])
-            if(len(Y) > 0):
-                Y = np.concatenate((Y, Y_sim[2:]))
+        i = 0
+        k = 0
+        while True:
+            # Apply all the pulses up to the segment start time.
+            k = self.apply_pulses(y, pulses, events, k, T[i])
+            if k < len(events):
+                j = np.searchsorted(T, events[k][0])
             else:
-                Y = Y_sim[2:]
-
-            prev_start = pulse.time
-            prev_end = prev_start + sim_length
+                j = len(T) - 1
+            Y_sim = self.integrate(y, T[i:j + 1])
+            Y[i:j] = Y_sim[:-1]
+            y = np.array(Y_sim[-1])
+            i = j
+            if i == len(T) - 1:
+                Y[i] = y
+                break
+        if self.stats is not None:
+            self.stats.add_time('pulses', time.perf_counter() - started)
+        result = Result(T, Y, [c.name for c in self.compositors])
+        if key is not None:
+            self.result_cache.put(key, result)
+        return result
 
-            for j in range(0, len(self.compositors)):
-                self.compositors[j].value = Y_sim[-1][j]
+    ## Pulses of a pulsed simulation and the times they are applied at.
+    #  @param self The object pointer.
+    #  @param pulse_series List of pulse objects, see run_pulses.
+    #  @return Tuple (start, stop, pulses, events) of the time span, the
+    #  pulses without the last one (which only stops the simulation) and
+    #  the sorted list of (time, pulse index) pairs.
+    def pulse_events(self, pulse_series):
+        start = pulse_series[0].time
+        stop = pulse_series[-1].time
+        pulses = pulse_series[:-1]
+        events = list(heapq.merge(
+            *[[(t, i) for t in pulses[i].times(stop)]
+              for i in range(0, len(pulses))]))
+        return (start, stop, pulses, events)
 
-        self.reset_state_variables()
-        return (T, Y)
+    ## Apply the pulses due up to a time.
+    #  @param self The object pointer.
+    #  @param y Compositor values, changed in place.
+    #  @param pulses List of pulse objects.
+    #  @param events Sorted list of (time, pulse index) pairs.
+    #  @param k Index of the first event not applied yet.
+    #  @param t The time.
+    #  @return Index of the first event not applied.
+    def apply_pulses(self, y, pulses, events, k, t):
+        while k < len(events) and events[k][0] <= t:
+            pulse = pulses[events[k][1]]
+            if pulse.compositor_name:
+                c = self.map_compositors[pulse.compositor_name]
+                if pulse.add:
+                    y[c] = y[c] + pulse.value
+                else:
+                    y[c] = pulse.value
+            k = k + 1
+        return k
 
     ## Find the index in T (time point) list that gives a value just before t
     #  or exact t.
+    #
+    #  T must be sorted. The lookup is a binary search, so it is cheap even
+    #  for long or memory-mapped T, and @p t may be an array of times.
+    #
     #  @param ignore Ignored argument.
     #  @param T A list of time points.
-    #  @param t Time.
-    #  @return Index of T just before t (or exact t).
+    #  @param t Time or array of times.
+    #  @return Index of T just before t (or exact t) as a one element list,
+    #  or an array of indices if @p t is an array.
     def time_to_index(ignore, T, t):
-        i = 0
-        while i < len(T):
-            if T[i] >= t:
-                break
-            i = i + 1
-        if T[i] == t:
-            ix = i
-        else:
-            ix = i - 1
-        return [ ix ]
+        i = np.searchsorted(T, t, side='left')
+        if np.any(i >= len(T)):
+            raise IndexError('time after the last time point')
+        ix = np.where(np.asarray(T)[i] == t, i, i - 1)
+        if np.ndim(t) == 0:
+            return [ int(ix) ]
+        return ix
 
     ## Given two (x, y) traces, interpolate the less dense one to
     #  have values for each x-value in the denser trace.
@@ -368,6 +2160,10 @@ class BioSystem:
     #  trace at that value using the two closest values of iX2.
     #  iX1, iX2 are assumed to be ordered and to both start at the same
     #  value. Assume iY1, iY2 are columns, iX1, iX2 are rows.
+    #
+    #  iY1, iY2 may also be matrices with one column per Compositor (e.g. Y
+    #  of a simulation), then all the columns are interpolated at once.
+    #
     #  @param ignore Ignored argument.
     #  @param iX1 List of X values in first trace.
     #  @param iY1 List of Y values in first trace.
@@ -387,35 +2183,35 @@ class BioSystem:
             Y2 = iY2
             swap = False
 
-        interpolated = np.zeros(len(X1))
-        max_j = len(X2) - 1
-        j = 0
-        for i in range(0, len(X1)):
-            x1 = X1[i]
-            x_diff = abs(x1 - X2[j])
-            while (j < max_j - 1) and (abs(x1 - X2[j+1]) < x_diff):
-                x_diff = min(x_diff, abs(x1 - X2[j+1]))
-                j = j + 1
-
-            x2 = X2[j]
-
-            a = X2[j]
-            b = Y2[j]
-            c = X2[j + 1]
-            d = Y2[j + 1]
-            if x1 < x2 and j > 1:
-                a = X2[j - 1]
-                b = Y2[j - 1]
-                c = X2[j]
-                d = Y2[j]
-
-            if (a - c) == 0:
-                A = 0
-            else:
-                A = (b - d) / (a - c)
+        x = np.asarray(X1, dtype=float)
+        xs = np.asarray(X2, dtype=float)
+        ys = np.asarray(Y2, dtype=float)
+        max_j = len(xs) - 1
+
+        # Index of the closest value in X2 to each x (the lower one of
+        # equally close values), not past max_j - 1. As in a scan moving
+        # forward only while the next value is strictly closer, the index
+        # never passes the first pair of equal values in X2.
+        j = np.clip(np.searchsorted(xs, x, side='left'), 1, max_j)
+        lower = np.abs(x - xs[j - 1]) <= np.abs(xs[j] - x)
+        j = np.where(lower, j - 1, j)
+        equal = np.flatnonzero(xs[:-1] == xs[1:])
+        if len(equal) > 0:
+            j = np.minimum(j, equal[0])
+        j = np.minimum(j, max_j - 1)
 
-            B = b - A * a
-            interpolated[i] = A *x1 + B
+        # y = Ax + B through the points (a, b) and (c, d) around x.
+        first = np.where((x < xs[j]) & (j > 1), j - 1, j)
+        a = xs[first]
+        c = xs[first + 1]
+        b = ys[first]
+        d = ys[first + 1]
+        shape = (len(x),) + (1,) * (ys.ndim - 1)
+        dx = (a - c).reshape(shape)
+        A = np.divide(b - d, dx, out=np.zeros(np.broadcast(b, dx).shape),
+                      where=(dx != 0))
+        B = b - A * a.reshape(shape)
+        interpolated = A * x.reshape(shape) + B
 
         x1 = X1
         y1 = Y1
@@ -427,4 +2223,126 @@ class BioSystem:
             x2 = X1
             y2 = Y1
         return (x1, y1, x2, y2)
-        return (x1, y1, x2, y2)
+
+## Context manager doing nothing, used for phases when instrumentation is
+#  disabled.
+_no_timer = contextlib.nullcontext()
+
+## First bytes of a file written by BioSystem.save, with the format version.
+SAVE_MAGIC = b'BIOSYSTEM 4\n'
+
+## Parse a chunk of rate strings.
+#  @param table Dictionary of the names used in rate strings and their
+#  symbols.
+#  @param rates List of rate strings.
+#  @return List of sympy expressions.
+def _parse_chunk(table, rates):
+    from sympy import sympify
+    return [sympify(rate, locals=table) for rate in rates]
+
+## Differentiate a chunk of expressions.
+#  @param ignore Unused context.
+#  @param items List of (expression, symbols) pairs.
+#  @return List of the nonzero derivatives [(symbol, expression)] of every
+#  expression by its symbols.
+def _derivative_chunk(ignore, items):
+    from sympy import diff
+    results = []
+    for (expr, syms) in items:
+        derivatives = []
+        for s in syms:
+            d = diff(expr, s)
+            if d != 0:
+                derivatives.append((s, d))
+        results.append(derivatives)
+    return results
+
+## Scale of the coefficients of a reaction, see BioSystem.reaction_network.
+#  @param term Rate of the reaction without its number.
+#  @param coefficients Dictionary of Compositor indices and coefficients.
+#  @param state_syms Compositor symbols.
+#  @return The number dividing the coefficients.
+def _reaction_scale(term, coefficients, state_syms):
+    powers = term.as_powers_dict()
+    scales = set()
+    for (i, c) in coefficients.items():
+        order = powers.get(state_syms[i])
+        if c < 0 and order is not None and order.is_Integer and order > 0:
+            scales.add(abs(c) / order)
+    if len(scales) == 1:
+        scale = scales.pop()
+        if all([float(c / scale).is_integer()
+                for c in coefficients.values()]):
+            return scale
+    return min([abs(c) for c in coefficients.values()])
+
+## BioSystem of the current ensemble worker process.
+_ensemble_system = None
+
+## Ensemble worker process initializer.
+#  @param system BioSystem (already compiled) to run in this worker.
+#  @return None.
+def _ensemble_init(system):
+    global _ensemble_system
+    _ensemble_system = system
+    return None
+
+## Run one ensemble member in a worker process.
+#  @param tspan Time interval to simulate.
+#  @param member Tuple (initial values, constants), see BioSystem.run_with.
+#  @return Result.
+def _ensemble_run(tspan, member):
+    return _ensemble_system.run_with(tspan, member[0], member[1])
+
+## Draw a random starting point of a fit.
+#  Positive bounds spanning more than a decade are sampled log-uniformly,
+#  unbounded values are the given values scaled by a random factor.
+#  @param x0 Current values.
+#  @param lower Lower bounds.
+#  @param upper Upper bounds.
+#  @param rng numpy.random.Generator.
+#  @return Array of starting values.
+def _random_start(x0, lower, upper, rng):
+    x = np.empty(len(x0))
+    for i in range(0, len(x0)):
+        (a, b) = (lower[i], upper[i])
+        if np.isfinite(a) and np.isfinite(b):
+            if a > 0 and b > 10 * a:
+                x[i] = np.exp(rng.uniform(np.log(a), np.log(b)))
+            else:
+                x[i] = rng.uniform(a, b)
+        else:
+            x[i] = np.clip(x0[i] * np.exp(rng.normal()), a, b)
+    return x
+
+## FitProblem of the fit worker processes.
+_fit_problem = None
+
+## Fit worker process initializer.
+#  @param problem FitProblem (with a compiled BioSystem) to solve.
+#  @return None.
+def _fit_init(problem):
+    global _fit_problem
+    _fit_problem = problem
+    return None
+
+## Run one start of a fit in a worker process.
+#  @param x0 Starting values.
+#  @param bounds Tuple (lower, upper).
+#  @param options Extra keyword arguments of scipy.optimize.least_squares.
+#  @return scipy.optimize.OptimizeResult or None if the fit failed.
+def _fit_run(x0, bounds, options):
+    return _fit_start(_fit_problem, x0, bounds[0], bounds[1], options)
+
+## Run one start of a fit.
+#  @param problem FitProblem.
+#  @param x0 Starting values.
+#  @param lower Lower bounds.
+#  @param upper Upper bounds.
+#  @param options Extra keyword arguments of scipy.optimize.least_squares.
+#  @return scipy.optimize.OptimizeResult or None if the fit failed.
+def _fit_start(problem, x0, lower, upper, options):
+    try:
+        return problem.solve(x0, (lower, upper), **options)
+    except (RuntimeError, ValueError):
+        return None
@@ -0,0 +1,746 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import re
+import numpy as np
+from Compiler import chunked
+
+## Numeric code generated from the rate expressions of a BioSystem.
+#
+#  A CompiledModel holds the system as a reaction network: the sparse
+#  stoichiometry matrix S (compositors x reactions) and the Python source of
+#  the function computing the rates v of all reactions. The right-hand side
+#  of the system (the rates of change of all compositors) is S v, so each
+#  reaction rate is evaluated once, however many compositors it changes.
+#  Compiled functions take three arguments: time t, the sequence of
+#  compositor values y and the sequence of constant values p. Constants are
+#  kept as parameters, so changing their values needs no recompilation.
+#
+#  All reaction rates are evaluated by a single call, and subexpressions
+#  shared by several of them are computed only once.
+#
+#  Optionally it also holds the analytic Jacobian of the right-hand side,
+#  stored as the list of its structurally nonzero entries.
+#
+#  Optionally the right-hand side and the Jacobian are also evaluated by
+#  native code (NativeModel), which is then used instead of the numpy
+#  functions.
+#
+#  Reactions of structured rate laws (MassAction, MichaelisMenten, Hill)
+#  are evaluated by a RateKernel instead of generated code. They follow the
+#  reactions of the generated code in S; their contributions are added to
+#  the right-hand side and the Jacobians of the generated (or native)
+#  functions.
+#
+#  Source generation can be split into chunks compiled in parallel (see
+#  Compiler); subexpressions are then shared only within a chunk. Chunks
+#  can also be given explicitly, e.g. the reactions of each compositor,
+#  together with a dictionary of the sources of earlier chunks: only the
+#  chunks whose expressions changed are then generated again.
+#
+#  A CompiledModel is pickled as its source code; the functions are compiled
+#  again when it is unpickled, without any symbolic work.
+
+class CompiledModel:
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param args Function arguments: [time symbol, compositor symbols,
+    #  constant symbols].
+    #  @param rates Sympy expressions of the reaction rates.
+    #  @param S Stoichiometry matrix as a scipy.sparse matrix.
+    #  @param kernel RateKernel of the structured rate laws or None.
+    #  @param compiler Compiler generating the source in chunks or None.
+    #  @param chunks Numbers of reactions per chunk or None (see
+    #  function_source).
+    #  @param sources Dictionary of the sources of earlier chunks or None.
+    def __init__(self, args, rates, S, kernel=None, compiler=None,
+                 chunks=None, sources=None):
+        from scipy.sparse import csr_matrix, hstack
+        ## Python source of the reaction rates function rates(t, y, p).
+        self.source = function_source('rates', args, rates,
+                                      compiler=compiler, chunks=chunks,
+                                      sources=sources)
+        ## Reaction rates function rates(t, y, p) returning a list.
+        self.rates = load_function(self.source, 'rates')
+        ## Number of reactions evaluated by the generated code.
+        self.symbolic_reactions = S.shape[1]
+        ## RateKernel evaluating the structured rate laws or None.
+        self.kernel = kernel
+        S = csr_matrix(S)
+        if kernel is not None:
+            S = hstack([S, csr_matrix(kernel.S)]).tocsr()
+        ## Stoichiometry matrix (compositors x reactions), dense for small
+        #  systems where it is faster, else scipy.sparse CSR.
+        self.S = S
+        if S.shape[0] * S.shape[1] <= 10000:
+            self.S = self.S.toarray()
+        ## Python source of the Jacobian function jac(t, y, p) or None.
+        self.jac_source = None
+        ## Jacobian function jac(t, y, p) returning the nonzero entries or
+        #  None.
+        self.jac = None
+        ## Row indices of the nonzero Jacobian entries.
+        self.jac_rows = None
+        ## Column indices of the nonzero Jacobian entries.
+        self.jac_cols = None
+        ## Positions of the entries of @p jac and of the kernel Jacobian
+        #  among the nonzero entries, or None without a kernel.
+        self.jac_maps = None
+        ## Python source of the parameter Jacobian function pjac(t, y, p)
+        #  or None.
+        self.pjac_source = None
+        ## Parameter Jacobian function pjac(t, y, p) returning the nonzero
+        #  entries or None.
+        self.pjac = None
+        ## Row (compositor) indices of the nonzero parameter Jacobian
+        #  entries.
+        self.pjac_rows = None
+        ## Column (constant) indices of the nonzero parameter Jacobian
+        #  entries.
+        self.pjac_cols = None
+        ## Python source of the propensities function propensities(t, y, p)
+        #  of the reactions of the generated code or None.
+        self.propensity_source = None
+        ## Propensities function propensities(t, y, p) returning a list or
+        #  None.
+        self.propensity_function = None
+        ## Python source of the single reaction propensity functions or
+        #  None.
+        self.reaction_source = None
+        ## Single reaction propensity functions r_j(t, y, p), each returning
+        #  a list of one value, or None.
+        self.reaction_functions = None
+        ## Indices of the compositors each reaction rate depends on.
+        self.reaction_inputs = None
+        ## Backend of the right-hand side: 'numpy', 'c' or 'numba'.
+        self.backend = 'numpy'
+        ## NativeModel evaluating the right-hand side and the Jacobian, or
+        #  None to use the numpy functions.
+        self.native = None
+        ## Split of the compositors by the conservation laws (see
+        #  reduction) or None if not computed yet.
+        self.reduced = None
+
+    ## State to pickle: everything except the compiled functions.
+    #  @param self The object pointer.
+    #  @return Dictionary of attributes.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['rates'] = None
+        state['jac'] = None
+        state['pjac'] = None
+        state['propensity_function'] = None
+        state['reaction_functions'] = None
+        return state
+
+    ## Restore a pickled object and compile its functions.
+    #  @param self The object pointer.
+    #  @param state Dictionary of attributes.
+    #  @return None.
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.rates = load_function(self.source, 'rates')
+        if self.jac_source is not None:
+            self.jac = load_function(self.jac_source, 'jac')
+        if self.pjac_source is not None:
+            self.pjac = load_function(self.pjac_source, 'pjac')
+        if self.propensity_source is not None:
+            self.load_propensities()
+        if self.reaction_source is not None:
+            self.load_reaction_functions()
+        if self.native is not None and not self.native.load():
+            self.native = None
+        return None
+
+    ## Evaluate the right-hand side.
+    #  @param self The object pointer.
+    #  @param t Time point.
+    #  @param y Compositor values.
+    #  @param p Constant values.
+    #  @return Array of the rates of change of compositors.
+    def rhs(self, t, y, p):
+        if self.native is not None:
+            if self.kernel is not None:
+                return self.native.rhs(t, y, p) + self.kernel.rhs(y, p)
+            return self.native.rhs(t, y, p)
+        return self.S.dot(self.reaction_rates(t, y, p))
+
+    ## Evaluate the rates of all reactions, those of the generated code
+    #  followed by those of the kernel.
+    #  @param self The object pointer.
+    #  @param t Time point.
+    #  @param y Compositor values, or one row per compositor and one column
+    #  per batch member.
+    #  @param p Constant values, each one a scalar or a row of batch values.
+    #  @return Array of reaction rates (one row per reaction for a batch).
+    def reaction_rates(self, t, y, p):
+        V = stacked(self.rates(t, y, p), y)
+        if self.kernel is not None:
+            V = np.concatenate((V, self.kernel.rates(y, p)))
+        return V
+
+    ## Evaluate the propensities of all reactions for molecule counts, in
+    #  the order of reaction_rates. Needs setPropensities.
+    #  @param self The object pointer.
+    #  @param t Time point.
+    #  @param y Compositor counts, or one row per compositor and one column
+    #  per batch member.
+    #  @param p Constant values, each one a scalar or a row of batch values.
+    #  @return Array of propensities (one row per reaction for a batch).
+    def propensities(self, t, y, p):
+        V = stacked(self.propensity_function(t, y, p), y)
+        if self.kernel is not None:
+            V = np.concatenate((V, self.kernel.propensities(y, p)))
+        return V
+
+    ## Compile the Jacobian of the right-hand side.
+    #  @param self The object pointer.
+    #  @param args Function arguments: [time symbol, compositor symbols,
+    #  constant symbols].
+    #  @param rows Row indices of the nonzero entries.
+    #  @param cols Column indices of the nonzero entries.
+    #  @param entries Sympy expressions of the nonzero entries.
+    #  @param compiler Compiler generating the source in chunks or None.
+    #  @param chunks Numbers of entries per chunk or None.
+    #  @param sources Dictionary of the sources of earlier chunks or None.
+    #  @return The object pointer.
+    def setJacobian(self, args, rows, cols, entries, compiler=None,
+                    chunks=None, sources=None):
+        self.jac_source = function_source('jac', args, entries,
+                                          compiler=compiler, chunks=chunks,
+                                          sources=sources)
+        self.jac = load_function(self.jac_source, 'jac')
+        self.jac_rows = np.array(rows, dtype=int)
+        self.jac_cols = np.array(cols, dtype=int)
+        if self.kernel is not None:
+            # Entries of both are summed at the union of their positions.
+            n = self.S.shape[0]
+            (positions, inverse) = np.unique(np.concatenate((
+                self.jac_rows * n + self.jac_cols,
+                self.kernel.jac_rows * n + self.kernel.jac_cols)),
+                return_inverse=True)
+            self.jac_maps = (inverse[:len(rows)], inverse[len(rows):])
+            self.jac_rows = positions // n
+            self.jac_cols = positions % n
+        return self
+
+    ## Compile the function evaluating the propensities of the reactions
+    #  of the generated code, used by the stochastic simulations.
+    #  @param self The object pointer.
+    #  @param args Function arguments: [time symbol, compositor symbols,
+    #  constant symbols].
+    #  @param propensities Sympy expressions of the propensities or None if
+    #  they are the reaction rates.
+    #  @param compiler Compiler generating the source in chunks or None.
+    #  @param chunks Numbers of propensities per chunk or None.
+    #  @param sources Dictionary of the sources of earlier chunks or None.
+    #  @return The object pointer.
+    def setPropensities(self, args, propensities=None, compiler=None,
+                        chunks=None, sources=None):
+        if propensities is None:
+            self.propensity_source = self.source
+        else:
+            self.propensity_source = function_source(
+                'propensities', args, propensities, compiler=compiler,
+                chunks=chunks, sources=sources)
+        self.load_propensities()
+        return self
+
+    ## Compile the propensities function from its source.
+    #  @param self The object pointer.
+    #  @return None.
+    def load_propensities(self):
+        if self.propensity_source == self.source:
+            self.propensity_function = self.rates
+        else:
+            self.propensity_function = load_function(
+                self.propensity_source, 'propensities')
+        return None
+
+    ## Compile the functions evaluating single reaction propensities, used
+    #  by the stochastic next reaction method.
+    #  @param self The object pointer.
+    #  @param args Function arguments: [time symbol, compositor symbols,
+    #  constant symbols].
+    #  @param rates Sympy expressions of the propensities.
+    #  @param inputs Lists of indices of the compositors each reaction rate
+    #  depends on.
+    #  @param compiler Compiler generating the source in chunks or None.
+    #  @return The object pointer.
+    def setReactionFunctions(self, args, rates, inputs, compiler=None):
+        self.reaction_source = ''.join(
+            chunked(compiler, 'codegen reactions', reaction_sources, args,
+                    list(enumerate(rates))))
+        self.reaction_inputs = list(inputs)
+        if self.kernel is not None:
+            self.reaction_inputs.extend(self.kernel.inputs())
+        self.load_reaction_functions()
+        return self
+
+    ## Compile the single reaction propensity functions from their source.
+    #  @param self The object pointer.
+    #  @return None.
+    def load_reaction_functions(self):
+        namespace = load_namespace(self.reaction_source, 'reactions')
+        self.reaction_functions = [namespace['r%d' % j] for j in
+                                   range(0, self.symbolic_reactions)]
+        if self.kernel is not None:
+            self.reaction_functions.extend(
+                [self.kernel.reaction_function(j) for j in
+                 range(0, len(self.kernel))])
+        return None
+
+    ## Evaluate the Jacobian of the right-hand side.
+    #  @param self The object pointer.
+    #  @param t Time point.
+    #  @param y Compositor values.
+    #  @param p Constant values.
+    #  @param sparse If True return a scipy.sparse CSC matrix, else a dense
+    #  array.
+    #  @return Matrix of partial derivatives d(dy_i/dt)/dy_j.
+    def jacobian(self, t, y, p, sparse=False):
+        n = len(y)
+        if self.native is not None:
+            values = self.native.jac(t, y, p)
+        else:
+            values = np.array(self.jac(t, y, p), dtype=float)
+        if self.kernel is not None:
+            values = self.with_kernel(values, self.kernel.jacobian(y, p))
+        if sparse:
+            from scipy.sparse import csc_matrix
+            return csc_matrix((values, (self.jac_rows, self.jac_cols)),
+                              shape=(n, n))
+        J = np.zeros((n, n))
+        J[self.jac_rows, self.jac_cols] = values
+        return J
+
+    ## Compile the Jacobian of the right-hand side with respect to the
+    #  constants.
+    #  @param self The object pointer.
+    #  @param args Function arguments: [time symbol, compositor symbols,
+    #  constant symbols].
+    #  @param rows Row (compositor) indices of the nonzero entries.
+    #  @param cols Column (constant) indices of the nonzero entries.
+    #  @param entries Sympy expressions of the nonzero entries.
+    #  @param compiler Compiler generating the source in chunks or None.
+    #  @param chunks Numbers of entries per chunk or None.
+    #  @param sources Dictionary of the sources of earlier chunks or None.
+    #  @return None.
+    def setParameterJacobian(self, args, rows, cols, entries,
+                             compiler=None, chunks=None, sources=None):
+        self.pjac_source = function_source('pjac', args, entries,
+                                           compiler=compiler, chunks=chunks,
+                                           sources=sources)
+        self.pjac = load_function(self.pjac_source, 'pjac')
+        self.pjac_rows = np.array(rows, dtype=int)
+        self.pjac_cols = np.array(cols, dtype=int)
+        return None
+
+    ## Set the native code evaluating the right-hand side and the Jacobian.
+    #  @param self The object pointer.
+    #  @param backend 'numpy', 'c' or 'numba'.
+    #  @param native NativeModel or None to use the numpy functions.
+    #  @return None.
+    def setNative(self, backend, native):
+        self.backend = backend
+        self.native = native
+        return None
+
+    ## Evaluate the Jacobian with respect to the constants.
+    #  @param self The object pointer.
+    #  @param t Time point.
+    #  @param y Compositor values.
+    #  @param p Constant values.
+    #  @return Dense matrix of partial derivatives d(dy_i/dt)/dp_k.
+    def parameter_jacobian(self, t, y, p):
+        P = np.zeros((len(y), len(p)))
+        P[self.pjac_rows, self.pjac_cols] = self.pjac(t, y, p)
+        if self.kernel is not None:
+            P[self.kernel.pjac_rows, self.kernel.pjac_cols] += \
+                self.kernel.parameter_jacobian(y, p)
+        return P
+
+    ## Sum the Jacobian entries of the generated code and of the kernel.
+    #  @param self The object pointer.
+    #  @param values Entries of the generated (or native) Jacobian.
+    #  @param kernel_values Entries of the kernel Jacobian.
+    #  @return Entries at (@p jac_rows, @p jac_cols).
+    def with_kernel(self, values, kernel_values):
+        result = np.zeros((len(self.jac_rows),) + np.shape(kernel_values)[1:])
+        result[self.jac_maps[0]] = values
+        result[self.jac_maps[1]] += kernel_values
+        return result
+
+    ## Conservation laws of the reaction network.
+    #
+    #  The rows of the returned matrix L span the left null space of the
+    #  stoichiometry matrix, L S = 0, so the weighted sums L y of compositor
+    #  values stay constant whatever the reaction rates are. Each law has
+    #  a compositor of its own with the weight 1 (see reduction).
+    #
+    #  @param self The object pointer.
+    #  @return Matrix with one row per conservation law.
+    def conservation_laws(self):
+        return self.reduction()[2]
+
+    ## Split of the compositors by the conservation laws into independent
+    #  ones and dependent ones, which follow from the independent ones and
+    #  the conserved totals.
+    #
+    #  The laws are found by sparse elimination on the rows of S (see
+    #  conservation_basis), which chooses one dependent compositor per law
+    #  and brings the laws to the form y_D + M_I y_I = M y = const, where
+    #  D and I are the dependent and independent compositors.
+    #
+    #  @param self The object pointer.
+    #  @return Tuple (independent, dependent, M) of the index arrays of the
+    #  independent and the dependent compositors and the matrix M with one
+    #  row per dependent compositor.
+    def reduction(self):
+        if self.reduced is None:
+            (dependent, M) = conservation_basis(self.S)
+            independent = np.setdiff1d(np.arange(self.S.shape[0]),
+                                       dependent)
+            self.reduced = (independent, dependent, M)
+        return self.reduced
+
+    ## Evaluate the right-hand side for a batch of independent systems.
+    #  @param self The object pointer.
+    #  @param t Time point.
+    #  @param Y Compositor values, one row per compositor and one column per
+    #  batch member.
+    #  @param p Constant values, each one a scalar or a row of batch values.
+    #  @return Rates of change as an array shaped like @p Y.
+    def rhs_batch(self, t, Y, p):
+        if self.native is not None:
+            if self.kernel is not None:
+                return (self.native.rhs_batch(t, Y, p) +
+                        self.kernel.rhs(Y, p))
+            return self.native.rhs_batch(t, Y, p)
+        return self.S.dot(self.reaction_rates(t, Y, p))
+
+    ## Evaluate the Jacobian for a batch of independent systems.
+    #
+    #  The batch state is flattened member by member, i.e. the state of
+    #  member b occupies entries b * n .. (b + 1) * n - 1, so the Jacobian is
+    #  block diagonal.
+    #
+    #  @param self The object pointer.
+    #  @param t Time point.
+    #  @param Y Compositor values, one row per compositor and one column per
+    #  batch member.
+    #  @param p Constant values, each one a scalar or a row of batch values.
+    #  @return Block diagonal scipy.sparse CSC matrix.
+    def jacobian_batch(self, t, Y, p):
+        (n, batch) = Y.shape
+        if self.native is not None:
+            data = self.native.jac_batch(t, Y, p)
+        else:
+            values = self.jac(t, Y, p)
+            data = np.empty((len(values), batch))
+            for k in range(0, len(values)):
+                data[k] = values[k]
+        if self.kernel is not None:
+            data = self.with_kernel(data, self.kernel.jacobian(Y, p))
+        offsets = n * np.arange(0, batch)
+        rows = (self.jac_rows[:, None] + offsets).ravel()
+        cols = (self.jac_cols[:, None] + offsets).ravel()
+        from scipy.sparse import csc_matrix
+        return csc_matrix((data.ravel(), (rows, cols)),
+                          shape=(n * batch, n * batch))
+
+
+## Generate the source of a function evaluating a list of expressions.
+#
+#  Every argument group is either a single Symbol (passed as a scalar) or a
+#  list of Symbols (passed as one sequence and unpacked). Symbols are renamed
+#  so that substance names can never clash with Python names. Common
+#  subexpressions are extracted and assigned to temporaries first.
+#
+#  @param name Function name.
+#  @param groups List of argument groups.
+#  @param exprs List of sympy expressions to evaluate.
+#  @param indexed If True sequence arguments are indexed where used instead
+#  of unpacked, which is faster for expressions using few of them.
+#  @param compiler Compiler generating the source in chunks or None.
+#  @param chunks List of the numbers of consecutive expressions of each
+#  chunk, or None for the chunks of @p compiler (or one chunk without it).
+#  @param sources Dictionary of the sources of the chunks of an earlier
+#  call with @p chunks, updated to the chunks of this call, or None.
+#  @return Python source of the function returning a list of values.
+def function_source(name, groups, exprs, indexed=False, compiler=None,
+                    chunks=None, sources=None):
+    arg_names = ['_a%d' % g for g in range(0, len(groups))]
+    if len(exprs) == 0:
+        # Nothing to evaluate, and nothing to import sympy for.
+        return 'def %s(%s):\n    return []\n' % (name, ', '.join(arg_names))
+    (renames, body) = argument_renames(groups, indexed)
+    if chunks is None:
+        results = chunked(compiler, 'codegen ' + name, source_chunk,
+                          renames, list(enumerate(exprs)))
+    else:
+        if sources is None:
+            sources = {}
+        results = cached_chunks(name, renames, exprs, chunks, compiler,
+                                sources)
+    returned = []
+    for (lines, value) in results:
+        body.extend(lines)
+        returned.append(value)
+    body.append('return [%s]' % ', '.join(returned))
+    lines = ['def %s(%s):' % (name, ', '.join(arg_names))]
+    lines.extend(['    ' + line for line in body])
+    return '\n'.join(lines) + '\n'
+
+
+## Renames of the argument Symbols of a generated function.
+#  @param groups List of argument groups, see function_source.
+#  @param indexed If True sequence arguments are indexed where used.
+#  @return Tuple (renames, lines) of the dictionary of Symbols and their
+#  new names and the source lines unpacking the arguments.
+def argument_renames(groups, indexed):
+    from sympy import Symbol
+    renames = {}
+    lines = []
+    for g in range(0, len(groups)):
+        group = groups[g]
+        arg_name = '_a%d' % g
+        if isinstance(group, (list, tuple)):
+            names = []
+            for i in range(0, len(group)):
+                if indexed:
+                    renames[group[i]] = Symbol('%s[%d]' % (arg_name, i))
+                else:
+                    renames[group[i]] = Symbol('_a%d_%d' % (g, i))
+                    names.append('_a%d_%d' % (g, i))
+            if names:
+                lines.append('%s, = %s' % (', '.join(names), arg_name))
+        else:
+            renames[group] = Symbol(arg_name)
+    return (renames, lines)
+
+
+## Generate the source evaluating a chunk of expressions.
+#  The temporaries of the common subexpressions are named after the index
+#  of the first expression, so the sources of chunks can be joined.
+#  @param renames Dictionary of argument Symbols and their new names.
+#  @param items List of (index, expression) pairs.
+#  @return List of (lines, value) pairs, one per expression: the source
+#  lines to execute before the value and the source of the value.
+def source_chunk(renames, items):
+    from sympy import cse, numbered_symbols
+    from sympy.printing.numpy import NumPyPrinter
+    printer = NumPyPrinter({'fully_qualified_modules': True})
+    prefix = '_x'
+    if items[0][0] > 0:
+        prefix = '_x%d_' % items[0][0]
+    exprs = [e.xreplace(renames) for (j, e) in items]
+    replacements, reduced = cse(exprs, symbols=numbered_symbols(prefix))
+    results = [([], printer.doprint(e)) for e in reduced]
+    results[0] = (['%s = %s' % (sym, printer.doprint(e))
+                   for (sym, e) in replacements], results[0][1])
+    return results
+
+
+## Generate the sources of chunks of expressions, reusing the sources of
+#  unchanged chunks.
+#
+#  A chunk is identified by its expressions and the new names of their
+#  arguments, so it is found again whatever its position. Its source is
+#  kept with the temporaries of the first chunk and renamed for its
+#  position.
+#
+#  @param name Function name, for the progress callback.
+#  @param renames Dictionary of argument Symbols and their new names.
+#  @param exprs List of sympy expressions.
+#  @param chunks List of the numbers of consecutive expressions of each
+#  chunk.
+#  @param compiler Compiler generating the new chunks or None.
+#  @param sources Dictionary of chunk keys and sources, replaced by the
+#  chunks of @p exprs.
+#  @return List of (lines, value) pairs, see source_chunk.
+def cached_chunks(name, renames, exprs, chunks, compiler, sources):
+    keys = []
+    start = 0
+    for size in chunks:
+        part = tuple(exprs[start:start + size])
+        symbols = set()
+        for e in part:
+            symbols.update(e.free_symbols)
+        names = sorted([(s.name, renames[s].name) for s in symbols
+                        if s in renames])
+        keys.append((start, (part, tuple(names))))
+        start = start + size
+    missing = {}
+    for (start, key) in keys:
+        if key not in sources:
+            missing[key] = None
+    missing = list(missing)
+    generated = chunked(compiler, 'codegen ' + name, _chunk_sources,
+                        renames, [part for (part, names) in missing])
+    used = dict(zip(missing, generated))
+    for (start, key) in keys:
+        if key not in used:
+            used[key] = sources[key]
+    sources.clear()
+    sources.update(used)
+    results = []
+    for (start, key) in keys:
+        prefix = r'_x%d_\1' % start
+        for (lines, value) in sources[key]:
+            if start > 0:
+                lines = [TEMPORARY.sub(prefix, line) for line in lines]
+                value = TEMPORARY.sub(prefix, value)
+            results.append((lines, value))
+    return results
+
+
+## Numbers of consecutive equal keys, e.g. the chunks of the entries of
+#  each row of a matrix.
+#  @param keys Sequence of keys.
+#  @return List of numbers.
+def chunk_sizes(keys):
+    sizes = []
+    previous = None
+    for key in keys:
+        if len(sizes) > 0 and key == previous:
+            sizes[-1] = sizes[-1] + 1
+        else:
+            sizes.append(1)
+        previous = key
+    return sizes
+
+
+## Temporaries of the common subexpressions of the first chunk.
+TEMPORARY = re.compile(r'\b_x(\d+)\b')
+
+
+## Generate the sources of chunks of expressions, each with the
+#  temporaries of the first chunk.
+#  @param renames Dictionary of argument Symbols and their new names.
+#  @param chunks List of tuples of expressions.
+#  @return List of the lists of (lines, value) pairs, see source_chunk.
+def _chunk_sources(renames, chunks):
+    return [source_chunk(renames, list(enumerate(chunk)))
+            for chunk in chunks]
+
+
+## Generate the sources of single reaction propensity functions.
+#  @param args Function arguments, see CompiledModel.setReactionFunctions.
+#  @param items List of (reaction index, rate expression) pairs.
+#  @return List of the function sources.
+def reaction_sources(args, items):
+    return [function_source('r%d' % j, args, [rate], indexed=True)
+            for (j, rate) in items]
+
+
+## Basis of the conservation laws of a reaction network.
+#
+#  The rows of S are eliminated in order of their numbers of entries, with
+#  sparse rows and a pivot per row chosen among its large entries, so a
+#  network without conservation laws costs about as much as its number of
+#  entries. Rows which vanish belong to dependent compositors; the weights
+#  of the others in their laws are then solved for by a sparse LU
+#  decomposition of the pivots.
+#
+#  @param S Stoichiometry matrix (compositors x reactions), dense or
+#  scipy.sparse.
+#  @param tolerance Entries below @p tolerance times the largest entry of
+#  @p S count as zero.
+#  @return Tuple (dependent, M) of the sorted index array of the dependent
+#  compositors and the laws, one row per dependent compositor with the
+#  weight 1 for it and 0 for the others.
+def conservation_basis(S, tolerance=1e-10):
+    from scipy.sparse import csr_matrix
+    S = csr_matrix(S)
+    n = S.shape[0]
+    threshold = tolerance * (np.abs(S.data).max() if S.nnz else 1.0)
+    rows = []
+    columns = {}
+    for i in range(0, n):
+        (start, end) = (S.indptr[i], S.indptr[i + 1])
+        rows.append(dict([(j, v) for (j, v) in zip(
+            S.indices[start:end].tolist(), S.data[start:end].tolist())
+            if abs(v) > threshold]))
+        for j in rows[i]:
+            columns.setdefault(j, set()).add(i)
+    pivots = []
+    dependent = []
+    for i in sorted(range(0, n), key=lambda i: len(rows[i])):
+        row = rows[i]
+        if len(row) == 0:
+            dependent.append(i)
+            continue
+        # Among the entries of at least a tenth of the largest one, the one
+        # in the shortest column, which causes the least fill.
+        large = 0.1 * max([abs(v) for v in row.values()])
+        pivot = min([j for j in row if abs(row[j]) >= large],
+                    key=lambda j: len(columns[j]))
+        pivots.append((i, pivot))
+        for j in row:
+            columns[j].discard(i)
+        for r in list(columns[pivot]):
+            other = rows[r]
+            factor = other[pivot] / row[pivot]
+            for (j, v) in row.items():
+                value = other.get(j, 0.0) - factor * v
+                if j != pivot and abs(value) > threshold:
+                    if j not in other:
+                        columns[j].add(r)
+                    other[j] = value
+                elif j in other:
+                    del other[j]
+                    columns[j].discard(r)
+    dependent = np.array(sorted(dependent), dtype=int)
+    M = np.zeros((len(dependent), n))
+    if len(dependent) == 0:
+        return (dependent, M)
+    M[np.arange(len(dependent)), dependent] = 1.0
+    if len(pivots) > 0:
+        # The weights w of the pivot rows P in the law of a dependent row
+        # d cancel it on the pivot columns C: S[P, C]^T w = -S[d, C].
+        from scipy.sparse.linalg import splu
+        P = np.array([i for (i, j) in pivots], dtype=int)
+        C = np.array([j for (i, j) in pivots], dtype=int)
+        A = S[P][:, C].T.tocsc()
+        B = -S[dependent][:, C].T.toarray()
+        W = splu(A).solve(B)
+        # Remove the rounding noise, so sparse laws stay sparse.
+        W[np.abs(W) < 1e-12] = 0.0
+        M[:, P] = W.T
+    return (dependent, M)
+
+
+## Stack the values returned by a generated function.
+#  @param values List of values, scalars or arrays of batch values.
+#  @param y Compositor values, a vector or one column per batch member.
+#  @return Array of the values (one row per value for a batch).
+def stacked(values, y):
+    if np.ndim(y) == 1:
+        return np.array(values, dtype=float)
+    V = np.empty((len(values),) + np.shape(y)[1:])
+    for j in range(0, len(values)):
+        V[j] = values[j]
+    return V
+
+
+## Compile a function from its source.
+#  @param source Python source defining the function.
+#  @param name Name of the function defined in @p source.
+#  @return The compiled function.
+def load_function(source, name):
+    return load_namespace(source, name)[name]
+
+
+## Compile source code defining functions.
+#  @param source Python source.
+#  @param name Name used in tracebacks.
+#  @return Dictionary of the names defined by @p source.
+def load_namespace(source, name):
+    namespace = {'numpy': np, 'functools': functools}
+    if 'scipy.' in source:
+        import scipy.special
+        namespace['scipy'] = scipy
+    exec(compile(source, '<biosystem %s>' % name, 'exec'), namespace)
+    return namespace
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ProcessPoolExecutor
+import collections
+import os
+
+## Chunked, parallel symbolic compilation.
+#
+#  The symbolic work of building a BioSystem (parsing the rate strings,
+#  differentiating them and generating the source of the compiled
+#  functions) is independent per Compositor or per expression. A Compiler
+#  splits each of these phases into chunks of items, runs the chunks in a
+#  pool of worker processes and merges the results in order, so the model
+#  is the same as one built serially and the build time scales with the
+#  number of cores.
+#
+#  Only a few chunks per worker are pending at any time, so the work
+#  submitted and the results not yet merged stay bounded whatever the size
+#  of the model. A progress callback progress(phase, done, total) is called
+#  as chunks finish, with the number of finished and of all items of the
+#  phase.
+#
+#  Example:
+#
+#  @code
+# def progress(phase, done, total):
+#     print('%s: %d/%d' % (phase, done, total))
+#
+# sys.enableParallelCompilation(workers=8, progress=progress)
+# sys.determine_jacobian()
+#  @endcode
+
+class Compiler:
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param workers Number of worker processes, None for the number of
+    #  CPUs, 1 to compile the chunks in this process.
+    #  @param chunk_size Number of items (Compositors, expressions) per
+    #  chunk.
+    #  @param progress Function progress(phase, done, total) or None.
+    def __init__(self, workers=None, chunk_size=1000, progress=None):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if chunk_size < 1:
+            raise ValueError('Chunk size must be positive')
+        ## Number of worker processes.
+        self.workers = workers
+        ## Number of items per chunk.
+        self.chunk_size = chunk_size
+        ## Progress callback or None.
+        self.progress = progress
+
+    ## Apply a function to chunks of items.
+    #  @param self The object pointer.
+    #  @param phase Name of the phase, passed to the progress callback.
+    #  @param function Module level function f(context, items) returning a
+    #  list with one result per item.
+    #  @param context Data needed by all chunks, sent to every worker once.
+    #  @param items List of items.
+    #  @return List of the results in the order of @p items.
+    def map(self, phase, function, context, items):
+        chunks = [items[i:i + self.chunk_size]
+                  for i in range(0, len(items), self.chunk_size)]
+        results = []
+        self.report(phase, 0, len(items))
+        if self.workers == 1 or len(chunks) < 2:
+            for chunk in chunks:
+                results.extend(function(context, chunk))
+                self.report(phase, len(results), len(items))
+            return results
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(chunks)),
+                                 initializer=_compile_init,
+                                 initargs=(context,)) as executor:
+            pending = collections.deque()
+            for chunk in chunks:
+                if len(pending) >= 2 * self.workers:
+                    results.extend(pending.popleft().result())
+                    self.report(phase, len(results), len(items))
+                pending.append(executor.submit(_compile_run, function,
+                                               chunk))
+            while len(pending) > 0:
+                results.extend(pending.popleft().result())
+                self.report(phase, len(results), len(items))
+        return results
+
+    ## Call the progress callback, if any.
+    #  @param self The object pointer.
+    #  @param phase Name of the phase.
+    #  @param done Number of finished items.
+    #  @param total Number of all items.
+    #  @return None.
+    def report(self, phase, done, total):
+        if self.progress is not None:
+            self.progress(phase, done, total)
+        return None
+
+
+## Apply a function to items, in chunks by a Compiler or at once.
+#  @param compiler Compiler or None.
+#  @param phase Name of the phase.
+#  @param function Module level function f(context, items).
+#  @param context Data needed by all items.
+#  @param items List of items.
+#  @return List of the results in the order of @p items.
+def chunked(compiler, phase, function, context, items):
+    if compiler is None:
+        return function(context, items)
+    return compiler.map(phase, function, context, items)
+
+## Context of the chunks compiled by a worker process.
+_compile_context = None
+
+## Worker process initializer.
+#  @param context Data needed by all chunks.
+#  @return None.
+def _compile_init(context):
+    global _compile_context
+    _compile_context = context
+    return None
+
+## Compile one chunk in a worker process.
+#  @param function Module level function f(context, items).
+#  @param items The chunk.
+#  @return List of results.
+def _compile_run(function, items):
+    return function(_compile_context, items)
@@ -1,7 +1,5 @@
 # -*- coding: utf-8 -*-
 
-from sympy import Symbol
-
 ## Substance concentration.
 #
 #  A Compositor is the total rate of change of a state
@@ -21,12 +19,33 @@ class Compositor:
         self.rate = '0'
         ## Substance name in a system.
         self.name = name
-        ## A Symbol with a @p name representing a substance.
-        self.sym = Symbol(name)
+        ## Symbol of the substance, created by @p sym when first needed.
+        self._sym = None
         ## Initial concentration of a substance.
         self.init_value = init_value
         ## Current concentration of a substance.
         self.value = init_value
+        ## Sympy expression of the rate, set by BioSystem.determine_rates.
+        self.expr = None
+        ## Nonzero partial derivatives of the rate as a list of (Symbol,
+        #  expression) pairs, set by BioSystem.determine_jacobian.
+        self.derivatives = None
+        ## Nonzero partial derivatives of the rate with respect to Constants
+        #  as a list of (Symbol, expression) pairs, set by
+        #  BioSystem.determine_parameter_jacobian.
+        self.parameter_derivatives = None
+
+    ## A Symbol with a @p name representing a substance.
+    #  Created when first needed, so sympy is imported only for symbolic
+    #  work.
+    #  @param self The object pointer.
+    #  @return sympy Symbol.
+    @property
+    def sym(self):
+        if self._sym is None:
+            from sympy import Symbol
+            self._sym = Symbol(self.name)
+        return self._sym
 
     ## Add new rate represented as a string.
     #  @param self The object pointer.
@@ -34,6 +53,9 @@ class Compositor:
     #  @return The object pointer.
     def addRate(self, new_rate):
         self.rate = self.rate + ' + (' + str(new_rate) + ')'
+        self.expr = None
+        self.derivatives = None
+        self.parameter_derivatives = None
         return self
 
     ## Set initial concentration.
@@ -1,7 +1,5 @@
 # -*- coding: utf-8 -*-
 
-from sympy import Symbol
-
 ## A Const is some constant in a system.
 #
 #  A Const class defines numeric constant in a system.
@@ -20,7 +18,19 @@ class Const:
             raise AssertionError('Don''t name your constants gamma, it''s a reserved keyword')
         ## A name of Const.
         self.name = name
-        ## A Symbol with a @p name representing a constant.
-        self.sym = Symbol(name)
         ## A value of Const.
         self.value = value
+        ## Symbol of the Const, created by @p sym when first needed.
+        self._sym = None
+
+    ## A Symbol with a @p name representing a constant.
+    #  Created when first needed, so sympy is imported only for symbolic
+    #  work.
+    #  @param self The object pointer.
+    #  @return sympy Symbol.
+    @property
+    def sym(self):
+        if self._sym is None:
+            from sympy import Symbol
+            self._sym = Symbol(self.name)
+        return self._sym
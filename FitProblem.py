@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+## Least squares fit of Constant values to measured Compositor traces.
+#
+#  The residuals are the differences of simulated and measured values
+#  (divided by the measurement errors, if given) at the measurement times
+#  only. The system is simulated once per parameter vector with
+#  BioSystem.run_sensitivities, which gives both the residuals and their
+#  analytic derivatives, and the compiled model is reused between
+#  evaluations.
+#
+#  Example:
+#
+#  @code
+# data = {'B': (times, values)}
+# problem = FitProblem(sys, data, ['k'])
+# result = problem.solve([0.1], ([0.0], [1.0]))
+#  @endcode
+
+class FitProblem:
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param system BioSystem to fit.
+    #  @param data Dictionary of Compositor names and tuples (times, values)
+    #  or (times, values, errors) of measurements. NaN values are ignored.
+    #  @param constants Names of the Constants to fit.
+    #  @param t0 Initial time of the simulations.
+    #  @param gradient If True use the analytic derivatives of the
+    #  residuals, else finite differences.
+    def __init__(self, system, data, constants, t0=0.0, gradient=True):
+        ## BioSystem to fit.
+        self.system = system
+        ## Names of the Constants to fit.
+        self.constants = list(constants)
+        ## Initial time of the simulations.
+        self.t0 = t0
+        ## If True use the analytic derivatives of the residuals.
+        self.gradient = gradient
+        times = []
+        for name in data:
+            times.append(np.asarray(data[name][0], dtype=float))
+        ## Sorted measurement times of all the Compositors.
+        self.times = np.unique(np.concatenate(times))
+        ## Per measured Compositor: (Compositor index, time point indices,
+        #  values, errors) of the valid measurements.
+        self.measurements = []
+        for name in data:
+            t = np.asarray(data[name][0], dtype=float)
+            values = np.asarray(data[name][1], dtype=float)
+            errors = np.ones(len(values))
+            if len(data[name]) > 2:
+                errors = np.broadcast_to(
+                    np.asarray(data[name][2], dtype=float), values.shape)
+            valid = ~np.isnan(values)
+            self.measurements.append((
+                system.map_compositors[name],
+                np.searchsorted(self.times, t[valid]),
+                values[valid], errors[valid]))
+        ## Parameter vector of the last evaluation.
+        self.last_x = None
+        ## Result of the last evaluation.
+        self.last_result = None
+
+    ## Simulate the system with the given Constant values, reusing the last
+    #  simulation if the values did not change.
+    #  @param self The object pointer.
+    #  @param x Values of the fitted Constants.
+    #  @return Result with the sensitivities to the fitted Constants.
+    def evaluate(self, x):
+        if self.last_x is not None and np.array_equal(x, self.last_x):
+            return self.last_result
+        for (name, value) in zip(self.constants, x):
+            self.system.changeConstantValue(name, value)
+        tspan = [self.t0, self.times[-1]]
+        if self.gradient:
+            result = self.system.run_sensitivities(tspan, self.constants,
+                                                   output=self.times)
+        else:
+            result = self.system.run(tspan, output=self.times)
+        self.last_x = np.array(x, dtype=float)
+        self.last_result = result
+        return result
+
+    ## Weighted residuals of the measurements.
+    #  @param self The object pointer.
+    #  @param x Values of the fitted Constants.
+    #  @return Array of residuals.
+    def residuals(self, x):
+        Y = self.evaluate(x).Y
+        return np.concatenate([(Y[rows, i] - values) / errors for
+                               (i, rows, values, errors) in self.measurements])
+
+    ## Derivatives of the weighted residuals.
+    #  @param self The object pointer.
+    #  @param x Values of the fitted Constants.
+    #  @return Matrix with one row per residual and one column per fitted
+    #  Constant.
+    def jacobian(self, x):
+        sensitivities = self.evaluate(x).sensitivities
+        columns = []
+        for name in self.constants:
+            dY = sensitivities[name]
+            columns.append(np.concatenate(
+                [dY[rows, i] / errors for
+                 (i, rows, values, errors) in self.measurements]))
+        return np.column_stack(columns)
+
+    ## Fit the Constants starting from one parameter vector.
+    #  The Constants of the system keep their fitted values.
+    #  @param self The object pointer.
+    #  @param x0 Initial values of the fitted Constants.
+    #  @param bounds Tuple (lower, upper) of bound lists.
+    #  @param options Extra keyword arguments of
+    #  scipy.optimize.least_squares.
+    #  @return scipy.optimize.OptimizeResult.
+    def solve(self, x0, bounds=(-np.inf, np.inf), **options):
+        from scipy.optimize import least_squares
+        jac = self.jacobian if self.gradient else '2-point'
+        result = least_squares(self.residuals, x0, jac=jac, bounds=bounds,
+                               **options)
+        for (name, value) in zip(self.constants, result.x):
+            self.system.changeConstantValue(name, value)
+        return result
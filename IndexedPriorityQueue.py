@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+## Indexed priority queue of reaction times.
+#
+#  A binary min-heap of the items 0 .. n - 1 ordered by their times, which
+#  also knows the heap position of every item. The time of any item can
+#  therefore be changed in O(log n), as needed by the next reaction method
+#  of Gibson and Bruck.
+
+class IndexedPriorityQueue:
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param times Initial times of the items.
+    def __init__(self, times):
+        ## Times of the items.
+        self.times = list(times)
+        ## Heap of item indices; a sorted list is a valid heap.
+        self.heap = sorted(range(0, len(self.times)),
+                           key=lambda j: self.times[j])
+        ## Position of every item in @p heap.
+        self.position = [0] * len(self.times)
+        for i in range(0, len(self.heap)):
+            self.position[self.heap[i]] = i
+
+    ## The item with the smallest time.
+    #  @param self The object pointer.
+    #  @return Tuple (time, item), (inf, None) if the queue is empty.
+    def top(self):
+        if not self.heap:
+            return (float('inf'), None)
+        j = self.heap[0]
+        return (self.times[j], j)
+
+    ## Change the time of an item.
+    #  @param self The object pointer.
+    #  @param j The item.
+    #  @param time New time of the item.
+    #  @return None.
+    def update(self, j, time):
+        old = self.times[j]
+        self.times[j] = time
+        if time < old:
+            self.sift_up(self.position[j])
+        elif time > old:
+            self.sift_down(self.position[j])
+        return None
+
+    ## Move the item at a heap position up while its parent is later.
+    #  @param self The object pointer.
+    #  @param i Heap position.
+    #  @return None.
+    def sift_up(self, i):
+        heap = self.heap
+        times = self.times
+        j = heap[i]
+        while i > 0:
+            parent = (i - 1) // 2
+            if times[heap[parent]] <= times[j]:
+                break
+            heap[i] = heap[parent]
+            self.position[heap[i]] = i
+            i = parent
+        heap[i] = j
+        self.position[j] = i
+        return None
+
+    ## Move the item at a heap position down while a child is earlier.
+    #  @param self The object pointer.
+    #  @param i Heap position.
+    #  @return None.
+    def sift_down(self, i):
+        heap = self.heap
+        times = self.times
+        n = len(heap)
+        j = heap[i]
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and times[heap[child + 1]] < times[heap[child]]:
+                child = child + 1
+            if times[heap[child]] >= times[j]:
+                break
+            heap[i] = heap[child]
+            self.position[heap[i]] = i
+            i = child
+        heap[i] = j
+        self.position[j] = i
+        return None
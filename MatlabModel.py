@@ -0,0 +1,550 @@
+# -*- coding: utf-8 -*-
+
+## @package MatlabModel
+#  Import and export of models of the MATLAB Part-compositor framework.
+#
+#  The MATLAB version of the framework (biosystem_matlab, set up by
+#  part_composition_setup.m) describes a model with a script like
+#
+#  @code
+# sys = BioSystem();
+# sys.AddConstant('k', 0.05);
+# dAdt = sys.AddCompositor('A', 10);
+# dBdt = sys.AddCompositor('B', 0);
+# dEdt = sys.AddCompositor('E', 1);
+# sys.AddPart(Part('A + E -k> B + E', [dAdt dBdt dEdt], ...
+#     [Rate('-k * A * E') Rate('k * A * E') Rate('0')]));
+#  @endcode
+#
+#  script writes such a script for a BioSystem, parse reads one back. Only
+#  the statements building the model are read: the constructors BioSystem,
+#  Const, Compositor, Part and Rate and the methods AddConstant,
+#  AddCompositor, AddPart, ChangeConstantValue, ChangeInitialValue and
+#  SetInitialValue, with string, number, variable and array arguments and
+#  simple arithmetic on numbers, and assignments of numbers and strings
+#  to variables. All other statements (simulations, plotting, ...) are
+#  skipped. The element-wise operators .*, ./ and .^ of
+#  rate strings are read as *, / and ^, and ** is written as ^.
+
+from Biosystem import BioSystem
+from Compositor import Compositor
+from Const import Const
+from Part import Part
+from Rate import Rate
+import math
+import re
+
+## Names whose presence makes a statement part of the model. Other
+#  statements which cannot be evaluated are skipped.
+MODEL_NAMES = frozenset([
+    'BioSystem', 'Const', 'Compositor', 'Part', 'Rate', 'AddConstant',
+    'AddCompositor', 'AddPart', 'ChangeConstantValue', 'ChangeInitialValue',
+    'SetInitialValue'])
+
+## Numeric functions and constants allowed in model statements.
+NUMERIC_NAMES = {'exp': math.exp, 'log': math.log, 'log10': math.log10,
+                 'log2': math.log2, 'sqrt': math.sqrt, 'abs': abs,
+                 'pi': math.pi, 'Inf': float('inf'), 'inf': float('inf'),
+                 'NaN': float('nan'), 'nan': float('nan')}
+
+## Tokens of a MATLAB script.
+TOKEN = re.compile(r'''
+    (?P<space>[ \t]+)
+  | (?P<continuation>\.\.\.[^\n]*\n?)
+  | (?P<comment>%[^\n]*)
+  | (?P<newline>\n)
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+  | (?P<name>[A-Za-z_]\w*)
+  | (?P<op>\.\*|\./|\.\^|==|~=|<=|>=|&&|\|\||[-+*/^=()\[\]{},;.<>&|~:@])
+  | (?P<string>'|")
+''', re.VERBOSE)
+
+
+## Write a BioSystem as a MATLAB script.
+#  @param system The BioSystem.
+#  @return Script text.
+def script(system):
+    lines = ['sys = BioSystem();']
+    for c in system.constants:
+        lines.append('sys.AddConstant(%s, %s);'
+                     % (matlab_string(c.name), matlab_number(c.value)))
+    variables = {}
+    used = set(['sys'])
+    for k in system.compositors:
+        variable = 'd%sdt' % k.name
+        if not re.match(r'^[A-Za-z]\w{0,62}$', variable) or variable in used:
+            variable = 'compositor%d' % (len(variables) + 1)
+        used.add(variable)
+        variables[id(k)] = variable
+        lines.append('%s = sys.AddCompositor(%s, %s);'
+                     % (variable, matlab_string(k.name),
+                        matlab_number(k.init_value)))
+    for p in system.parts:
+        compositors = []
+        for k in p.compositors:
+            if id(k) not in variables:
+                raise ValueError('Part %s uses a Compositor not in the '
+                                 'system: %s' % (p.name, k.name))
+            compositors.append(variables[id(k)])
+        rates = ['Rate(%s)' % matlab_string(str(r).replace('**', '^'))
+                 for r in p.rates]
+        lines.append('sys.AddPart(Part(%s, ...' % matlab_string(p.name))
+        lines.append('    [%s], ...' % ', '.join(compositors))
+        lines.append('    [%s]));' % ', '.join(rates))
+    return '\n'.join(lines) + '\n'
+
+
+## MATLAB literal of a string.
+#  @param s The string.
+#  @return Quoted string.
+def matlab_string(s):
+    return "'" + str(s).replace("'", "''") + "'"
+
+
+## MATLAB literal of a number.
+#  @param value The number.
+#  @return Number string.
+def matlab_number(value):
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return 'Inf' if value > 0 else '-Inf'
+    if value.is_integer() and abs(value) < 1e15:
+        return '%d' % value
+    return repr(value)
+
+
+## Read a BioSystem from a MATLAB script.
+#  @param text Script text.
+#  @param name Variable holding the BioSystem or None for the last
+#  BioSystem created by the script.
+#  @return The BioSystem.
+def parse(text, name=None):
+    env = {}
+    systems = []
+    for statement in statements(tokenize(text)):
+        try:
+            _Statement(statement, env, systems).run()
+        except (ValueError, TypeError, KeyError, IndexError,
+                ArithmeticError) as e:
+            names = set([v for (kind, v, line, space) in statement
+                         if kind == 'name'])
+            if names & MODEL_NAMES:
+                raise ValueError('line %d: %s' % (statement[0][2], e))
+    if name is not None:
+        if not isinstance(env.get(name), BioSystem):
+            raise ValueError('No BioSystem named %s' % name)
+        return env[name]
+    if not systems:
+        raise ValueError('No BioSystem in the script')
+    return systems[-1]
+
+
+## Split a MATLAB script into tokens.
+#  @param text Script text.
+#  @return List of tuples (kind, value, line, space before). Kinds are
+#  'number', 'name', 'string', 'op' and 'newline'.
+def tokenize(text):
+    tokens = []
+    position = 0
+    line = 1
+    space = False
+    # Block comments, keeping their line ends for the line numbers.
+    text = re.sub(r'(?ms)^[ \t]*%\{[ \t]*$.*?^[ \t]*%\}[ \t]*$',
+                  lambda m: '\n' * m.group().count('\n'), text)
+    while position < len(text):
+        m = TOKEN.match(text, position)
+        if m is None:
+            raise ValueError('line %d: unexpected character %r'
+                             % (line, text[position]))
+        kind = m.lastgroup
+        value = m.group()
+        position = m.end()
+        if kind in ('space', 'continuation', 'comment'):
+            space = True
+            line = line + value.count('\n')
+            continue
+        if kind == 'string':
+            previous = tokens[-1] if tokens else None
+            if (value == "'" and previous is not None and not space and
+                    (previous[0] in ('name', 'number', 'string') or
+                     previous[1] in (')', ']', '}', "'"))):
+                # Transpose, which does not matter for the model.
+                tokens.append(('op', "'", line, space))
+                space = False
+                continue
+            (value, position) = read_string(text, position, value, line)
+        if kind == 'number':
+            value = float(value)
+        tokens.append((kind, value, line, space))
+        if kind == 'newline':
+            line = line + 1
+        space = False
+    return tokens
+
+
+## Read a string literal.
+#  @param text Script text.
+#  @param position Position after the opening quote.
+#  @param quote The quote character.
+#  @param line Line number for error messages.
+#  @return Tuple (string, position after the closing quote).
+def read_string(text, position, quote, line):
+    parts = []
+    while True:
+        end = text.find(quote, position)
+        if end < 0 or '\n' in text[position:end]:
+            raise ValueError('line %d: unterminated string' % line)
+        parts.append(text[position:end])
+        if text.startswith(quote, end + 1):
+            parts.append(quote)
+            position = end + 2
+        else:
+            return (''.join(parts), end + 1)
+
+
+## Split tokens into statements at ; , and line ends outside brackets.
+#  Inside [] and {} line ends separate rows, inside () they are ignored.
+#  @param tokens Tokens of tokenize.
+#  @return List of statements, each a nonempty list of tokens.
+def statements(tokens):
+    result = []
+    current = []
+    brackets = []
+    for token in tokens:
+        (kind, value, line, space) = token
+        if kind == 'op' and value in ('(', '[', '{'):
+            brackets.append(value)
+        elif kind == 'op' and value in (')', ']', '}') and brackets:
+            brackets.pop()
+        if not brackets and (kind == 'newline' or
+                             (kind == 'op' and value in (';', ','))):
+            if current:
+                result.append(current)
+            current = []
+            continue
+        if kind == 'newline':
+            if brackets[-1] == '(':
+                continue
+            token = ('op', ';', line, space)
+        current.append(token)
+    if current:
+        result.append(current)
+    return result
+
+
+## Marker of a function or method to call.
+class _Callable:
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param f The Python function.
+    def __init__(self, f):
+        ## The Python function.
+        self.f = f
+
+
+## Evaluation of one model statement.
+class _Statement:
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param tokens Tokens of the statement.
+    #  @param env Dictionary of the script variables.
+    #  @param systems List of the created BioSystems.
+    def __init__(self, tokens, env, systems):
+        ## Tokens of the statement.
+        self.tokens = tokens
+        ## Position of the next token.
+        self.position = 0
+        ## Dictionary of the script variables.
+        self.env = env
+        ## List of the created BioSystems.
+        self.systems = systems
+
+    ## Evaluate the statement, assigning its value if it is an assignment.
+    #  @param self The object pointer.
+    #  @return None.
+    def run(self):
+        target = None
+        if (len(self.tokens) > 2 and self.tokens[0][0] == 'name' and
+                self.tokens[1][:2] == ('op', '=')):
+            target = self.tokens[0][1]
+            self.position = 2
+        value = self.expression(False)
+        if self.position < len(self.tokens):
+            raise ValueError('unexpected %r' % (self.peek()[1],))
+        if isinstance(value, _Callable):
+            value = value.f()
+        if target is not None:
+            self.env[target] = value
+        return None
+
+    ## The next token.
+    #  @param self The object pointer.
+    #  @return Token tuple or None at the end.
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    ## Check if the next token is one of the operators.
+    #  @param self The object pointer.
+    #  @param ops Operator strings.
+    #  @return True or False.
+    def at(self, *ops):
+        token = self.peek()
+        return token is not None and token[0] == 'op' and token[1] in ops
+
+    ## Consume an operator.
+    #  @param self The object pointer.
+    #  @param op The expected operator.
+    #  @return None.
+    def expect(self, op):
+        if not self.at(op):
+            token = self.peek()
+            raise ValueError('expected %r, found %r'
+                             % (op, token[1] if token else 'end'))
+        self.position = self.position + 1
+        return None
+
+    ## Parse and evaluate an expression.
+    #  @param self The object pointer.
+    #  @param in_matrix True inside [] or {}, where 'a -b' are two elements.
+    #  @return The value.
+    def expression(self, in_matrix):
+        value = self.term(in_matrix)
+        while self.at('+', '-'):
+            token = self.peek()
+            following = self.tokens[self.position + 1] \
+                if self.position + 1 < len(self.tokens) else None
+            if (in_matrix and token[3] and following is not None and
+                    not following[3]):
+                break
+            self.position = self.position + 1
+            right = self.term(in_matrix)
+            value = arithmetic(token[1], value, right)
+        return value
+
+    ## Parse and evaluate a product.
+    #  @param self The object pointer.
+    #  @param in_matrix True inside [] or {}.
+    #  @return The value.
+    def term(self, in_matrix):
+        value = self.unary(in_matrix)
+        while self.at('*', '/', '.*', './'):
+            op = self.peek()[1].lstrip('.')
+            self.position = self.position + 1
+            value = arithmetic(op, value, self.unary(in_matrix))
+        return value
+
+    ## Parse and evaluate a signed power.
+    #  @param self The object pointer.
+    #  @param in_matrix True inside [] or {}.
+    #  @return The value.
+    def unary(self, in_matrix):
+        if self.at('-', '+'):
+            op = self.peek()[1]
+            self.position = self.position + 1
+            return arithmetic(op, 0.0, self.unary(in_matrix))
+        value = self.postfix()
+        if self.at('^', '.^'):
+            self.position = self.position + 1
+            value = arithmetic('^', value, self.unary(in_matrix))
+        return value
+
+    ## Parse and evaluate a value followed by calls, indexing, methods and
+    #  transposes.
+    #  @param self The object pointer.
+    #  @return The value.
+    def postfix(self):
+        value = self.primary()
+        while True:
+            if self.at('(') and not self.peek()[3]:
+                self.position = self.position + 1
+                args = []
+                while not self.at(')'):
+                    args.append(self.expression(False))
+                    if not self.at(')'):
+                        self.expect(',')
+                self.expect(')')
+                value = self.call(value, args)
+            elif self.at('.'):
+                self.position = self.position + 1
+                token = self.peek()
+                if token is None or token[0] != 'name':
+                    raise ValueError('expected a name after .')
+                self.position = self.position + 1
+                if isinstance(value, _Callable):
+                    value = value.f()
+                value = self.method(value, token[1])
+            elif self.at("'"):
+                self.position = self.position + 1
+            else:
+                return value
+
+    ## Parse and evaluate a literal, variable, function, parenthesized
+    #  expression or array.
+    #  @param self The object pointer.
+    #  @return The value.
+    def primary(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError('unexpected end of statement')
+        (kind, value, line, space) = token
+        self.position = self.position + 1
+        if kind in ('number', 'string'):
+            return value
+        if kind == 'name':
+            if value in self.env:
+                return self.env[value]
+            if value in FUNCTIONS:
+                return _Callable(self.function(value))
+            if value in NUMERIC_NAMES:
+                return NUMERIC_NAMES[value]
+            raise ValueError('unknown name %s' % value)
+        if value == '(':
+            result = self.expression(False)
+            self.expect(')')
+            return result
+        if value in ('[', '{'):
+            return self.matrix(']' if value == '[' else '}')
+        raise ValueError('unexpected %r' % (value,))
+
+    ## Parse and evaluate the elements of an array up to its closing
+    #  bracket. The elements are flattened into one list; an array of
+    #  strings is their concatenation, like a MATLAB char array.
+    #  @param self The object pointer.
+    #  @param close The closing bracket.
+    #  @return List of elements or a string.
+    def matrix(self, close):
+        elements = []
+        while not self.at(close):
+            if self.at(',', ';'):
+                self.position = self.position + 1
+                continue
+            value = self.expression(True)
+            if isinstance(value, _Callable):
+                value = value.f()
+            if isinstance(value, list):
+                elements.extend(value)
+            else:
+                elements.append(value)
+        self.expect(close)
+        if elements and all([isinstance(e, str) for e in elements]):
+            return ''.join(elements)
+        return elements
+
+    ## Call a function or index an array.
+    #  @param self The object pointer.
+    #  @param value Function marker, numeric function or array.
+    #  @param args Evaluated arguments.
+    #  @return The result.
+    def call(self, value, args):
+        args = [a.f() if isinstance(a, _Callable) else a for a in args]
+        if isinstance(value, _Callable):
+            return value.f(*args)
+        if callable(value):
+            return value(*args)
+        if isinstance(value, list) and len(args) == 1:
+            return value[int(args[0]) - 1]
+        raise ValueError('cannot call or index %r' % (value,))
+
+    ## Python implementation of a model constructor.
+    #  @param self The object pointer.
+    #  @param name Constructor name.
+    #  @return Function.
+    def function(self, name):
+        systems = self.systems
+
+        def new_system():
+            system = BioSystem()
+            systems.append(system)
+            return system
+
+        return {'BioSystem': new_system,
+                'Const': lambda name, value=0: Const(name, number(value)),
+                'Compositor': lambda name, init_value=0:
+                    Compositor(name, number(init_value)),
+                'Part': lambda name, compositors, rates:
+                    Part(name, as_list(compositors), as_list(rates)),
+                'Rate': lambda rate: Rate(rate_string(rate))}[name]
+
+    ## Python implementation of a method of a model object.
+    #  @param self The object pointer.
+    #  @param obj BioSystem or Compositor.
+    #  @param name Method name.
+    #  @return Function marker.
+    def method(self, obj, name):
+        if isinstance(obj, BioSystem):
+            methods = {
+                'AddConstant': lambda c, value=None: obj.addConstant(
+                    c, None if value is None else number(value)),
+                'AddCompositor': lambda c, value=None: obj.addCompositor(
+                    c, None if value is None else number(value)),
+                'AddPart': obj.addPart,
+                'ChangeConstantValue': lambda c, value:
+                    obj.changeConstantValue(c, number(value)),
+                'ChangeInitialValue': lambda c, value:
+                    obj.changeInitialValue(c, number(value))}
+        elif isinstance(obj, Compositor):
+            methods = {'SetInitialValue': lambda value:
+                       obj.setInitialValue(number(value))}
+        else:
+            methods = {}
+        if name not in methods:
+            raise ValueError('unsupported method %s' % name)
+        return _Callable(methods[name])
+
+
+## Model constructors understood by parse.
+FUNCTIONS = frozenset(['BioSystem', 'Const', 'Compositor', 'Part', 'Rate'])
+
+
+## Arithmetic on numbers.
+#  @param op '+', '-', '*', '/' or '^'.
+#  @param a Left operand.
+#  @param b Right operand.
+#  @return The result.
+def arithmetic(op, a, b):
+    a = number(a)
+    b = number(b)
+    if op == '+':
+        return a + b
+    if op == '-':
+        return a - b
+    if op == '*':
+        return a * b
+    if op == '/':
+        return a / b
+    return a ** b
+
+
+## Check that a value is a number.
+#  @param value The value.
+#  @return The value as a float.
+def number(value):
+    if isinstance(value, list) and len(value) == 1:
+        value = value[0]
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError('expected a number, found %r' % (value,))
+    return float(value)
+
+
+## A value as a list (a single object is a 1x1 array in MATLAB).
+#  @param value The value.
+#  @return List.
+def as_list(value):
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+## Python rate string of a MATLAB rate string.
+#  @param rate The MATLAB rate string.
+#  @return Rate string with .*, ./ and .^ replaced by *, / and ^.
+def rate_string(rate):
+    if not isinstance(rate, str):
+        raise ValueError('expected a rate string, found %r' % (rate,))
+    return re.sub(r'\.([*/^])', r'\1', rate)
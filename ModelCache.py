@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+
+## Cache of compiled models keyed on model structure.
+#
+#  Compiled models (CompiledModel) depend only on the structure of a
+#  BioSystem: the rate formulas of the compositors, the order of compositor
+#  symbols, the names of constants and the backend evaluating them.
+#  Constant and initial values are passed to the compiled functions as
+#  arguments and so are not part of the key. Systems with the same
+#  structure therefore share one compiled model.
+#
+#  The most recently used models are kept in memory; optionally models are
+#  also stored in a directory, so other processes and later runs can load
+#  them without any symbolic work.
+#
+#  Example:
+#
+#  @code
+# sys.model_cache = ModelCache(maxsize=32, directory='/tmp/biosystem-cache')
+#  @endcode
+
+class ModelCache:
+
+    ## Version of the cached data, part of every key.
+    FORMAT = 7
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param maxsize Maximum number of models kept in memory.
+    #  @param directory Directory to store models in or None for memory only.
+    def __init__(self, maxsize=128, directory=None):
+        ## Maximum number of models kept in memory.
+        self.maxsize = maxsize
+        ## Directory to store models in or None.
+        self.directory = directory
+        ## Models kept in memory, least recently used first.
+        self.models = OrderedDict()
+
+    ## Compute the cache key of a model structure.
+    #  @param self The object pointer.
+    #  @param rates Rate strings of all compositors.
+    #  @param symbols Compositor names in the order of the state vector.
+    #  @param constants Constant names in the order of the parameters.
+    #  @param backend Backend of the model (see BioSystem.setBackend).
+    #  @return Hexadecimal key string.
+    def key(self, rates, symbols, constants, backend='numpy'):
+        h = hashlib.sha256()
+        h.update(('%d\n%s\n' % (self.FORMAT, backend)).encode('utf-8'))
+        for part in (symbols, constants, rates):
+            for item in part:
+                # Normalize the rate strings by removing all whitespace.
+                h.update(''.join(str(item).split()).encode('utf-8'))
+                h.update(b'\n')
+            h.update(b'\x00')
+        return h.hexdigest()
+
+    ## Get a model from the cache.
+    #  @param self The object pointer.
+    #  @param key Cache key.
+    #  @return The CompiledModel or None if not cached.
+    def get(self, key):
+        model = self.models.get(key)
+        if model is not None:
+            self.models.move_to_end(key)
+            return model
+        path = self.path(key)
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    model = pickle.load(f)
+            except Exception:
+                return None
+            self.remember(key, model)
+        return model
+
+    ## Put a model to the cache.
+    #  @param self The object pointer.
+    #  @param key Cache key.
+    #  @param model The CompiledModel to store.
+    #  @return None.
+    def put(self, key, model):
+        self.remember(key, model)
+        path = self.path(key)
+        if path is not None:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Write to a temporary file first, so concurrent readers never
+            # see a partially written model.
+            (fd, tmp) = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(model, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        return None
+
+    ## Keep a model in memory, evicting the least recently used ones.
+    #  @param self The object pointer.
+    #  @param key Cache key.
+    #  @param model The CompiledModel to keep.
+    #  @return None.
+    def remember(self, key, model):
+        self.models[key] = model
+        self.models.move_to_end(key)
+        while len(self.models) > self.maxsize:
+            self.models.popitem(last=False)
+        return None
+
+    ## File name of a stored model.
+    #  @param self The object pointer.
+    #  @param key Cache key.
+    #  @return Path or None if models are kept in memory only.
+    def path(self, key):
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, key + '.pickle')
+
+    ## Remove all models from memory (stored files are kept).
+    #  @param self The object pointer.
+    #  @return None.
+    def clear(self):
+        self.models.clear()
+        return None
+
+
+## Cache shared by all BioSystem objects. Models are also stored on disk if
+#  the BIOSYSTEM_CACHE_DIR environment variable names a directory.
+shared_cache = ModelCache(directory=os.environ.get('BIOSYSTEM_CACHE_DIR'))
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+## @package ModelDescription
+#  Description of a BioSystem by JSON values only.
+#
+#  A description holds what BioSystem.save holds except the compiled
+#  model: the Constants, the Compositors with their rate formulas, the
+#  Parts with their Rates, the structured rate laws already taken from the
+#  Parts and the solver and backend settings. It contains no code and no
+#  pickles, so it can be received from another process and checked before
+#  the receiver compiles the model itself.
+#
+#  Rates are formula strings or, for the structured rate laws, lists:
+#  - ['mass-action', constant, [[name, order], ...], coefficient]
+#  - ['michaelis-menten', vmax, km, substrate, coefficient, enzyme]
+#  - ['hill', vmax, k, n, ligand, coefficient, repressor]
+#
+#  @code
+# text = json.dumps(ModelDescription.describe(sys))
+# copy = ModelDescription.build(json.loads(text))
+#  @endcode
+
+import hashlib
+import json
+from Biosystem import BioSystem
+from Part import Part
+from Rate import Rate, MassAction, MichaelisMenten, Hill
+
+## Version of the description format.
+FORMAT = 1
+
+
+## Describe a BioSystem.
+#  @param system The BioSystem.
+#  @return Dictionary of JSON values.
+def describe(system):
+    index = {}
+    for i in range(0, len(system.compositors)):
+        index[id(system.compositors[i])] = i
+    return {
+        'format': FORMAT,
+        'constants': [[c.name, float(c.value)] for c in system.constants],
+        'compositors': [[k.name, float(k.init_value), float(k.value),
+                         str(k.rate)] for k in system.compositors],
+        'parts': [[p.name, [index[id(k)] for k in p.compositors],
+                   [rate_description(r) for r in p.rates]]
+                  for p in system.parts],
+        'parts_determined': system.parts_determined,
+        'rate_laws': [[i, rate_description(r)] for (i, r) in
+                      system.rate_laws],
+        'solver': [system.solver, bool(system.use_jacobian),
+                   bool(system.sparse_jacobian),
+                   dict(system.solver_options), bool(system.reduce)],
+        'backend': system.backend}
+
+
+## Key of a description: the SHA-256 hash of its canonical JSON text.
+#  @param description Dictionary of JSON values.
+#  @return Hexadecimal key string.
+def key(description):
+    text = json.dumps(description, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+## Description of a Rate.
+#  @param rate Rate or rate formula string.
+#  @return Formula string or list describing a structured rate law.
+def rate_description(rate):
+    if isinstance(rate, MassAction):
+        return ['mass-action', rate.constant,
+                [[name, order] for (name, order) in rate.reactants],
+                rate.coefficient]
+    if isinstance(rate, MichaelisMenten):
+        return ['michaelis-menten', rate.vmax, rate.km, rate.substrate,
+                rate.coefficient, rate.enzyme]
+    if isinstance(rate, Hill):
+        return ['hill', rate.vmax, rate.k, rate.n, rate.ligand,
+                rate.coefficient, rate.repressor]
+    return str(rate)
+
+
+## Build a BioSystem from its description.
+#  @param description Dictionary of JSON values, see describe.
+#  @return The BioSystem, with its rates not compiled yet.
+#  @exception ValueError The description is malformed.
+def build(description):
+    if not isinstance(description, dict) or \
+            description.get('format') != FORMAT:
+        raise ValueError('Not a BioSystem description')
+    try:
+        system = BioSystem()
+        for (name, value) in description['constants']:
+            system.addConstant(text(name), number(value))
+        for (name, init_value, value, rate) in description['compositors']:
+            k = system.addCompositor(text(name), number(init_value))
+            k.value = number(value)
+            k.rate = text(rate)
+        for (name, compositors, rates) in description['parts']:
+            if len(compositors) != len(rates):
+                raise ValueError('Part %s has %d Compositors but %d Rates'
+                                 % (name, len(compositors), len(rates)))
+            system.parts.append(Part(
+                text(name), [system.compositors[integer(i)]
+                             for i in compositors],
+                [rate_of(r) for r in rates]))
+        system.parts_determined = integer(description['parts_determined'])
+        if system.parts_determined > len(system.parts):
+            raise ValueError('More Parts determined than there are')
+        for (i, rate) in description['rate_laws']:
+            rate = rate_of(rate)
+            if rate.law() is None or not 0 <= integer(i) < \
+                    len(system.compositors):
+                raise ValueError('Invalid rate law')
+            system.rate_laws.append((integer(i), rate))
+        (solver, jacobian, sparse, options, reduce) = description['solver']
+        if not isinstance(options, dict):
+            raise ValueError('Solver options must be a dictionary')
+        system.setSolver(text(solver), bool(jacobian), bool(sparse),
+                         bool(reduce), **options)
+        system.setBackend(text(description['backend']))
+    except (KeyError, IndexError, TypeError) as e:
+        raise ValueError('Malformed BioSystem description: %s: %s'
+                         % (type(e).__name__, e))
+    return system
+
+
+## Rate of a description.
+#  @param description Formula string or structured rate law list.
+#  @return Rate.
+#  @exception ValueError The kind of rate law is unknown.
+def rate_of(description):
+    if isinstance(description, str):
+        return Rate(description)
+    kind = description[0]
+    if kind == 'mass-action':
+        (kind, constant, reactants, coefficient) = description
+        return MassAction(parameter(constant),
+                          dict([(text(name), number(order))
+                                for (name, order) in reactants]),
+                          number(coefficient))
+    if kind == 'michaelis-menten':
+        (kind, vmax, km, substrate, coefficient, enzyme) = description
+        return MichaelisMenten(parameter(vmax), parameter(km),
+                               text(substrate), number(coefficient),
+                               None if enzyme is None else text(enzyme))
+    if kind == 'hill':
+        (kind, vmax, k, n, ligand, coefficient, repressor) = description
+        return Hill(parameter(vmax), parameter(k), parameter(n),
+                    text(ligand), number(coefficient), bool(repressor))
+    raise ValueError('Unknown rate law: %r' % (kind,))
+
+
+## Check a string value.
+#  @param value The value.
+#  @return @p value.
+#  @exception ValueError It is not a string.
+def text(value):
+    if not isinstance(value, str):
+        raise ValueError('Not a string: %r' % (value,))
+    return value
+
+
+## Check a number value.
+#  @param value The value.
+#  @return @p value.
+#  @exception ValueError It is not a number.
+def number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError('Not a number: %r' % (value,))
+    return value
+
+
+## Check an integer value.
+#  @param value The value.
+#  @return @p value.
+#  @exception ValueError It is not an integer.
+def integer(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError('Not an integer: %r' % (value,))
+    return value
+
+
+## Check a rate law parameter: a Constant name or a number.
+#  @param value The value.
+#  @return @p value.
+#  @exception ValueError It is neither.
+def parameter(value):
+    if isinstance(value, str):
+        return value
+    return number(value)
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+
+import ctypes
+import hashlib
+import importlib.util
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import numpy as np
+
+## Native code for the right-hand side and the Jacobian of a BioSystem.
+#
+#  The compositor rates and the nonzero Jacobian entries are translated to
+#  C (compiled with the system C compiler into a shared library and called
+#  through ctypes) or to a Python module compiled by numba. The batch
+#  functions loop over the members of a batch in native code, so sweeps
+#  pay the call overhead once per step instead of once per member.
+#
+#  Artifacts are stored in a directory under the hash of their source, so
+#  every model is compiled only once. NativeModel.build returns None when
+#  no compiler (or numba) is available or compilation fails; callers then
+#  keep using the numpy functions of the CompiledModel.
+#
+#  A NativeModel is pickled with its source; the artifact is loaded again
+#  (and compiled again if missing) when it is unpickled.
+
+class NativeModel:
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param backend 'c' or 'numba'.
+    #  @param source Source code of the artifact.
+    #  @param path Path of the artifact.
+    #  @param n Number of compositors.
+    #  @param m Number of constants.
+    #  @param nnz Number of nonzero Jacobian entries.
+    def __init__(self, backend, source, path, n, m, nnz):
+        ## 'c' or 'numba'.
+        self.backend = backend
+        ## Source code of the artifact.
+        self.source = source
+        ## Path of the artifact.
+        self.path = path
+        ## Number of compositors.
+        self.n = n
+        ## Number of constants.
+        self.m = m
+        ## Number of nonzero Jacobian entries.
+        self.nnz = nnz
+        ## Loaded functions: rhs, jac, rhs_batch, jac_batch.
+        self.functions = None
+        ## Buffers of single evaluations: y, p, rates of change, Jacobian
+        #  entries.
+        self.buffers = None
+        ## Arguments passing @p buffers to the loaded functions.
+        self.arguments = None
+
+    ## State to pickle: everything except the loaded functions.
+    #  @param self The object pointer.
+    #  @return Dictionary of attributes.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['functions'] = None
+        state['buffers'] = None
+        state['arguments'] = None
+        return state
+
+    ## Compile the artifact (unless already stored) and load it.
+    #  @param backend 'c' or 'numba'.
+    #  @param args Function arguments: [time symbol, compositor symbols,
+    #  constant symbols].
+    #  @param rhs Sympy expressions of the compositor rates.
+    #  @param jac Sympy expressions of the nonzero Jacobian entries.
+    #  @param directory Directory of the artifacts.
+    #  @return Loaded NativeModel or None if it cannot be built.
+    @staticmethod
+    def build(backend, args, rhs, jac, directory):
+        if backend not in ('c', 'numba'):
+            raise ValueError('Unknown backend: %s' % backend)
+        try:
+            if backend == 'c':
+                source = c_source(args, rhs, jac)
+            else:
+                source = numba_source(args, rhs, jac)
+        except Exception:
+            # Expressions the printers do not support.
+            return None
+        suffix = '.so' if backend == 'c' else '.py'
+        key = hashlib.sha256(source.encode('utf-8')).hexdigest()
+        path = os.path.join(directory, 'native_' + key + suffix)
+        native = NativeModel(backend, source, path, len(args[1]),
+                             len(args[2]), len(jac))
+        if not native.load():
+            return None
+        return native
+
+    ## Load the artifact, compiling it first if it is not stored.
+    #  @param self The object pointer.
+    #  @return True if the functions were loaded.
+    def load(self):
+        try:
+            if not os.path.exists(self.path):
+                compile_artifact(self.backend, self.source, self.path)
+            if self.backend == 'c':
+                self.functions = load_library(self.path)
+            else:
+                self.functions = load_module(self.path)
+        except Exception:
+            self.functions = None
+            return False
+        # Arguments of single evaluations are copied to preallocated
+        # buffers, which are passed to C as raw pointers: converting the
+        # arrays on every call would cost more than the evaluation itself.
+        self.buffers = [np.empty(self.n), np.empty(self.m), np.empty(self.n),
+                        np.empty(self.nnz)]
+        self.arguments = [self.pointer(b) for b in self.buffers]
+        return True
+
+    ## Argument passed to the loaded functions for an array.
+    #  @param self The object pointer.
+    #  @param x Contiguous float64 array.
+    #  @return Address of the data for C, else the array.
+    def pointer(self, x):
+        if self.backend == 'c':
+            return x.ctypes.data
+        return x
+
+    ## Evaluate the right-hand side.
+    #  Not thread safe: single evaluations share buffers.
+    #  @param self The object pointer.
+    #  @param t Time point.
+    #  @param y Compositor values.
+    #  @param p Constant values.
+    #  @return Array of the rates of change of compositors.
+    def rhs(self, t, y, p):
+        self.buffers[0][:] = y
+        self.buffers[1][:] = p
+        (y_arg, p_arg, out, jac_out) = self.arguments
+        self.functions[0](float(t), y_arg, p_arg, out)
+        return self.buffers[2].copy()
+
+    ## Evaluate the nonzero Jacobian entries.
+    #  Not thread safe: single evaluations share buffers.
+    #  @param self The object pointer.
+    #  @param t Time point.
+    #  @param y Compositor values.
+    #  @param p Constant values.
+    #  @return Array of the entries.
+    def jac(self, t, y, p):
+        self.buffers[0][:] = y
+        self.buffers[1][:] = p
+        (y_arg, p_arg, out, jac_out) = self.arguments
+        self.functions[1](float(t), y_arg, p_arg, jac_out)
+        return self.buffers[3].copy()
+
+    ## Evaluate the right-hand side for a batch of independent systems.
+    #  @param self The object pointer.
+    #  @param t Time point.
+    #  @param Y Compositor values, one row per compositor and one column per
+    #  batch member.
+    #  @param p Constant values, each one a scalar or a row of batch values.
+    #  @return Rates of change as an array shaped like @p Y.
+    def rhs_batch(self, t, Y, p):
+        batch = Y.shape[1]
+        Y = np.ascontiguousarray(Y.T, dtype=np.float64)
+        P = batch_parameters(p, batch, self.m)
+        dY = np.empty((batch, self.n))
+        self.functions[2](batch, float(t), self.pointer(Y), self.pointer(P),
+                          self.pointer(dY))
+        return dY.T
+
+    ## Evaluate the nonzero Jacobian entries for a batch of independent
+    #  systems.
+    #  @param self The object pointer.
+    #  @param t Time point.
+    #  @param Y Compositor values, one row per compositor and one column per
+    #  batch member.
+    #  @param p Constant values, each one a scalar or a row of batch values.
+    #  @return Array of the entries, one row per entry and one column per
+    #  batch member.
+    def jac_batch(self, t, Y, p):
+        batch = Y.shape[1]
+        Y = np.ascontiguousarray(Y.T, dtype=np.float64)
+        P = batch_parameters(p, batch, self.m)
+        values = np.empty((batch, self.nnz))
+        self.functions[3](batch, float(t), self.pointer(Y), self.pointer(P),
+                          self.pointer(values))
+        return values.T
+
+
+## Matrix of Constant values of a batch, one row per member.
+#  @param p Constant values, each one a scalar or a row of batch values.
+#  @param batch Number of batch members.
+#  @param m Number of constants.
+#  @return numpy array of shape (batch, m).
+def batch_parameters(p, batch, m):
+    P = np.empty((batch, m))
+    for k in range(0, m):
+        P[:, k] = p[k]
+    return P
+
+
+## Rename the arguments of expressions to indexed array names.
+#  @param args Function arguments: [time symbol, compositor symbols,
+#  constant symbols].
+#  @param exprs Sympy expressions.
+#  @return Tuple (temporary assignments, reduced expressions) of the common
+#  subexpression elimination of the renamed expressions.
+def renamed(args, exprs):
+    from sympy import Symbol, cse, numbered_symbols
+    renames = {args[0]: Symbol('t')}
+    for (name, group) in (('y', args[1]), ('p', args[2])):
+        for i in range(0, len(group)):
+            renames[group[i]] = Symbol('%s[%d]' % (name, i))
+    exprs = [e.xreplace(renames) for e in exprs]
+    return cse(exprs, symbols=numbered_symbols('_x'))
+
+
+## Generate the C source of the native functions.
+#  @param args Function arguments: [time symbol, compositor symbols,
+#  constant symbols].
+#  @param rhs Sympy expressions of the compositor rates.
+#  @param jac Sympy expressions of the nonzero Jacobian entries.
+#  @return C source.
+def c_source(args, rhs, jac):
+    from sympy import ccode
+    n = len(args[1])
+    m = len(args[2])
+    lines = ['#include <math.h>', '']
+    for (name, exprs, size) in (('rhs', rhs, n), ('jac', jac, len(jac))):
+        (replacements, reduced) = renamed(args, exprs)
+        lines.append('void bs_%s(double t, const double *y, const double *p,'
+                     ' double *out) {' % name)
+        for (sym, e) in replacements:
+            lines.append('    const double %s = %s;' % (sym, ccode(e)))
+        for i in range(0, len(reduced)):
+            lines.append('    out[%d] = %s;' % (i, ccode(reduced[i])))
+        lines.append('}')
+        lines.append('')
+        lines.append('void bs_%s_batch(int batch, double t, const double *Y,'
+                     ' const double *P, double *out) {' % name)
+        lines.append('    for (int b = 0; b < batch; b++) {')
+        lines.append('        bs_%s(t, Y + b * %d, P + b * %d, out + b * %d);'
+                     % (name, n, m, size))
+        lines.append('    }')
+        lines.append('}')
+        lines.append('')
+    return '\n'.join(lines)
+
+
+## Generate the Python source of the numba functions.
+#  @param args Function arguments: [time symbol, compositor symbols,
+#  constant symbols].
+#  @param rhs Sympy expressions of the compositor rates.
+#  @param jac Sympy expressions of the nonzero Jacobian entries.
+#  @return Python source.
+def numba_source(args, rhs, jac):
+    from sympy.printing.numpy import NumPyPrinter
+    printer = NumPyPrinter({'fully_qualified_modules': True})
+    lines = ['import numba', 'import numpy', '']
+    for (name, exprs) in (('rhs', rhs), ('jac', jac)):
+        (replacements, reduced) = renamed(args, exprs)
+        lines.append('@numba.njit(cache=True)')
+        lines.append('def %s(t, y, p, out):' % name)
+        for (sym, e) in replacements:
+            lines.append('    %s = %s' % (sym, printer.doprint(e)))
+        for i in range(0, len(reduced)):
+            lines.append('    out[%d] = %s' % (i, printer.doprint(reduced[i])))
+        lines.append('')
+        lines.append('@numba.njit(cache=True)')
+        lines.append('def %s_batch(batch, t, Y, P, out):' % name)
+        lines.append('    for b in range(batch):')
+        lines.append('        %s(t, Y[b], P[b], out[b])' % name)
+        lines.append('')
+    return '\n'.join(lines)
+
+
+## Compile an artifact and store it atomically.
+#  @param backend 'c' or 'numba'.
+#  @param source Source code.
+#  @param path Path of the artifact.
+#  @return None.
+def compile_artifact(backend, source, path):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    (fd, tmp) = tempfile.mkstemp(dir=directory)
+    os.close(fd)
+    try:
+        if backend == 'c':
+            compiler = shutil.which(os.environ.get('CC', 'cc'))
+            if compiler is None:
+                raise RuntimeError('No C compiler')
+            c_path = tmp + '.c'
+            with open(c_path, 'w') as f:
+                f.write(source)
+            try:
+                subprocess.run([compiler, '-O2', '-shared', '-fPIC', '-o',
+                                tmp, c_path, '-lm'], check=True,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+            finally:
+                os.remove(c_path)
+        else:
+            with open(tmp, 'w') as f:
+                f.write(source)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return None
+
+
+## Load the functions of a compiled C library.
+#  @param path Path of the shared library.
+#  @return List of functions [rhs, jac, rhs_batch, jac_batch] taking
+#  pointers to float64 data.
+def load_library(path):
+    library = ctypes.CDLL(path)
+    functions = []
+    for name in ('rhs', 'jac'):
+        f = getattr(library, 'bs_' + name)
+        f.argtypes = [ctypes.c_double] + [ctypes.c_void_p] * 3
+        f.restype = None
+        g = getattr(library, 'bs_%s_batch' % name)
+        g.argtypes = [ctypes.c_int, ctypes.c_double] + [ctypes.c_void_p] * 3
+        g.restype = None
+        functions.append(f)
+        functions.append(g)
+    return [functions[0], functions[2], functions[1], functions[3]]
+
+
+## Load the functions of a numba module.
+#  @param path Path of the module.
+#  @return List of functions [rhs, jac, rhs_batch, jac_batch].
+def load_module(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[name] = module
+    return [module.rhs, module.jac, module.rhs_batch, module.jac_batch]
@@ -5,6 +5,17 @@
 #  A Pulse tells that at time @p time we should set value of the
 #  compositor named @p compositor_name to @p value in our simulation.
 #
+#  A Pulse can also be a periodic dosing schedule: with a @p period it
+#  repeats every @p period time units (@p count times, or until the end of
+#  the simulation), and with @p add = True the @p value is added to the
+#  compositor instead of replacing its value.
+#
+#  Example (a dose of 5 A every 24 time units, starting at time 0):
+#
+#  @code
+# Pulse(0, 'A', 5, period=24, add=True)
+#  @endcode
+#
 #  @author Eglė Plėštytė
 #  @date 2017-05-10
 
@@ -17,7 +28,18 @@ class Pulse:
     #  @param compositor_name Represents Biosystem compositor.
     #  @param value Compositor @p compositor_name concentration value at @p
     #  time.
-    def __init__(self, time, compositor_name, value):
+    #  @param period Time between repetitions or None for a single pulse.
+    #  @param count Number of repetitions or None for no limit.
+    #  @param add If True add @p value to the compositor instead of setting
+    #  it.
+    #  @exception ValueError The period is not positive or the count is
+    #  less than 1.
+    def __init__(self, time, compositor_name, value, period=None, count=None,
+                 add=False):
+        if period is not None and not period > 0:
+            raise ValueError('Pulse period must be positive: %r' % (period,))
+        if count is not None and not count >= 1:
+            raise ValueError('Pulse count must be at least 1: %r' % (count,))
         ## The time when to change a concentration of the @p compositor_name
         #  compositor.
         self.time = time
@@ -25,3 +47,26 @@ class Pulse:
         self.compositor_name = compositor_name
         ## Compositor @p compositor_name concentration value at @p time.
         self.value = value
+        ## Time between repetitions or None for a single pulse.
+        self.period = period
+        ## Number of repetitions or None for no limit.
+        self.count = count
+        ## Flag if @p value is added to the compositor instead of set.
+        self.add = add
+
+    ## Times when the pulse happens before a stop time.
+    #  @param self The object pointer.
+    #  @param stop Stop time of the simulation.
+    #  @return Generator of increasing time points.
+    def times(self, stop):
+        if self.period is None:
+            if self.time < stop:
+                yield self.time
+            return
+        i = 0
+        while self.count is None or i < self.count:
+            t = self.time + i * self.period
+            if t >= stop:
+                break
+            yield t
+            i = i + 1
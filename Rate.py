@@ -6,6 +6,12 @@
 #  representation of a rate law involving compositors, constants,
 #  and potentially other functions (including of time).
 #
+#  The structured rate laws MassAction, MichaelisMenten and Hill are Rates
+#  too. Their rates are not parsed by sympy: BioSystem evaluates all of
+#  them with one vectorized kernel (RateKernel), so even models with many
+#  thousands of such reactions are built quickly. Their string form is the
+#  equivalent rate formula.
+#
 #  @author Eglė Plėštytė
 #  @date 2017-05-10
 
@@ -22,4 +28,159 @@ class Rate:
     #  @param self The object pointer.
     #  @return string representation of a rate law
     def __str__(self):
-        return self.rate_string
\ No newline at end of file
+        return self.rate_string
+
+    ## Structure of a structured rate law.
+    #  @param self The object pointer.
+    #  @return None for a rate formula; for structured rate laws a tuple
+    #  (kind, parameters, compositors) identifying the reaction, see
+    #  RateKernel.
+    def law(self):
+        return None
+
+
+## Mass-action rate law: the rate constant times the product of the
+#  reacting Compositor values, each raised to its order.
+#
+#  Example, the reaction 'A + E -k> B + E':
+#
+#  @code
+# Part('A + E -k> B + E', [dAdt, dBdt],
+#      [MassAction('k', ['A', 'E'], -1), MassAction('k', ['A', 'E'])])
+#  @endcode
+class MassAction(Rate):
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param constant Rate constant: a Constant name or a number.
+    #  @param reactants Names of the reacting Compositors, repeated for
+    #  higher orders, or a dictionary of names and orders.
+    #  @param coefficient Stoichiometric coefficient of the Compositor the
+    #  rate belongs to: negative if it is consumed, positive if produced.
+    def __init__(self, constant, reactants, coefficient=1):
+        orders = {}
+        if isinstance(reactants, dict):
+            orders.update(reactants)
+        else:
+            for name in reactants:
+                orders[name] = orders.get(name, 0) + 1
+        ## Rate constant: a Constant name or a number.
+        self.constant = constant
+        ## Sorted list of (Compositor name, order) pairs.
+        self.reactants = sorted(orders.items())
+        ## Stoichiometric coefficient of the Compositor.
+        self.coefficient = coefficient
+        factors = [_operand(constant)]
+        for (name, order) in self.reactants:
+            if order == 1:
+                factors.append(name)
+            else:
+                factors.append('%s**%s' % (name, _operand(order)))
+        Rate.__init__(self, _prefix(coefficient) + ' * '.join(factors))
+
+    ## Structure of the rate law.
+    #  @param self The object pointer.
+    #  @return Tuple ('mass-action', (constant,), ((name, order), ...)).
+    def law(self):
+        return ('mass-action', (self.constant,), tuple(self.reactants))
+
+
+## Michaelis-Menten rate law: vmax * S / (km + S), optionally times the
+#  value of an enzyme Compositor (then vmax is the catalytic constant).
+class MichaelisMenten(Rate):
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param vmax Maximal rate: a Constant name or a number.
+    #  @param km Michaelis constant: a Constant name or a number.
+    #  @param substrate Name of the substrate Compositor.
+    #  @param coefficient Stoichiometric coefficient of the Compositor the
+    #  rate belongs to.
+    #  @param enzyme Name of the enzyme Compositor or None.
+    def __init__(self, vmax, km, substrate, coefficient=1, enzyme=None):
+        ## Maximal rate: a Constant name or a number.
+        self.vmax = vmax
+        ## Michaelis constant: a Constant name or a number.
+        self.km = km
+        ## Name of the substrate Compositor.
+        self.substrate = substrate
+        ## Stoichiometric coefficient of the Compositor.
+        self.coefficient = coefficient
+        ## Name of the enzyme Compositor or None.
+        self.enzyme = enzyme
+        factors = [_operand(vmax)]
+        if enzyme is not None:
+            factors.append(enzyme)
+        factors.append(substrate)
+        Rate.__init__(self, '%s%s / (%s + %s)' % (
+            _prefix(coefficient), ' * '.join(factors), _operand(km),
+            substrate))
+
+    ## Structure of the rate law.
+    #  @param self The object pointer.
+    #  @return Tuple ('michaelis-menten', (vmax, km), (substrate, enzyme)).
+    def law(self):
+        return ('michaelis-menten', (self.vmax, self.km),
+                (self.substrate, self.enzyme))
+
+
+## Hill rate law: vmax * L**n / (k**n + L**n) for an activator L, or
+#  vmax * k**n / (k**n + L**n) for a repressor.
+class Hill(Rate):
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param vmax Maximal rate: a Constant name or a number.
+    #  @param k Half-saturation constant: a Constant name or a number.
+    #  @param n Hill coefficient: a Constant name or a number.
+    #  @param ligand Name of the activator or repressor Compositor.
+    #  @param coefficient Stoichiometric coefficient of the Compositor the
+    #  rate belongs to.
+    #  @param repressor If True @p ligand represses, else it activates.
+    def __init__(self, vmax, k, n, ligand, coefficient=1, repressor=False):
+        ## Maximal rate: a Constant name or a number.
+        self.vmax = vmax
+        ## Half-saturation constant: a Constant name or a number.
+        self.k = k
+        ## Hill coefficient: a Constant name or a number.
+        self.n = n
+        ## Name of the activator or repressor Compositor.
+        self.ligand = ligand
+        ## Stoichiometric coefficient of the Compositor.
+        self.coefficient = coefficient
+        ## Flag if @p ligand represses.
+        self.repressor = repressor
+        kn = '%s**%s' % (_operand(k), _operand(n))
+        ln = '%s**%s' % (ligand, _operand(n))
+        Rate.__init__(self, '%s%s * %s / (%s + %s)' % (
+            _prefix(coefficient), _operand(vmax), kn if repressor else ln,
+            kn, ln))
+
+    ## Structure of the rate law.
+    #  @param self The object pointer.
+    #  @return Tuple ('hill' or 'hill-repressor', (vmax, k, n), (ligand,)).
+    def law(self):
+        kind = 'hill-repressor' if self.repressor else 'hill'
+        return (kind, (self.vmax, self.k, self.n), (self.ligand,))
+
+
+## Rate formula operand of a Constant name or a number.
+#  @param value Name or number.
+#  @return String.
+def _operand(value):
+    if isinstance(value, str):
+        return value
+    if float(value) == int(value):
+        return '%d' % value
+    return '(%r)' % float(value)
+
+
+## Rate formula prefix of a stoichiometric coefficient.
+#  @param coefficient The coefficient.
+#  @return String.
+def _prefix(coefficient):
+    if coefficient == 1:
+        return ''
+    if coefficient == -1:
+        return '-'
+    return '%s * ' % _operand(coefficient)
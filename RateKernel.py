@@ -0,0 +1,456 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+## Vectorized evaluation of structured rate laws.
+#
+#  The structured rates (MassAction, MichaelisMenten, Hill) of a BioSystem
+#  are compiled into index arrays: one reaction per distinct rate law, the
+#  stoichiometry matrix S of these reactions, and per kind of law the
+#  indices of its Compositors and parameters. The rates of all reactions
+#  of a kind are then evaluated by a few numpy operations, without any
+#  symbolic work, and so are the analytic Jacobian and the derivatives with
+#  respect to the Constants.
+#
+#  Parameters are Constants (passed as the parameter vector p, like to the
+#  compiled functions of CompiledModel) or numbers, which are appended to
+#  p. The state vector is extended by a 1, which pads the Compositor
+#  indices of laws with fewer Compositors (for example mass-action
+#  reactions of lower order).
+#
+#  Derivatives are computed per slot, i.e. per pair of a reaction and one
+#  of its Compositors (or parameters), and summed into the entries of the
+#  Jacobian of the right-hand side S v by a constant sparse matrix.
+#
+#  For stochastic simulations the mass-action propensities count the ways
+#  to pick the reacting molecules: a reactant of order n contributes the
+#  falling factorial X (X - 1) ... (X - n + 1) instead of X^n. This needs
+#  integer orders; the propensity of a reaction with any other order is
+#  its rate.
+
+class RateKernel:
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param rates List of (Compositor index, structured Rate) pairs.
+    #  @param n Number of Compositors.
+    #  @param compositors Dictionary of Compositor names and indices.
+    #  @param constants Dictionary of Constant names and indices.
+    #  @exception ValueError A rate uses an unknown name.
+    def __init__(self, rates, n, compositors, constants):
+        from scipy.sparse import csr_matrix
+        ## Number of Compositors.
+        self.n = n
+        ## Number of Constants.
+        self.m = len(constants)
+        index = {}
+        laws = []
+        coefficients = {}
+        for (i, rate) in rates:
+            law = rate.law()
+            if law not in index:
+                index[law] = len(laws)
+                laws.append(law)
+            key = (i, index[law])
+            coefficients[key] = coefficients.get(key, 0.0) + \
+                float(rate.coefficient)
+        entries = sorted([(r, i, c) for ((i, r), c) in coefficients.items()
+                          if c != 0.0])
+        ## Stoichiometry matrix (Compositors x reactions), dense for small
+        #  systems, else scipy.sparse CSR.
+        self.S = csr_matrix(([c for (r, i, c) in entries],
+                             ([i for (r, i, c) in entries],
+                              [r for (r, i, c) in entries])),
+                            shape=(n, len(laws)))
+        if n * len(laws) <= 10000:
+            self.S = self.S.toarray()
+        columns = [[] for r in range(0, len(laws))]
+        for (r, i, c) in entries:
+            columns[r].append((i, c))
+
+        ## Numbers used as parameters, appended to the Constant values.
+        self.literals = []
+        literal_index = {}
+
+        def parameter(value):
+            if isinstance(value, str):
+                if value not in constants:
+                    raise ValueError('Unknown Constant %s in a rate law'
+                                     % value)
+                return constants[value]
+            value = float(value)
+            if value not in literal_index:
+                literal_index[value] = self.m + len(self.literals)
+                self.literals.append(value)
+            return literal_index[value]
+
+        def compositor(name):
+            if name is None:
+                return n
+            if name not in compositors:
+                raise ValueError('Unknown Compositor %s in a rate law'
+                                 % name)
+            return compositors[name]
+
+        ## Laws with resolved indices: (kind, parameter indices, Compositor
+        #  indices, or (Compositor index, order) pairs for mass action).
+        self.laws = []
+        for (kind, parameters, species) in laws:
+            if kind == 'mass-action':
+                species = tuple([(compositor(s), float(o))
+                                 for (s, o) in species])
+            else:
+                species = tuple([compositor(s) for s in species])
+            self.laws.append((kind, tuple([parameter(x) for x in
+                                           parameters]), species))
+        self.literals = np.array(self.literals, dtype=float)
+
+        # Mass action: the Compositors of every reaction, repeated by
+        # their orders if all its orders are integers, else with powers.
+        ma = [r for r in range(0, len(laws))
+              if self.laws[r][0] == 'mass-action']
+        slots = []
+        integer = []
+        for r in ma:
+            integer.append(integer_orders(self.laws[r][2]))
+            if integer[-1]:
+                slots.append([(s, 1.0) for (s, o) in self.laws[r][2]
+                              for k in range(0, int(o))])
+            else:
+                slots.append(list(self.laws[r][2]))
+        width = max([len(s) for s in slots] + [1])
+        ## Reaction indices of the mass-action laws.
+        self.ma_rows = np.array(ma, dtype=int)
+        ## Rate constant indices of the mass-action laws.
+        self.ma_k = np.array([self.laws[r][1][0] for r in ma], dtype=int)
+        ## Compositor indices of the mass-action laws (reactions x slots),
+        #  padded with n.
+        self.ma_idx = np.full((len(ma), width), n, dtype=int)
+        ## Orders of the mass-action slots or None if all are 1.
+        self.ma_pow = np.ones((len(ma), width))
+        ## Number of the earlier slots of the same Compositor, subtracted
+        #  from the counts in the propensities; 0 in the reactions of
+        #  orders which are not all integers.
+        self.ma_shift = np.zeros((len(ma), width))
+        for r in range(0, len(ma)):
+            for j in range(0, len(slots[r])):
+                self.ma_idx[r, j] = slots[r][j][0]
+                self.ma_pow[r, j] = slots[r][j][1]
+                if integer[r]:
+                    self.ma_shift[r, j] = list(
+                        self.ma_idx[r, :j]).count(self.ma_idx[r, j])
+        if np.all(self.ma_pow == 1.0):
+            self.ma_pow = None
+
+        mm = [r for r in range(0, len(laws))
+              if self.laws[r][0] == 'michaelis-menten']
+        ## Reaction indices of the Michaelis-Menten laws.
+        self.mm_rows = np.array(mm, dtype=int)
+        ## Maximal rate indices of the Michaelis-Menten laws.
+        self.mm_v = np.array([self.laws[r][1][0] for r in mm], dtype=int)
+        ## Michaelis constant indices of the Michaelis-Menten laws.
+        self.mm_km = np.array([self.laws[r][1][1] for r in mm], dtype=int)
+        ## Substrate indices of the Michaelis-Menten laws.
+        self.mm_s = np.array([self.laws[r][2][0] for r in mm], dtype=int)
+        ## Enzyme indices of the Michaelis-Menten laws, n if none.
+        self.mm_e = np.array([self.laws[r][2][1] for r in mm], dtype=int)
+
+        hill = [r for r in range(0, len(laws))
+                if self.laws[r][0] in ('hill', 'hill-repressor')]
+        ## Reaction indices of the Hill laws.
+        self.h_rows = np.array(hill, dtype=int)
+        ## Maximal rate indices of the Hill laws.
+        self.h_v = np.array([self.laws[r][1][0] for r in hill], dtype=int)
+        ## Half-saturation constant indices of the Hill laws.
+        self.h_k = np.array([self.laws[r][1][1] for r in hill], dtype=int)
+        ## Hill coefficient indices of the Hill laws.
+        self.h_n = np.array([self.laws[r][1][2] for r in hill], dtype=int)
+        ## Ligand indices of the Hill laws.
+        self.h_l = np.array([self.laws[r][2][0] for r in hill], dtype=int)
+        ## Flags of the Hill laws with a repressor.
+        self.h_rep = np.array([self.laws[r][0] == 'hill-repressor'
+                               for r in hill], dtype=bool)
+
+        # Slots of the Jacobian, in the order of jacobian, and of the
+        # parameter Jacobian, in the order of parameter_jacobian.
+        mask = self.ma_idx < n
+        state_slots = list(zip(np.repeat(self.ma_rows, mask.sum(axis=1)),
+                               self.ma_idx[mask]))
+        state_slots.extend(zip(self.mm_rows, self.mm_s))
+        enzyme = self.mm_e < n
+        state_slots.extend(zip(self.mm_rows[enzyme], self.mm_e[enzyme]))
+        state_slots.extend(zip(self.h_rows, self.h_l))
+        ## Masks selecting the parameter slots which are Constants.
+        self.pmasks = [self.ma_k < self.m, self.mm_v < self.m,
+                       self.mm_km < self.m, self.h_v < self.m,
+                       self.h_k < self.m, self.h_n < self.m]
+        parameter_slots = []
+        for (rows, params, selected) in zip(
+                [self.ma_rows, self.mm_rows, self.mm_rows, self.h_rows,
+                 self.h_rows, self.h_rows],
+                [self.ma_k, self.mm_v, self.mm_km, self.h_v, self.h_k,
+                 self.h_n], self.pmasks):
+            parameter_slots.extend(zip(rows[selected], params[selected]))
+        (self.jac_rows, self.jac_cols, self.A) = slot_matrix(
+            columns, state_slots)
+        (self.pjac_rows, self.pjac_cols, self.B) = slot_matrix(
+            columns, parameter_slots)
+
+    ## Number of reactions.
+    #  @param self The object pointer.
+    #  @return Number of columns of @p S.
+    def __len__(self):
+        return self.S.shape[1]
+
+    ## Extended state and parameter vectors.
+    #  @param self The object pointer.
+    #  @param y Compositor values, or one row per Compositor and one column
+    #  per batch member.
+    #  @param p Constant values, each one a scalar or a row of batch values.
+    #  @return Tuple (state with a row of ones appended, parameters with the
+    #  literals appended).
+    def extended(self, y, p):
+        y = np.asarray(y, dtype=float)
+        shape = y.shape[1:]
+        yy = np.concatenate((y, np.ones((1,) + shape)))
+        if not shape:
+            return (yy, np.concatenate((np.asarray(p, dtype=float),
+                                        self.literals)))
+        pp = np.empty((self.m + len(self.literals),) + shape)
+        for i in range(0, self.m):
+            pp[i] = p[i]
+        pp[self.m:] = self.literals.reshape((-1,) + (1,) * len(shape))
+        return (yy, pp)
+
+    ## Evaluate the rates of all reactions.
+    #  @param self The object pointer.
+    #  @param y Compositor values, or one row per Compositor and one column
+    #  per batch member.
+    #  @param p Constant values, each one a scalar or a row of batch values.
+    #  @return Array of reaction rates (one row per reaction for a batch).
+    def rates(self, y, p):
+        return self.evaluate(y, p, None)
+
+    ## Evaluate the propensities of all reactions, for molecule counts.
+    #  @param self The object pointer.
+    #  @param y Compositor counts, or one row per Compositor and one column
+    #  per batch member.
+    #  @param p Constant values, each one a scalar or a row of batch values.
+    #  @return Array of propensities (one row per reaction for a batch).
+    def propensities(self, y, p):
+        return self.evaluate(y, p, self.ma_shift)
+
+    ## Evaluate the rate laws.
+    #  @param self The object pointer.
+    #  @param y Compositor values, or one row per Compositor and one column
+    #  per batch member.
+    #  @param p Constant values, each one a scalar or a row of batch values.
+    #  @param shift Values subtracted from the mass-action slots or None.
+    #  @return Array of values (one row per reaction for a batch).
+    def evaluate(self, y, p, shift):
+        (yy, pp) = self.extended(y, p)
+        v = np.empty((len(self),) + yy.shape[1:])
+        if len(self.ma_rows):
+            F = yy[self.ma_idx]
+            if self.ma_pow is not None:
+                F = F ** self.expand(self.ma_pow, yy)
+            if shift is not None:
+                F = F - self.expand(shift, yy)
+            v[self.ma_rows] = pp[self.ma_k] * F.prod(axis=1)
+        if len(self.mm_rows):
+            S = yy[self.mm_s]
+            v[self.mm_rows] = (pp[self.mm_v] * yy[self.mm_e] * S /
+                               (pp[self.mm_km] + S))
+        if len(self.h_rows):
+            (Ln, Kn) = (yy[self.h_l] ** pp[self.h_n],
+                        pp[self.h_k] ** pp[self.h_n])
+            numerator = np.where(self.expand(self.h_rep, yy), Kn, Ln)
+            v[self.h_rows] = pp[self.h_v] * numerator / (Kn + Ln)
+        return v
+
+    ## Evaluate the contribution of the reactions to the right-hand side.
+    #  @param self The object pointer.
+    #  @param y Compositor values, or one row per Compositor and one column
+    #  per batch member.
+    #  @param p Constant values, each one a scalar or a row of batch values.
+    #  @return Rates of change of the Compositors, shaped like @p y.
+    def rhs(self, y, p):
+        return self.S.dot(self.rates(y, p))
+
+    ## Evaluate the Jacobian of the contribution to the right-hand side.
+    #  @param self The object pointer.
+    #  @param y Compositor values, or one row per Compositor and one column
+    #  per batch member.
+    #  @param p Constant values, each one a scalar or a row of batch values.
+    #  @return Values of the entries at (@p jac_rows, @p jac_cols) (one row
+    #  per entry for a batch).
+    def jacobian(self, y, p):
+        (yy, pp) = self.extended(y, p)
+        slots = []
+        if len(self.ma_rows):
+            G = yy[self.ma_idx]
+            dG = 1.0
+            if self.ma_pow is not None:
+                powers = self.expand(self.ma_pow, yy)
+                dG = powers * G ** (powers - 1.0)
+                G = G ** powers
+            D = np.empty(G.shape)
+            k = pp[self.ma_k]
+            for j in range(0, G.shape[1]):
+                D[:, j] = k * np.delete(G, j, axis=1).prod(axis=1)
+            slots.append((D * dG)[self.ma_idx < self.n])
+        if len(self.mm_rows):
+            (S, E) = (yy[self.mm_s], yy[self.mm_e])
+            (V, K) = (pp[self.mm_v], pp[self.mm_km])
+            slots.append(V * E * K / (K + S) ** 2)
+            slots.append((V * S / (K + S))[self.mm_e < self.n])
+        if len(self.h_rows):
+            (L, V, K, N) = (yy[self.h_l], pp[self.h_v], pp[self.h_k],
+                            pp[self.h_n])
+            sign = np.where(self.expand(self.h_rep, yy), -1.0, 1.0)
+            (Ln, Kn) = (L ** N, K ** N)
+            slots.append(sign * V * N * Kn * L ** (N - 1.0) / (Kn + Ln) ** 2)
+        return self.A.dot(self.concatenate(slots, yy))
+
+    ## Evaluate the Jacobian of the contribution to the right-hand side
+    #  with respect to the Constants.
+    #  @param self The object pointer.
+    #  @param y Compositor values.
+    #  @param p Constant values.
+    #  @return Values of the entries at (@p pjac_rows, @p pjac_cols).
+    def parameter_jacobian(self, y, p):
+        (yy, pp) = self.extended(y, p)
+        slots = []
+        if len(self.ma_rows):
+            F = yy[self.ma_idx]
+            if self.ma_pow is not None:
+                F = F ** self.expand(self.ma_pow, yy)
+            slots.append(F.prod(axis=1)[self.pmasks[0]])
+        if len(self.mm_rows):
+            (S, E) = (yy[self.mm_s], yy[self.mm_e])
+            (V, K) = (pp[self.mm_v], pp[self.mm_km])
+            slots.append((E * S / (K + S))[self.pmasks[1]])
+            slots.append((-V * E * S / (K + S) ** 2)[self.pmasks[2]])
+        if len(self.h_rows):
+            (L, V, K, N) = (yy[self.h_l], pp[self.h_v], pp[self.h_k],
+                            pp[self.h_n])
+            repressor = self.expand(self.h_rep, yy)
+            sign = np.where(repressor, -1.0, 1.0)
+            (Ln, Kn) = (L ** N, K ** N)
+            D = (Kn + Ln) ** 2
+            # L**n log(L) goes to 0 with L, so log(0) is never needed.
+            logs = (np.log(np.where(L > 0, L, 1.0)) -
+                    np.log(np.where(K > 0, K, 1.0)))
+            slots.append((np.where(repressor, Kn, Ln) /
+                          (Kn + Ln))[self.pmasks[3]])
+            slots.append((-sign * V * N * K ** (N - 1.0) * Ln /
+                          D)[self.pmasks[4]])
+            slots.append((sign * V * Ln * Kn * logs / D)[self.pmasks[5]])
+        return self.B.dot(self.concatenate(slots, yy))
+
+    ## Reshape a per reaction array to broadcast against batch values.
+    #  @param self The object pointer.
+    #  @param a The array.
+    #  @param yy Extended state.
+    #  @return Reshaped array.
+    def expand(self, a, yy):
+        return a.reshape(a.shape + (1,) * (yy.ndim - 1))
+
+    ## Concatenate slot values.
+    #  @param self The object pointer.
+    #  @param slots List of arrays of slot values.
+    #  @param yy Extended state.
+    #  @return Array of all slot values.
+    def concatenate(self, slots, yy):
+        if not slots:
+            return np.zeros((0,) + yy.shape[1:])
+        return np.concatenate(slots)
+
+    ## Compositors each reaction rate depends on.
+    #  @param self The object pointer.
+    #  @return List of sorted lists of Compositor indices.
+    def inputs(self):
+        result = []
+        for (kind, parameters, species) in self.laws:
+            if kind == 'mass-action':
+                species = [s for (s, o) in species]
+            result.append(sorted(set([s for s in species if s < self.n])))
+        return result
+
+    ## Function evaluating the propensity of a single reaction, used by the
+    #  stochastic next reaction method.
+    #  @param self The object pointer.
+    #  @param j Reaction index.
+    #  @return Function r(t, y, p) returning a list of one value.
+    def reaction_function(self, j):
+        (kind, parameters, species) = self.laws[j]
+        m = self.m
+        literals = self.literals
+
+        def value(p, k):
+            return p[k] if k < m else literals[k - m]
+
+        if kind == 'mass-action' and integer_orders(species):
+            def f(t, y, p):
+                v = value(p, parameters[0])
+                for (s, o) in species:
+                    for k in range(0, int(o)):
+                        v = v * (y[s] - k)
+                return [v]
+        elif kind == 'mass-action':
+            def f(t, y, p):
+                v = value(p, parameters[0])
+                for (s, o) in species:
+                    v = v * y[s] ** o
+                return [v]
+        elif kind == 'michaelis-menten':
+            def f(t, y, p):
+                S = y[species[0]]
+                E = 1.0 if species[1] == self.n else y[species[1]]
+                return [value(p, parameters[0]) * E * S /
+                        (value(p, parameters[1]) + S)]
+        else:
+            repressor = kind == 'hill-repressor'
+
+            def f(t, y, p):
+                N = value(p, parameters[2])
+                Ln = y[species[0]] ** N
+                Kn = value(p, parameters[1]) ** N
+                return [value(p, parameters[0]) *
+                        (Kn if repressor else Ln) / (Kn + Ln)]
+        return f
+
+
+## Tell if all the orders of a mass-action law are integers.
+#  @param species List of (Compositor index, order) pairs.
+#  @return True or False.
+def integer_orders(species):
+    return all([o == int(o) for (s, o) in species])
+
+
+## Matrix summing slot derivatives into the entries of S times the
+#  derivatives of the reaction rates.
+#  @param columns Per reaction list of (Compositor index, coefficient) pairs
+#  of the stoichiometry matrix.
+#  @param slots List of (reaction, variable index) pairs.
+#  @return Tuple (rows, cols, matrix) of the entry positions and the sparse
+#  matrix (entries x slots).
+def slot_matrix(columns, slots):
+    from scipy.sparse import csr_matrix
+    index = {}
+    rows = []
+    cols = []
+    values = []
+    for t in range(0, len(slots)):
+        (r, s) = slots[t]
+        for (i, c) in columns[r]:
+            key = (i, int(s))
+            if key not in index:
+                index[key] = len(index)
+            rows.append(index[key])
+            cols.append(t)
+            values.append(c)
+    positions = sorted(index, key=index.get)
+    A = csr_matrix((values, (rows, cols)), shape=(len(index), len(slots)))
+    return (np.array([i for (i, s) in positions], dtype=int),
+            np.array([s for (i, s) in positions], dtype=int), A)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+## Simulation result.
+#
+#  A Result holds the time points T and the matrix Y of Compositor values
+#  (one row per time point, one column per Compositor) of a simulation.
+#  It unpacks like the (T, Y) tuple returned by earlier versions, and a
+#  single Compositor trace can be taken by its name.
+#
+#  Results of many trajectories have Y of shape (trajectories, time
+#  points, Compositors); the trace of a Compositor is then a matrix with one
+#  row per trajectory.
+#
+#  Results of BioSystem.run_sensitivities also hold the sensitivities
+#  dY/dp of the Compositor values to Constants, aligned with Y.
+#
+#  Example:
+#
+#  @code
+# (T, Y) = sys.run([0, 25])
+# result = sys.run([0, 1e6], output='steps', threshold=1e-3)
+# plt.plot(result.T, result['A'])
+#  @endcode
+
+class Result:
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param T Time points.
+    #  @param Y Matrix of Compositor values at the time points.
+    #  @param names Compositor names in the order of the columns of @p Y.
+    #  @param sensitivities Dictionary of Constant names and matrices of
+    #  sensitivities shaped like @p Y or None.
+    def __init__(self, T, Y, names, sensitivities=None):
+        ## Time points.
+        self.T = T
+        ## Matrix of Compositor values at the time points.
+        self.Y = Y
+        ## Compositor names in the order of the columns of @p Y.
+        self.names = list(names)
+        ## A mapping between compositor name and its column in @p Y.
+        self.map_compositors = dict(zip(self.names,
+                                        range(0, len(self.names))))
+        ## Dictionary of Constant names and sensitivities dY/dp.
+        self.sensitivities = sensitivities or {}
+
+    ## Iterate as the tuple (T, Y).
+    #  @param self The object pointer.
+    #  @return Iterator over T and Y.
+    def __iter__(self):
+        return iter((self.T, self.Y))
+
+    ## Length of the tuple (T, Y).
+    #  @param self The object pointer.
+    #  @return 2.
+    def __len__(self):
+        return 2
+
+    ## Get T (0), Y (1) or the trace of a Compositor by its name.
+    #  @param self The object pointer.
+    #  @param key 0, 1 or a Compositor name.
+    #  @return The array.
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.Y[..., self.map_compositors[key]]
+        return (self.T, self.Y)[key]
+
+    ## Keep only the time points where some Compositor value changed by more
+    #  than @p threshold since the last kept point. The first and the last
+    #  points are always kept.
+    #  @param self The object pointer.
+    #  @param threshold Absolute change threshold.
+    #  @return New Result.
+    def decimate(self, threshold):
+        n = len(self.T)
+        if n <= 2:
+            return self
+        keep = [0]
+        last = self.Y[0]
+        for i in range(1, n - 1):
+            if np.max(np.abs(self.Y[i] - last)) > threshold:
+                keep.append(i)
+                last = self.Y[i]
+        keep.append(n - 1)
+        return self.select(keep)
+
+    ## Keep at most @p max_points evenly spread time points, including the
+    #  first and the last one.
+    #  @param self The object pointer.
+    #  @param max_points Maximum number of time points.
+    #  @return New Result.
+    def thin(self, max_points):
+        n = len(self.T)
+        if n <= max_points:
+            return self
+        keep = np.unique(np.round(
+            np.linspace(0, n - 1, max(max_points, 2))).astype(int))
+        return self.select(keep)
+
+    ## Keep only some time points.
+    #  @param self The object pointer.
+    #  @param keep Indices of the time points to keep.
+    #  @return New Result.
+    def select(self, keep):
+        sensitivities = {}
+        for (name, dY) in self.sensitivities.items():
+            sensitivities[name] = dY[keep]
+        return Result(self.T[keep], self.Y[keep], self.names, sensitivities)
+
+    ## Copy of the result with its own arrays.
+    #  @param self The object pointer.
+    #  @return New Result.
+    def copy(self):
+        sensitivities = {}
+        for (name, dY) in self.sensitivities.items():
+            sensitivities[name] = np.array(dY)
+        return Result(np.array(self.T), np.array(self.Y), self.names,
+                      sensitivities)
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import numbers
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+import numpy as np
+
+## Cache of simulation results.
+#
+#  Results of BioSystem.run and BioSystem.run_pulses depend only on the
+#  structure of the system (rates, Compositor and Constant names), the
+#  Constant values, the Compositor values the simulation starts from, the
+#  arguments of the call (time span, output policy, pulse schedule) and the
+#  solver settings. All of these are part of the key (see BioSystem
+#  result_key), so changing a Constant or an initial value or adding a Part
+#  simply leads to other keys, and results of the old state are never
+#  returned.
+#
+#  The most recently used results are kept in memory, bounded both by
+#  their number and by their total size; optionally results are also
+#  stored in a directory, so other processes and later runs can reuse
+#  them.
+#
+#  Example:
+#
+#  @code
+# sys.enableResultCache(maxsize=32, directory='/tmp/biosystem-results')
+# (T, Y) = sys.run([0, 25])   # simulated
+# (T, Y) = sys.run([0, 25])   # taken from the cache
+#  @endcode
+
+class ResultCache:
+
+    ## Version of the cached data, part of every key.
+    FORMAT = 1
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param maxsize Maximum number of results kept in memory.
+    #  @param max_bytes Maximum total size of the arrays of the results kept
+    #  in memory.
+    #  @param directory Directory to store results in or None for memory
+    #  only.
+    def __init__(self, maxsize=64, max_bytes=256 * 2 ** 20, directory=None):
+        ## Maximum number of results kept in memory.
+        self.maxsize = maxsize
+        ## Maximum total size of the results kept in memory, in bytes.
+        self.max_bytes = max_bytes
+        ## Directory to store results in or None.
+        self.directory = directory
+        ## Results kept in memory with their sizes, least recently used
+        #  first.
+        self.results = OrderedDict()
+        ## Total size of the results kept in memory, in bytes.
+        self.nbytes = 0
+        ## Number of results found in the cache.
+        self.hits = 0
+        ## Number of results not found in the cache.
+        self.misses = 0
+
+    ## Compute the cache key of a simulation.
+    #  @param self The object pointer.
+    #  @param items Everything the result depends on: strings, numbers,
+    #  arrays, lists, tuples and dictionaries of them, other objects by
+    #  their repr.
+    #  @return Hexadecimal key string.
+    def key(self, *items):
+        h = hashlib.sha256()
+        h.update(('%d\n' % self.FORMAT).encode('utf-8'))
+        for item in items:
+            feed(h, item)
+        return h.hexdigest()
+
+    ## Get a result from the cache.
+    #  @param self The object pointer.
+    #  @param key Cache key.
+    #  @return A copy of the Result or None if not cached.
+    def get(self, key):
+        entry = self.results.get(key)
+        if entry is not None:
+            self.results.move_to_end(key)
+            self.hits = self.hits + 1
+            return entry[0].copy()
+        path = self.path(key)
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    result = pickle.load(f)
+            except Exception:
+                result = None
+            if result is not None:
+                self.remember(key, result)
+                self.hits = self.hits + 1
+                return result.copy()
+        self.misses = self.misses + 1
+        return None
+
+    ## Put a result to the cache.
+    #  @param self The object pointer.
+    #  @param key Cache key.
+    #  @param result The Result to store; a copy is kept.
+    #  @return None.
+    def put(self, key, result):
+        result = result.copy()
+        self.remember(key, result)
+        path = self.path(key)
+        if path is not None:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Write to a temporary file first, so concurrent readers never
+            # see a partially written result.
+            (fd, tmp) = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        return None
+
+    ## Keep a result in memory, evicting the least recently used ones.
+    #  Results larger than @p max_bytes are not kept.
+    #  @param self The object pointer.
+    #  @param key Cache key.
+    #  @param result The Result to keep.
+    #  @return None.
+    def remember(self, key, result):
+        size = result_bytes(result)
+        if key in self.results:
+            self.nbytes = self.nbytes - self.results.pop(key)[1]
+        if size > self.max_bytes:
+            return None
+        self.results[key] = (result, size)
+        self.nbytes = self.nbytes + size
+        while len(self.results) > self.maxsize or \
+                self.nbytes > self.max_bytes:
+            self.nbytes = self.nbytes - self.results.popitem(last=False)[1][1]
+        return None
+
+    ## File name of a stored result.
+    #  @param self The object pointer.
+    #  @param key Cache key.
+    #  @return Path or None if results are kept in memory only.
+    def path(self, key):
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, key + '.result')
+
+    ## Remove all results from memory and, if @p stored is True, the
+    #  stored files too.
+    #  @param self The object pointer.
+    #  @param stored If True also remove the stored results.
+    #  @return None.
+    def clear(self, stored=False):
+        self.results.clear()
+        self.nbytes = 0
+        if stored and self.directory is not None and \
+                os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.result'):
+                    os.remove(os.path.join(self.directory, name))
+        return None
+
+
+## Add an item to a hash, with its type and delimiters, so different items
+#  never give the same bytes.
+#  @param h hashlib object.
+#  @param item The item.
+#  @return None.
+def feed(h, item):
+    if item is None or isinstance(item, (bool, str)):
+        h.update(('%s:%r\n' % (type(item).__name__, item)).encode('utf-8'))
+    elif isinstance(item, numbers.Real):
+        h.update(('f:%r\n' % float(item)).encode('utf-8'))
+    elif isinstance(item, np.ndarray):
+        a = np.ascontiguousarray(item, dtype=float)
+        h.update(('a:%r\n' % (a.shape,)).encode('utf-8'))
+        h.update(a.tobytes())
+    elif isinstance(item, (list, tuple)):
+        h.update(('l:%d[' % len(item)).encode('utf-8'))
+        for i in item:
+            feed(h, i)
+        h.update(b']')
+    elif isinstance(item, dict):
+        h.update(('d:%d{' % len(item)).encode('utf-8'))
+        for k in sorted(item, key=repr):
+            feed(h, k)
+            feed(h, item[k])
+        h.update(b'}')
+    else:
+        h.update(('o:%r\n' % (item,)).encode('utf-8'))
+    return None
+
+
+## Size of the arrays of a Result.
+#  @param result The Result.
+#  @return Size in bytes.
+def result_bytes(result):
+    size = np.asarray(result.T).nbytes + np.asarray(result.Y).nbytes
+    for v in result.sensitivities.values():
+        size = size + np.asarray(v).nbytes
+    return size
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+import os
+import socket
+import ModelDescription
+from Biosystem import BioSystem
+from Result import Result
+from SimulationServer import DEFAULT_ADDRESS, FRAME, message_parts, \
+    unpack_message
+
+## Client of a SimulationServer, simulating one model.
+#
+#  The client mirrors BioSystem.run and BioSystem.run_pulses; initial and
+#  Constant values can be replaced per call like with BioSystem.run_with.
+#  The model is sent to the server, as a description (ModelDescription),
+#  only if the server does not know it yet. A client serves one thread; concurrent callers use a client each,
+#  and the server integrates their run requests together.
+#
+#  Example:
+#
+#  @code
+# client = SimulationClient('model.biosystem')
+# (T, Y) = client.run([0, 25], constants={'k': 0.1})
+# (T, Y) = client.run_pulses(pulses, initial_values={'A': 5})
+# client.close()
+#  @endcode
+
+class SimulationClient:
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param model BioSystem or file name of a system saved by
+    #  BioSystem.save.
+    #  @param address Path of the Unix socket of the server.
+    #  @exception PermissionError The socket belongs to another user.
+    #  @exception RuntimeError The server rejected the model.
+    def __init__(self, model, address=DEFAULT_ADDRESS):
+        if isinstance(model, str):
+            model = BioSystem.load(model)
+        description = ModelDescription.describe(model)
+        ## Key of the model (see ModelDescription.key).
+        self.key = ModelDescription.key(description)
+        # Do not send models to a server of another user.
+        if os.stat(address).st_uid != os.getuid():
+            raise PermissionError('%s belongs to another user' % address)
+        ## Connection to the server.
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(address)
+        ## Id of the last request.
+        self.last_id = 0
+        (response, arrays) = self.request({'op': 'model',
+                                           'model': self.key})
+        if not response['known']:
+            self.request({'op': 'model', 'model': self.key,
+                          'description': description})
+
+    ## Run a simulation on the server.
+    #  @param self The object pointer.
+    #  @param tspan Time interval to simulate, for example [t0, t1].
+    #  @param initial_values Dictionary of Compositor names and initial
+    #  values, list of initial values of all Compositors or None.
+    #  @param constants Dictionary of Constant names and values or None.
+    #  @return Result.
+    def run(self, tspan, initial_values=None, constants=None):
+        return self.simulate({'op': 'run',
+                              'tspan': [float(t) for t in tspan]},
+                             initial_values, constants)
+
+    ## Run a pulsed simulation on the server (see BioSystem.run_pulses).
+    #  @param self The object pointer.
+    #  @param pulse_series List of Pulse objects.
+    #  @param initial_values Dictionary of Compositor names and initial
+    #  values, list of initial values of all Compositors or None.
+    #  @param constants Dictionary of Constant names and values or None.
+    #  @return Result.
+    def run_pulses(self, pulse_series, initial_values=None, constants=None):
+        pulses = [[float(p.time), p.compositor_name, float(p.value),
+                   p.period, p.count, bool(p.add)] for p in pulse_series]
+        return self.simulate({'op': 'run_pulses', 'pulses': pulses},
+                             initial_values, constants)
+
+    ## Send a simulation request.
+    #  @param self The object pointer.
+    #  @param header Request header without the values.
+    #  @param initial_values Initial values or None.
+    #  @param constants Constant values or None.
+    #  @return Result.
+    def simulate(self, header, initial_values, constants):
+        header['model'] = self.key
+        if isinstance(initial_values, dict):
+            header['initial_values'] = dict(
+                [(name, float(v)) for (name, v) in initial_values.items()])
+        elif initial_values is not None:
+            header['initial_values'] = [float(v) for v in initial_values]
+        if constants is not None:
+            header['constants'] = dict(
+                [(name, float(v)) for (name, v) in constants.items()])
+        (response, arrays) = self.request(header)
+        return Result(arrays['T'], arrays['Y'], response['names'])
+
+    ## Send a request and wait for its response.
+    #  @param self The object pointer.
+    #  @param header Dictionary of JSON values.
+    #  @param arrays List of (name, numpy array) pairs.
+    #  @return Tuple (header, arrays) of the response.
+    #  @exception RuntimeError The request failed on the server.
+    def request(self, header, arrays=()):
+        self.last_id = self.last_id + 1
+        header = dict(header)
+        header['id'] = self.last_id
+        for part in message_parts(header, arrays):
+            self.socket.sendall(part)
+        (size, length) = FRAME.unpack(self.receive(FRAME.size))
+        text = bytes(self.receive(size))
+        (response, arrays) = unpack_message(text, self.receive(length))
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return (response, arrays)
+
+    ## Receive an exact number of bytes.
+    #  @param self The object pointer.
+    #  @param size Number of bytes.
+    #  @return bytearray, so arrays decoded from it are writable.
+    #  @exception ConnectionError The server closed the connection.
+    def receive(self, size):
+        data = bytearray(size)
+        view = memoryview(data)
+        received = 0
+        while received < size:
+            count = self.socket.recv_into(view[received:])
+            if count == 0:
+                raise ConnectionError('Connection closed by the server')
+            received = received + count
+        return data
+
+    ## Close the connection.
+    #  @param self The object pointer.
+    #  @return None.
+    def close(self):
+        self.socket.close()
+        return None
@@ -0,0 +1,650 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import ModelDescription
+from ModelCache import ModelCache
+from Pulse import Pulse
+
+## Default address of the server for the current user.
+#  @return Path of a Unix socket in the runtime directory of the user
+#  ($XDG_RUNTIME_DIR) or else in a directory of the user in the temporary
+#  directory.
+def default_address():
+    directory = os.environ.get('XDG_RUNTIME_DIR')
+    if not directory:
+        directory = os.path.join(tempfile.gettempdir(),
+                                 'biosystem-%d' % os.getuid())
+    return os.path.join(directory, 'biosystem.sock')
+
+## Default address of the server: a Unix socket of the current user.
+DEFAULT_ADDRESS = default_address()
+
+## Frame of a message: the lengths of its JSON header and of its binary
+#  payload.
+FRAME = struct.Struct('!II')
+
+## Largest JSON header of a message, in bytes.
+MAX_HEADER = 64 << 20
+
+## Largest binary payload of a request, in bytes.
+MAX_PAYLOAD = 256 << 20
+
+## Type of all the arrays of messages.
+FLOAT = np.dtype('<f8')
+
+## Local simulation service.
+#
+#  Processes on a node that simulate the same models connect to one
+#  server (SimulationClient) instead of building and compiling their own
+#  BioSystem each. Models are sent once, as descriptions of JSON values
+#  (see ModelDescription), and identified by the hash of the description,
+#  so every client of the same model shares it. The server compiles them
+#  itself: the worker processes share the compiled models through a model
+#  cache in the directory of the server and keep them resident.
+#
+#  Concurrent run requests for the same model and time span are coalesced:
+#  requests arriving within @p window seconds of each other (up to
+#  @p max_batch of them) are integrated together by one BioSystem.sweep,
+#  vectorized over their initial and Constant values. Batched results
+#  therefore depend, within the solver tolerances, on the other requests
+#  of the batch (see BioSystem.sweep); with @p max_batch = 1 every request
+#  is run on its own. Pulsed runs are simulated one by one on the worker
+#  pool.
+#
+#  Messages are a frame (FRAME), a JSON header and the raw buffers of the
+#  float64 arrays described by the header, so results are sent without any
+#  conversion. Headers and payloads are limited in size (MAX_HEADER,
+#  MAX_PAYLOAD).
+#
+#  The rate formulas of a model are parsed by sympy, which evaluates them,
+#  so the server serves its own user only: it listens on a Unix socket
+#  (there is no network mode), created readable and writable only by its
+#  owner in a directory no other user can write to, and it drops
+#  connections of other users where the system tells the peer of a socket
+#  (SO_PEERCRED). Clients check that the socket belongs to their user.
+#
+#  Example:
+#
+#  @code
+# # python SimulationServer.py
+#
+# client = SimulationClient(sys)
+# (T, Y) = client.run([0, 25], constants={'k': 0.1})
+#  @endcode
+
+class SimulationServer:
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param address Path of the Unix socket. Its directory must not be
+    #  writable by other users; it is created if missing.
+    #  @param workers Number of worker processes, None for the number of
+    #  CPUs.
+    #  @param window Time in seconds to wait for more requests to batch.
+    #  @param max_batch Maximum number of requests integrated together.
+    #  @param directory Directory to keep the compiled models in or None
+    #  for a new temporary directory.
+    #  @exception ValueError The address is not a path.
+    def __init__(self, address=DEFAULT_ADDRESS, workers=None, window=0.002,
+                 max_batch=256, directory=None):
+        if not isinstance(address, str):
+            raise ValueError('The address must be the path of a Unix '
+                             'socket: %r' % (address,))
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix='biosystem-models-')
+        ## Path of the Unix socket.
+        self.address = address
+        ## Number of worker processes.
+        self.workers = workers or os.cpu_count() or 1
+        ## Time in seconds to wait for more requests to batch.
+        self.window = window
+        ## Maximum number of requests integrated together.
+        self.max_batch = max_batch
+        ## Directory of the compiled models.
+        self.directory = directory
+        ## Received models: their keys and descriptions.
+        self.models = {}
+        ## Names of the received models: their keys and tuples (Compositor
+        #  names, set of Constant names).
+        self.names = {}
+        ## Pending batches: (model key, time span) and lists of (member,
+        #  future) pairs.
+        self.batches = {}
+        ## Worker processes (ProcessPoolExecutor), created by start.
+        self.executor = None
+        ## asyncio server, created by start.
+        self.server = None
+        ## Number of simulation requests received.
+        self.requests = 0
+        ## Number of integrations run for them.
+        self.integrations = 0
+
+    ## Start listening.
+    #  @param self The object pointer.
+    #  @return The object pointer.
+    #  @exception PermissionError The directory of the socket is writable
+    #  by other users.
+    async def start(self):
+        private_directory(os.path.dirname(os.path.abspath(self.address)))
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_serve_init,
+            initargs=(os.path.join(self.directory, 'cache'),))
+        # Left over by a server that did not shut down cleanly.
+        remove_socket(self.address)
+        # Create the socket private, without a moment of wider access.
+        mask = os.umask(0o177)
+        try:
+            self.server = await asyncio.start_unix_server(
+                self.handle, path=self.address)
+        finally:
+            os.umask(mask)
+        return self
+
+    ## Serve until cancelled.
+    #  @param self The object pointer.
+    #  @return None.
+    async def serve(self):
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            self.close()
+        return None
+
+    ## Serve until interrupted, in a new event loop.
+    #  @param self The object pointer.
+    #  @return None.
+    def serve_forever(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        return None
+
+    ## Stop listening and shut the worker processes down.
+    #  @param self The object pointer.
+    #  @return None.
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            remove_socket(self.address)
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        return None
+
+    ## Serve one connection. Requests are answered as they finish, so a
+    #  client may send several before reading the responses, which carry
+    #  the ids of their requests.
+    #  @param self The object pointer.
+    #  @param reader asyncio.StreamReader of the connection.
+    #  @param writer asyncio.StreamWriter of the connection.
+    #  @return None.
+    async def handle(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            if not same_user(writer.get_extra_info('socket')):
+                return None
+            while True:
+                try:
+                    (header, arrays) = await read_message(reader,
+                                                          MAX_PAYLOAD)
+                except (asyncio.IncompleteReadError, ConnectionError,
+                        ValueError):
+                    # Closed, or not a valid message: drop the connection.
+                    break
+                task = asyncio.ensure_future(
+                    self.respond(header, arrays, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if len(tasks) > 0:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            writer.close()
+        return None
+
+    ## Answer a request.
+    #  @param self The object pointer.
+    #  @param header Header of the request.
+    #  @param arrays Arrays of the request.
+    #  @param writer asyncio.StreamWriter of the connection.
+    #  @param lock asyncio.Lock serializing the responses.
+    #  @return None.
+    async def respond(self, header, arrays, writer, lock):
+        try:
+            (response, buffers) = await self.dispatch(header, arrays)
+        except Exception as e:
+            (response, buffers) = ({'error': '%s: %s' % (
+                type(e).__name__, e)}, [])
+        response['id'] = header.get('id')
+        async with lock:
+            for part in message_parts(response, buffers):
+                writer.write(part)
+            await writer.drain()
+        return None
+
+    ## Execute a request.
+    #
+    #  Requests are dictionaries with the key 'op':
+    #  - 'model' with 'model' (the key of a model): tells if the model is
+    #    known, and adds it if its 'description' is sent too;
+    #  - 'run' with 'model', 'tspan' and optionally 'initial_values' and
+    #    'constants' (see BioSystem.run_with);
+    #  - 'run_pulses' with 'model', 'pulses' (lists of the Pulse arguments)
+    #    and optionally 'initial_values' and 'constants'.
+    #
+    #  @param self The object pointer.
+    #  @param header Header of the request.
+    #  @param arrays Arrays of the request.
+    #  @return Tuple (header, arrays) of the response.
+    #  @exception ValueError The operation is unknown.
+    #  @exception KeyError The model is unknown.
+    async def dispatch(self, header, arrays):
+        op = header.get('op')
+        if op == 'model':
+            return await self.add_model(header['model'],
+                                        header.get('description'))
+        if op not in ('run', 'run_pulses'):
+            raise ValueError('Unknown operation: %r' % (op,))
+        key = header['model']
+        if key not in self.models:
+            raise KeyError('Unknown model %s' % key)
+        self.requests = self.requests + 1
+        member = (header.get('initial_values'), header.get('constants'))
+        self.check(key, member)
+        if op == 'run':
+            (T, Y, names) = await self.batched(key, header['tspan'], member)
+        else:
+            self.integrations = self.integrations + 1
+            (T, Y, names) = await asyncio.get_running_loop().run_in_executor(
+                self.executor, _serve_pulses, key, self.models[key],
+                header['pulses'], member)
+        return ({'names': names}, [('T', T), ('Y', Y)])
+
+    ## Add a model unless already known.
+    #  @param self The object pointer.
+    #  @param key Key of the model (see ModelDescription.key).
+    #  @param description Description of the model (see ModelDescription)
+    #  or None.
+    #  @return Tuple (header, arrays) of the response, telling if the model
+    #  is known now.
+    #  @exception ValueError The description does not match the key or is
+    #  malformed.
+    async def add_model(self, key, description):
+        if key in self.models:
+            return ({'known': True}, [])
+        if description is None:
+            return ({'known': False}, [])
+        if ModelDescription.key(description) != key:
+            raise ValueError('Model description does not match its key')
+        # Compile it once, so a broken model is reported to its sender.
+        self.names[key] = await asyncio.get_running_loop().run_in_executor(
+            self.executor, _model_names, key, description)
+        self.models[key] = description
+        return ({'known': True}, [])
+
+    ## Check the initial and Constant values of a request, so a bad request
+    #  is rejected alone instead of failing the batch it would join.
+    #  @param self The object pointer.
+    #  @param key Key of the model.
+    #  @param member Tuple (initial values, constants) of the request.
+    #  @return None.
+    #  @exception KeyError A name is not a Compositor or Constant of the
+    #  model.
+    #  @exception ValueError A value is not a number or the list of initial
+    #  values does not match the Compositors.
+    def check(self, key, member):
+        (compositors, constants) = self.names[key]
+        (initial_values, constant_values) = member
+        values = []
+        if isinstance(initial_values, dict):
+            for (name, value) in initial_values.items():
+                if name not in compositors:
+                    raise KeyError('Unknown Compositor %s' % name)
+                values.append(value)
+        elif initial_values is not None:
+            if not isinstance(initial_values, list) or \
+                    len(initial_values) != len(compositors):
+                raise ValueError('Expected %d initial values'
+                                 % len(compositors))
+            values.extend(initial_values)
+        if constant_values is not None:
+            if not isinstance(constant_values, dict):
+                raise ValueError('Constants must be a dictionary')
+            for (name, value) in constant_values.items():
+                if name not in constants:
+                    raise KeyError('Unknown Constant %s' % name)
+                values.append(value)
+        for value in values:
+            if isinstance(value, bool) or \
+                    not isinstance(value, (int, float)):
+                raise ValueError('Not a number: %r' % (value,))
+        return None
+
+    ## Run a simulation as a member of a batch.
+    #  @param self The object pointer.
+    #  @param key Key of the model.
+    #  @param tspan Time interval to simulate.
+    #  @param member Tuple (initial values, constants) of the simulation.
+    #  @return Tuple (T, Y, names) of the time points, the Compositor values
+    #  and the Compositor names.
+    async def batched(self, key, tspan, member):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch_key = (key, tuple([float(t) for t in tspan]))
+        batch = self.batches.get(batch_key)
+        if batch is None:
+            batch = []
+            self.batches[batch_key] = batch
+            loop.call_later(self.window, self.flush, batch_key, batch)
+        batch.append((member, future))
+        if len(batch) >= self.max_batch:
+            self.flush(batch_key, batch)
+        return await future
+
+    ## Integrate a batch on the worker pool, unless it was already flushed.
+    #  @param self The object pointer.
+    #  @param batch_key Tuple (model key, time span) of the batch.
+    #  @param batch List of (member, future) pairs.
+    #  @return None.
+    def flush(self, batch_key, batch):
+        if self.batches.get(batch_key) is not batch:
+            return None
+        del self.batches[batch_key]
+        self.integrations = self.integrations + 1
+        (key, tspan) = batch_key
+        task = asyncio.get_running_loop().run_in_executor(
+            self.executor, _serve_runs, key, self.models[key], list(tspan),
+            [member for (member, future) in batch])
+        task.add_done_callback(lambda task: deliver(batch, task))
+        return None
+
+
+## Pass the results of a batch to the waiting requests.
+#  @param batch List of (member, future) pairs.
+#  @param task Finished future of the list of the outcomes of the members,
+#  each one a tuple (T, Y, names) or an exception.
+#  @return None.
+def deliver(batch, task):
+    error = task.exception()
+    for b in range(0, len(batch)):
+        future = batch[b][1]
+        if future.done():
+            continue
+        outcome = error if error is not None else task.result()[b]
+        if isinstance(outcome, BaseException):
+            future.set_exception(outcome)
+        else:
+            future.set_result(outcome)
+    return None
+
+## Message parts to send: the frame with the header, then the buffers of
+#  the arrays, which are not copied unless they are not float64.
+#  @param header Dictionary of JSON values.
+#  @param arrays List of (name, numpy array) pairs.
+#  @return List of bytes-like objects.
+def message_parts(header, arrays):
+    header = dict(header)
+    header['arrays'] = []
+    buffers = []
+    length = 0
+    for (name, a) in arrays:
+        a = np.ascontiguousarray(a, dtype=FLOAT)
+        header['arrays'].append([name, a.dtype.str, list(a.shape)])
+        buffers.append(memoryview(a.reshape(-1)).cast('B'))
+        length = length + a.nbytes
+    text = json.dumps(header).encode('utf-8')
+    return [FRAME.pack(len(text), length) + text] + buffers
+
+## Decode a message.
+#  @param text JSON header.
+#  @param payload Bytes of the arrays; the arrays share its memory.
+#  @return Tuple (header, arrays) of the header dictionary and the
+#  dictionary of array names and arrays.
+#  @exception ValueError The header is invalid, an array is not float64 or
+#  the arrays do not fill the payload exactly.
+def unpack_message(text, payload):
+    header = json.loads(text.decode('utf-8'))
+    if not isinstance(header, dict):
+        raise ValueError('Message header is not a dictionary')
+    arrays = {}
+    offset = 0
+    for (name, dtype, shape) in header.pop('arrays', []):
+        if dtype != FLOAT.str:
+            raise ValueError('Array %s is not float64: %r' % (name, dtype))
+        if not isinstance(shape, list) or not all(
+                [isinstance(s, int) and s >= 0 for s in shape]):
+            raise ValueError('Invalid shape of array %s' % name)
+        count = int(np.prod(shape))
+        if offset + count * FLOAT.itemsize > len(payload):
+            raise ValueError('Array %s exceeds the payload' % name)
+        arrays[name] = np.frombuffer(payload, FLOAT, count,
+                                     offset).reshape(shape)
+        offset = offset + count * FLOAT.itemsize
+    if offset != len(payload):
+        raise ValueError('Payload does not match the arrays')
+    return (header, arrays)
+
+## Read a message from an asyncio stream.
+#  @param reader asyncio.StreamReader.
+#  @param max_payload Largest payload accepted, in bytes.
+#  @return Tuple (header, arrays), see unpack_message.
+#  @exception ValueError The message is too large or invalid.
+async def read_message(reader, max_payload):
+    (size, length) = FRAME.unpack(await reader.readexactly(FRAME.size))
+    if size > MAX_HEADER or length > max_payload:
+        raise ValueError('Message too large')
+    text = await reader.readexactly(size)
+    return unpack_message(text, await reader.readexactly(length))
+
+## Models built by the current worker process.
+_served_models = {}
+
+## ModelCache shared by the worker processes.
+_served_cache = None
+
+## Worker process initializer.
+#  @param directory Directory of the model cache.
+#  @return None.
+def _serve_init(directory):
+    global _served_cache
+    _served_cache = ModelCache(directory=directory)
+    return None
+
+## Get a model in a worker process, building it when first used.
+#  @param key Key of the model.
+#  @param description Description of the model.
+#  @return BioSystem.
+def _served_model(key, description):
+    system = _served_models.get(key)
+    if system is None:
+        system = ModelDescription.build(description)
+        system.model_cache = _served_cache
+        system.determine_rates()
+        _served_models[key] = system
+    return system
+
+## Initial and Constant values of a request as dictionaries.
+#  @param system BioSystem.
+#  @param member Tuple (initial values, constants); initial values may
+#  also be a list of the values of all Compositors.
+#  @return Tuple (initial values, constants).
+def _member_values(system, member):
+    (initial_values, constants) = member
+    if initial_values is not None and not isinstance(initial_values, dict):
+        initial_values = dict(zip([c.name for c in system.compositors],
+                                  initial_values))
+    return (initial_values or {}, constants or {})
+
+## Load a model in a worker process and get its names.
+#  @param key Key of the model.
+#  @param description Description of the model.
+#  @return Tuple (Compositor names, set of Constant names).
+def _model_names(key, description):
+    system = _served_model(key, description)
+    return ([c.name for c in system.compositors],
+            set([c.name for c in system.constants]))
+
+## Simulate one run of a model.
+#  @param system BioSystem.
+#  @param tspan Time interval to simulate.
+#  @param member Tuple (initial values, constants).
+#  @return Tuple (T, Y, names) or the exception raised by the run.
+def _serve_run(system, tspan, member):
+    try:
+        (initial_values, constants) = _member_values(system, member)
+        with system.replaced_values(initial_values, constants):
+            result = system.run(tspan)
+    except Exception as e:
+        return e
+    return (np.asarray(result.T), np.asarray(result.Y),
+            [c.name for c in system.compositors])
+
+## Simulate a batch of runs of a model in a worker process.
+#  Equal members are simulated once; the others together by
+#  BioSystem.sweep. If the sweep fails, the members are simulated one by
+#  one, so a failing member does not fail the others.
+#  @param key Key of the model.
+#  @param description Description of the model.
+#  @param tspan Time interval to simulate.
+#  @param members List of (initial values, constants) tuples.
+#  @return List of the outcomes of the members, each one a tuple (T, Y,
+#  names) or the exception the member failed with.
+def _serve_runs(key, description, tspan, members):
+    system = _served_model(key, description)
+    names = [c.name for c in system.compositors]
+    index = {}
+    unique = []
+    first = []
+    rows = []
+    for m in range(0, len(members)):
+        (initial_values, constants) = _member_values(system, members[m])
+        values = dict(initial_values)
+        values.update(constants)
+        identity = tuple(sorted(values.items()))
+        if identity not in index:
+            index[identity] = len(unique)
+            unique.append(values)
+            first.append(m)
+        rows.append(index[identity])
+    if len(unique) > 1:
+        try:
+            (T, Y) = _serve_sweep(system, tspan, unique)
+            return [(T, Y[r], names) for r in rows]
+        except Exception:
+            # A member the integrator fails on fails the whole sweep; the
+            # runs one by one below tell which one.
+            pass
+    outcomes = [_serve_run(system, tspan, members[m]) for m in first]
+    return [outcomes[r] for r in rows]
+
+## Simulate runs of a model together by BioSystem.sweep.
+#  @param system BioSystem.
+#  @param tspan Time interval to simulate.
+#  @param unique List of dictionaries of the initial and Constant values
+#  of the runs.
+#  @return Tuple (T, Y), Y with one row per run.
+#  @exception KeyError A name is not a Compositor or Constant.
+def _serve_sweep(system, tspan, unique):
+    sweep = {}
+    for u in range(0, len(unique)):
+        for (name, value) in unique[u].items():
+            if name not in sweep:
+                if name in system.map_constants:
+                    current = system.constants[
+                        system.map_constants[name]].value
+                elif name in system.map_compositors:
+                    current = system.compositors[
+                        system.map_compositors[name]].value
+                else:
+                    raise KeyError(name)
+                sweep[name] = np.full(len(unique), float(current))
+            sweep[name][u] = value
+    (T, Y) = system.sweep(tspan, sweep)
+    return (np.asarray(T), Y)
+
+## Simulate a pulsed run of a model in a worker process.
+#  @param key Key of the model.
+#  @param description Description of the model.
+#  @param pulses Lists of the Pulse arguments.
+#  @param member Tuple (initial values, constants).
+#  @return Tuple (T, Y, names).
+def _serve_pulses(key, description, pulses, member):
+    system = _served_model(key, description)
+    (initial_values, constants) = _member_values(system, member)
+    with system.replaced_values(initial_values, constants):
+        result = system.run_pulses([Pulse(*p) for p in pulses])
+    return (np.asarray(result.T), np.asarray(result.Y), result.names)
+
+## Make sure a directory is private to the current user, creating it if
+#  missing.
+#  @param path The directory.
+#  @return None.
+#  @exception PermissionError It is not a directory of the user or other
+#  users can write to it.
+def private_directory(path):
+    if not os.path.exists(path):
+        os.makedirs(path, 0o700)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or \
+            info.st_mode & 0o022:
+        raise PermissionError('%s must be a directory of the user not '
+                              'writable by others' % path)
+    return None
+
+## Tell if the peer of a Unix socket is the current user.
+#  @param sock The connected socket.
+#  @return False if the peer is known to be another user.
+def same_user(sock):
+    if sock is None or not hasattr(socket, 'SO_PEERCRED'):
+        return True
+    credentials = struct.Struct('3i')
+    (pid, uid, gid) = credentials.unpack(sock.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, credentials.size))
+    return uid == os.getuid()
+
+## Remove a Unix socket, but no other kind of file.
+#  @param path File name of the socket.
+#  @return None.
+def remove_socket(path):
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return None
+    if stat.S_ISSOCK(mode):
+        os.remove(path)
+    return None
+
+## Command line entry point.
+#  @param argv Arguments (without the program name) or None for sys.argv.
+#  @return Exit status.
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Serve BioSystem simulations to local clients.')
+    parser.add_argument('--address', default=DEFAULT_ADDRESS,
+                        help='Unix socket path (default %s)'
+                        % DEFAULT_ADDRESS)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--window', type=float, default=0.002,
+                        help='seconds to wait for requests to batch')
+    parser.add_argument('--max-batch', type=int, default=256)
+    args = parser.parse_args(argv)
+    SimulationServer(args.address, args.workers,
+                     args.window, args.max_batch).serve_forever()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
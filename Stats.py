@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import time
+
+## Instrumentation of a BioSystem.
+#
+#  Stats collects, while enabled on a BioSystem (BioSystem.enableStats):
+#  - the time spent in every phase (parsing, building the reaction network,
+#    code generation, cache lookups, Jacobian, integration, pulses, ...)
+#    and the number of times it was entered;
+#  - the number of right-hand side and Jacobian evaluations requested by
+#    the solvers;
+#  - solver statistics: steps, function and Jacobian evaluations, LU
+#    decompositions, method switches, the smallest and the largest step
+#    and the highest order used (as far as each solver reports them; the
+#    scipy solvers do not report rejected steps);
+#  - the largest output buffers allocated, in bytes.
+#
+#  Hooks are functions hook(event, name, value) called on every finished
+#  phase ('phase', name, seconds), solver run ('solver', solver name,
+#  dictionary of statistics) and buffer allocation ('buffer', name, bytes).
+#
+#  When stats are disabled (the default) none of this is done; the
+#  simulation code only checks whether stats are enabled once per phase or
+#  solver run.
+#
+#  Example:
+#
+#  @code
+# stats = sys.enableStats()
+# sys.run([0, 25])
+# print(stats)
+#  @endcode
+
+class Stats:
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param hook Function hook(event, name, value) or None.
+    def __init__(self, hook=None):
+        ## Hook functions.
+        self.hooks = []
+        if hook is not None:
+            self.hooks.append(hook)
+        self.reset()
+
+    ## Forget all the collected statistics.
+    #  @param self The object pointer.
+    #  @return The object pointer.
+    def reset(self):
+        ## Total seconds spent in every phase.
+        self.times = {}
+        ## Number of times every phase was entered.
+        self.phases = {}
+        ## Evaluation counters: 'rhs' and 'jacobian'.
+        self.counts = {'rhs': 0, 'jacobian': 0}
+        ## Accumulated solver statistics.
+        self.solver = {'runs': 0, 'steps': 0, 'rhs_evaluations': 0,
+                       'jacobian_evaluations': 0, 'lu_decompositions': 0,
+                       'method_switches': 0, 'min_step': None,
+                       'max_step': None, 'max_order': None}
+        ## Largest allocated output buffer of every kind, in bytes.
+        self.buffers = {}
+        return self
+
+    ## Add a hook function.
+    #  @param self The object pointer.
+    #  @param hook Function hook(event, name, value).
+    #  @return The object pointer.
+    def addHook(self, hook):
+        self.hooks.append(hook)
+        return self
+
+    ## Call the hooks.
+    #  @param self The object pointer.
+    #  @param event 'phase', 'solver' or 'buffer'.
+    #  @param name Name of the phase, solver or buffer.
+    #  @param value Seconds, dictionary of statistics or bytes.
+    #  @return None.
+    def emit(self, event, name, value):
+        for hook in self.hooks:
+            hook(event, name, value)
+        return None
+
+    ## Context manager timing a phase.
+    #  @param self The object pointer.
+    #  @param name Name of the phase.
+    #  @return Context manager.
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    ## Record the time of a finished phase.
+    #  @param self The object pointer.
+    #  @param name Name of the phase.
+    #  @param seconds Time spent.
+    #  @return None.
+    def add_time(self, name, seconds):
+        self.times[name] = self.times.get(name, 0.0) + seconds
+        self.phases[name] = self.phases.get(name, 0) + 1
+        if self.hooks:
+            self.emit('phase', name, seconds)
+        return None
+
+    ## Wrap a function to count its calls.
+    #  @param self The object pointer.
+    #  @param name Counter name: 'rhs' or 'jacobian'.
+    #  @param f Function or None.
+    #  @return Counting function or None.
+    def counted(self, name, f):
+        if f is None or not callable(f):
+            return f
+        counts = self.counts
+
+        def counting(*args):
+            counts[name] = counts[name] + 1
+            return f(*args)
+        return counting
+
+    ## Record the statistics of a solver run.
+    #  @param self The object pointer.
+    #  @param name Solver name.
+    #  @param info Dictionary of statistics: the infodict of odeint
+    #  (full_output) or the nfev, njev and nlu counts of solve_ivp.
+    #  @return None.
+    def add_solver(self, name, info):
+        s = self.solver
+        s['runs'] = s['runs'] + 1
+        run = {}
+        if 'nst' in info:
+            # odeint reports cumulative counts at every output time.
+            run['steps'] = int(info['nst'][-1])
+            run['rhs_evaluations'] = int(info['nfe'][-1])
+            run['jacobian_evaluations'] = int(info['nje'][-1])
+            used = info['mused'][info['nst'] > 0]
+            run['method_switches'] = int((used[1:] != used[:-1]).sum())
+            steps = info['hu'][info['nst'] > 0]
+            if len(steps) > 0:
+                run['min_step'] = float(steps.min())
+                run['max_step'] = float(steps.max())
+                run['max_order'] = int(info['nqu'].max())
+        else:
+            run['steps'] = int(info.get('steps', 0))
+            run['rhs_evaluations'] = int(info.get('nfev', 0))
+            run['jacobian_evaluations'] = int(info.get('njev', 0))
+            run['lu_decompositions'] = int(info.get('nlu', 0))
+        for key in ('steps', 'rhs_evaluations', 'jacobian_evaluations',
+                    'lu_decompositions', 'method_switches'):
+            s[key] = s[key] + run.get(key, 0)
+        for (key, better) in (('min_step', min), ('max_step', max),
+                              ('max_order', max)):
+            if key in run:
+                if s[key] is None:
+                    s[key] = run[key]
+                else:
+                    s[key] = better(s[key], run[key])
+        if self.hooks:
+            self.emit('solver', name, run)
+        return None
+
+    ## Record an allocated output buffer.
+    #  @param self The object pointer.
+    #  @param name Kind of the buffer.
+    #  @param array The buffer.
+    #  @return None.
+    def add_buffer(self, name, array):
+        size = int(array.nbytes)
+        self.buffers[name] = max(self.buffers.get(name, 0), size)
+        if self.hooks:
+            self.emit('buffer', name, size)
+        return None
+
+    ## All the statistics as one dictionary.
+    #  @param self The object pointer.
+    #  @return Dictionary with the keys times, phases, counts, solver and
+    #  buffers.
+    def summary(self):
+        return {'times': dict(self.times), 'phases': dict(self.phases),
+                'counts': dict(self.counts), 'solver': dict(self.solver),
+                'buffers': dict(self.buffers)}
+
+    ## Readable report of the statistics.
+    #  @param self The object pointer.
+    #  @return Report string.
+    def __str__(self):
+        lines = ['Phases:']
+        for name in sorted(self.times, key=self.times.get, reverse=True):
+            lines.append('  %-12s %10.6f s  (%d)' % (
+                name, self.times[name], self.phases[name]))
+        lines.append('Evaluations: rhs %(rhs)d, jacobian %(jacobian)d'
+                     % self.counts)
+        lines.append('Solver: ' + ', '.join(
+            ['%s %s' % (k, v) for (k, v) in sorted(self.solver.items())
+             if v is not None]))
+        if self.buffers:
+            lines.append('Buffers: ' + ', '.join(
+                ['%s %d B' % (k, v) for (k, v) in
+                 sorted(self.buffers.items())]))
+        return '\n'.join(lines)
+
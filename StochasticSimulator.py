@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from IndexedPriorityQueue import IndexedPriorityQueue
+
+## Maximum number of times a tau leap is halved after leading to negative
+#  counts. Below that length a leap is accepted as it is, like a reaction
+#  event of the exact methods, which do not check counts either.
+MAX_HALVINGS = 30
+
+## Stochastic simulation of the reaction network of a BioSystem.
+#
+#  The reactions and their propensities come from the CompiledModel of the
+#  system: compositor values are molecule counts, the propensities are the
+#  reaction rates with the combinatorial factors of higher order reactants
+#  (see BioSystem.propensity_expressions) and every firing of reaction j
+#  changes the counts by the column j of the stoichiometry matrix.
+#  Propensities depending on time are treated as constant between reaction
+#  events.
+#
+#  Three methods are available:
+#  - direct: Gillespie's direct method, simulating a batch of trajectories
+#    together with vectorized propensity evaluations;
+#  - next_reaction: the next reaction method of Gibson and Bruck for one
+#    trajectory, which after each event updates only the propensities
+#    depending on the changed compositors (dependency graph) and keeps the
+#    reaction times in an indexed priority queue; best for large networks;
+#  - tau_leap: explicit tau-leaping of a batch of trajectories with a fixed
+#    maximum step. A leap making any count of a trajectory negative is
+#    rejected and the trajectory takes two leaps of half the length
+#    instead (up to MAX_HALVINGS times), so counts stay non-negative and
+#    the reactions conserve what they conserve.
+#
+#  Results are sampled on the given time points; the value at a time point
+#  is the state after all the events up to and including that time.
+#  Pulses are given as a sorted list of (time, compositor index, value, add)
+#  tuples and are applied to all the trajectories at their times.
+
+class StochasticSimulator:
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param model CompiledModel of the system.
+    #  @param p Constant values.
+    #  @param rng numpy.random.Generator to draw random numbers from.
+    def __init__(self, model, p, rng):
+        ## CompiledModel of the system.
+        self.model = model
+        ## Constant values.
+        self.p = p
+        ## Random number generator.
+        self.rng = rng
+        ## Dense stoichiometry matrix (compositors x reactions).
+        self.S = model.S
+        if not isinstance(self.S, np.ndarray):
+            self.S = self.S.toarray()
+
+    ## Evaluate the propensities of a batch of trajectories.
+    #  Needs the propensities of the model (CompiledModel.setPropensities).
+    #  @param self The object pointer.
+    #  @param t Times of the trajectories.
+    #  @param X Counts, one column per trajectory.
+    #  @return Array of propensities, one column per trajectory.
+    def propensities(self, t, X):
+        return np.maximum(self.model.propensities(t, X, self.p), 0.0)
+
+    ## Split a simulation into segments between pulses.
+    #  @param self The object pointer.
+    #  @param T Time points.
+    #  @param events Sorted list of pulse tuples.
+    #  @return Generator of (segment end time, pulse tuple or None).
+    def segments(self, T, events):
+        for event in events:
+            if T[0] < event[0] < T[-1]:
+                yield (event[0], event)
+        yield (T[-1], None)
+
+    ## Apply the pulses at or before the start time to the initial counts.
+    #  @param self The object pointer.
+    #  @param x0 Initial counts.
+    #  @param T Time points.
+    #  @param events Sorted list of pulse tuples.
+    #  @return Array of counts.
+    def initial_counts(self, x0, T, events):
+        x = np.array(x0, dtype=float)
+        for event in events:
+            if event[0] <= T[0]:
+                apply_pulse(x, event)
+        return x
+
+    ## Gillespie's direct method for a batch of trajectories.
+    #  @param self The object pointer.
+    #  @param x0 Initial counts.
+    #  @param T Time points.
+    #  @param batch Number of trajectories.
+    #  @param events Sorted list of pulse tuples.
+    #  @return Array of counts (trajectories x time points x compositors).
+    def direct(self, x0, T, batch, events):
+        m = len(T)
+        x0 = self.initial_counts(x0, T, events)
+        X = np.tile(x0[:, None], (1, batch))
+        Y = np.empty((batch, m, len(x0)))
+        t = np.full(batch, float(T[0]))
+        k = np.zeros(batch, dtype=int)
+        for (stop, event) in self.segments(T, events):
+            while True:
+                active = np.flatnonzero(t < stop)
+                if len(active) == 0:
+                    break
+                V = self.propensities(t[active], X[:, active])
+                a0 = V.sum(0)
+                with np.errstate(divide='ignore'):
+                    t_next = (t[active] +
+                              self.rng.exponential(size=len(active)) / a0)
+                fire = t_next < stop
+                t_next = np.where(fire, t_next, stop)
+                self.record(Y, X, T, k, active, t_next)
+                # Choose the reactions to fire with probabilities a_j / a0.
+                f = np.flatnonzero(fire)
+                if len(f) > 0:
+                    r = self.rng.random(len(f)) * a0[f]
+                    C = np.cumsum(V[:, f], axis=0)
+                    j = np.minimum((C < r).sum(0), V.shape[0] - 1)
+                    X[:, active[f]] += self.S[:, j]
+                t[active] = t_next
+            if event is not None:
+                apply_pulse(X, event)
+        self.record(Y, X, T, k, np.arange(0, batch), np.inf)
+        return Y
+
+    ## Record the counts of some trajectories at the time points before
+    #  their next event.
+    #  @param self The object pointer.
+    #  @param Y Array of results (trajectories x time points x compositors).
+    #  @param X Counts, one column per trajectory.
+    #  @param T Time points.
+    #  @param k Index of the next time point to record of every trajectory.
+    #  @param idx Indices of the trajectories to record.
+    #  @param until Times of the next events of the trajectories.
+    #  @return None.
+    def record(self, Y, X, T, k, idx, until):
+        end = np.searchsorted(T, until, side='left')
+        counts = np.maximum(end - k[idx], 0)
+        if np.any(counts > 0):
+            rows = np.repeat(idx, counts)
+            starts = np.repeat(np.cumsum(counts) - counts, counts)
+            cols = np.arange(0, len(rows)) - starts + np.repeat(k[idx], counts)
+            Y[rows, cols] = X[:, rows].T
+            k[idx] = k[idx] + counts
+        return None
+
+    ## Gibson and Bruck's next reaction method for one trajectory.
+    #  Needs the single reaction propensity functions of the model.
+    #  @param self The object pointer.
+    #  @param x0 Initial counts.
+    #  @param T Time points.
+    #  @param events Sorted list of pulse tuples.
+    #  @return Array of counts (time points x compositors).
+    def next_reaction(self, x0, T, events):
+        f = self.model.reaction_functions
+        p = self.p
+        n = len(x0)
+        R = len(f)
+        changes = [[(i, self.S[i, j]) for i in np.flatnonzero(self.S[:, j])]
+                   for j in range(0, R)]
+        # Dependency graph: the reactions whose rates change when reaction
+        # j fires.
+        users = [[] for i in range(0, n)]
+        for j in range(0, R):
+            for i in self.model.reaction_inputs[j]:
+                users[i].append(j)
+        dependents = []
+        for j in range(0, R):
+            d = set([j])
+            for (i, change) in changes[j]:
+                d.update(users[i])
+            dependents.append(sorted(d))
+
+        x = list(self.initial_counts(x0, T, events))
+        Y = np.empty((len(T), n))
+        k = 0
+        t = float(T[0])
+        (a, queue) = self.reaction_times(t, x)
+        for (stop, event) in self.segments(T, events):
+            while True:
+                (tau, mu) = queue.top()
+                if tau >= stop:
+                    break
+                while T[k] < tau:
+                    Y[k] = x
+                    k = k + 1
+                t = tau
+                for (i, change) in changes[mu]:
+                    x[i] = x[i] + change
+                for j in dependents[mu]:
+                    a_new = max(f[j](t, x, p)[0], 0.0)
+                    if a_new <= 0.0:
+                        new_time = np.inf
+                    elif j == mu or a[j] <= 0.0:
+                        new_time = t + self.rng.exponential() / a_new
+                    else:
+                        new_time = t + (a[j] / a_new) * (queue.times[j] - t)
+                    a[j] = a_new
+                    queue.update(j, new_time)
+            while k < len(T) and T[k] < stop:
+                Y[k] = x
+                k = k + 1
+            t = stop
+            if event is not None:
+                apply_pulse(x, event)
+                # Reaction times are memoryless, so they may all be drawn
+                # again after the counts changed.
+                (a, queue) = self.reaction_times(t, x)
+        Y[k:] = x
+        return Y
+
+    ## Draw the next times of all the reactions.
+    #  @param self The object pointer.
+    #  @param t Current time.
+    #  @param x Counts.
+    #  @return Tuple (propensities, IndexedPriorityQueue of reaction times).
+    def reaction_times(self, t, x):
+        a = [max(r(t, x, self.p)[0], 0.0)
+             for r in self.model.reaction_functions]
+        times = []
+        for a_j in a:
+            if a_j > 0.0:
+                times.append(t + self.rng.exponential() / a_j)
+            else:
+                times.append(np.inf)
+        return (a, IndexedPriorityQueue(times))
+
+    ## Explicit tau-leaping for a batch of trajectories.
+    #  @param self The object pointer.
+    #  @param x0 Initial counts.
+    #  @param T Time points.
+    #  @param batch Number of trajectories.
+    #  @param tau Maximum leap length.
+    #  @param events Sorted list of pulse tuples.
+    #  @return Array of counts (trajectories x time points x compositors).
+    def tau_leap(self, x0, T, batch, tau, events):
+        m = len(T)
+        x0 = self.initial_counts(x0, T, events)
+        X = np.tile(x0[:, None], (1, batch))
+        Y = np.empty((batch, m, len(x0)))
+        Y[:, 0] = X.T
+        k = 1
+        t = T[0]
+        for (stop, event) in self.segments(T, events):
+            while t < stop:
+                target = stop
+                if k < m and T[k] < stop:
+                    target = T[k]
+                h = min(tau, target - t)
+                self.leap(X, np.arange(0, batch), t, h, 0)
+                if target - t <= tau:
+                    t = target
+                else:
+                    t = t + tau
+                if k < m and t == T[k] and t < stop:
+                    Y[:, k] = X.T
+                    k = k + 1
+            if event is not None:
+                apply_pulse(X, event)
+            while k < m and T[k] <= t:
+                Y[:, k] = X.T
+                k = k + 1
+        return Y
+
+    ## Leap some trajectories by a time step, in two halves for those whose
+    #  counts would become negative.
+    #  @param self The object pointer.
+    #  @param X Counts, one column per trajectory, updated.
+    #  @param idx Indices of the trajectories to leap.
+    #  @param t Current time.
+    #  @param h Time step.
+    #  @param halvings Number of times the step was already halved.
+    #  @return None.
+    def leap(self, X, idx, t, h, halvings):
+        V = self.propensities(np.full(len(idx), t), X[:, idx])
+        Z = X[:, idx] + self.S.dot(self.rng.poisson(V * h))
+        rejected = np.zeros(len(idx), dtype=bool)
+        if halvings < MAX_HALVINGS:
+            rejected = np.any(Z < 0, axis=0)
+        X[:, idx[~rejected]] = Z[:, ~rejected]
+        if np.any(rejected):
+            idx = idx[rejected]
+            self.leap(X, idx, t, h / 2, halvings + 1)
+            self.leap(X, idx, t + h / 2, h / 2, halvings + 1)
+        return None
+
+
+## Apply a pulse to counts.
+#  @param x Counts of one trajectory or a matrix of counts with one column
+#  per trajectory.
+#  @param event Pulse tuple (time, compositor index, value, add).
+#  @return None.
+def apply_pulse(x, event):
+    (time, i, value, add) = event
+    if i is not None:
+        if add:
+            x[i] = x[i] + value
+        else:
+            x[i] = value
+    return None
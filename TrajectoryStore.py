@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import os
+import numpy as np
+from Result import Result
+
+## Simulation results stored on disk.
+#
+#  A TrajectoryStore is a directory with the time points in T.npy, the
+#  Compositor values in Y.npy and the Compositor names in names.txt. The
+#  .npy files are written append-only, chunk by chunk, and their headers
+#  are updated after every chunk, so they are valid NumPy files at any time
+#  and can be memory-mapped without loading them into memory.
+#
+#  Example:
+#
+#  @code
+# store = TrajectoryStore('run1', sys.compositors)
+# for chunk in sys.run_stream([0, 1e7], store=store):
+#     pass
+# result = load_trajectory('run1')   # memory-mapped Result
+#  @endcode
+
+class TrajectoryStore:
+
+    ## Size of the .npy headers written, large enough for any shape.
+    HEADER_SIZE = 128
+
+    ## The constructor
+    #  @param self The object pointer.
+    #  @param directory Directory to create the files in.
+    #  @param compositors Compositors (or their names) in the order of the
+    #  columns of Y.
+    def __init__(self, directory, compositors):
+        ## Directory of the files.
+        self.directory = directory
+        ## Compositor names in the order of the columns of Y.
+        self.names = [getattr(c, 'name', c) for c in compositors]
+        ## Number of time points written.
+        self.count = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, 'names.txt'), 'w') as f:
+            f.write('\n'.join(self.names) + '\n')
+        ## Open file of time points.
+        self.T_file = open(os.path.join(directory, 'T.npy'), 'w+b')
+        ## Open file of Compositor values.
+        self.Y_file = open(os.path.join(directory, 'Y.npy'), 'w+b')
+        self.write_headers()
+
+    ## Append a chunk of results.
+    #  @param self The object pointer.
+    #  @param T Time points of the chunk.
+    #  @param Y Matrix of Compositor values of the chunk.
+    #  @return The object pointer.
+    def append(self, T, Y):
+        self.T_file.seek(0, os.SEEK_END)
+        self.T_file.write(np.ascontiguousarray(T, dtype='<f8').tobytes())
+        self.Y_file.seek(0, os.SEEK_END)
+        self.Y_file.write(np.ascontiguousarray(Y, dtype='<f8').tobytes())
+        self.count = self.count + len(T)
+        self.write_headers()
+        return self
+
+    ## Update the .npy headers with the current number of time points.
+    #  @param self The object pointer.
+    #  @return None.
+    def write_headers(self):
+        for (f, shape) in ((self.T_file, (self.count,)),
+                           (self.Y_file, (self.count, len(self.names)))):
+            f.seek(0)
+            f.write(npy_header(shape, self.HEADER_SIZE))
+            f.flush()
+        return None
+
+    ## Close the files.
+    #  @param self The object pointer.
+    #  @return None.
+    def close(self):
+        self.T_file.close()
+        self.Y_file.close()
+        return None
+
+    ## Open the stored results.
+    #  @param self The object pointer.
+    #  @return Result with memory-mapped T and Y.
+    def load(self):
+        return load_trajectory(self.directory)
+
+
+## Header of a .npy file (format version 1.0) of float64 values.
+#  @param shape Shape of the array.
+#  @param size Total size of the header in bytes, a multiple of 64.
+#  @return Header bytes.
+def npy_header(shape, size):
+    header = "{'descr': '<f8', 'fortran_order': False, 'shape': %r, }" % (
+        tuple(shape),)
+    # Magic string, version and header length take 10 bytes.
+    header = header.ljust(size - 10 - 1) + '\n'
+    return (b'\x93NUMPY\x01\x00' +
+            np.array(len(header), dtype='<u2').tobytes() +
+            header.encode('latin1'))
+
+
+## Open results stored by a TrajectoryStore without loading them.
+#  @param directory Directory of the TrajectoryStore.
+#  @return Result with memory-mapped T and Y.
+def load_trajectory(directory):
+    with open(os.path.join(directory, 'names.txt')) as f:
+        names = f.read().split()
+    T = np.load(os.path.join(directory, 'T.npy'), mmap_mode='r')
+    Y = np.load(os.path.join(directory, 'Y.npy'), mmap_mode='r')
+    return Result(T, Y, names)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from Biosystem import BioSystem
+from Compiler import Compiler
+from Part import Part
+from Rate import Rate
+
+
+## Chain X0 -> X1 -> ... of saturable conversions, with pairwise
+#  reactions X_i + X_{i+2} -> X_{i+1}.
+def chain(n):
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', 0.3)
+    system.addConstant('j', 0.1)
+    X = [system.addCompositor('X%d' % i, 1.0) for i in range(0, n)]
+    for i in range(0, n - 1):
+        rate = 'k * X%d / (1 + X%d**2)' % (i, i)
+        system.addPart(Part('p%d' % i, [X[i], X[i + 1]],
+                            [Rate('-' + rate), Rate(rate)]))
+    for i in range(0, n - 2):
+        rate = 'j * X%d * X%d' % (i, i + 2)
+        system.addPart(Part('q%d' % i, [X[i], X[i + 2], X[i + 1]],
+                            [Rate('-' + rate), Rate('-' + rate),
+                             Rate(rate)]))
+    return system
+
+
+## Compile everything a system can compile.
+def compiled(system):
+    system.determine_jacobian()
+    system.determine_parameter_jacobian()
+    system.determine_propensities()
+    return system.model
+
+
+## Parallel compilation in chunks gives the sources and results of the
+#  serial one, and reports the progress of every phase up to its total.
+@pytest.mark.parametrize('workers', [1, 2])
+def test_parallel_matches_serial(workers):
+    serial = compiled(chain(40))
+    reports = []
+    system = chain(40)
+    system.enableParallelCompilation(
+        workers, chunk_size=7,
+        progress=lambda *report: reports.append(report))
+    model = compiled(system)
+    for name in ('source', 'jac_source', 'pjac_source',
+                 'propensity_source'):
+        assert getattr(model, name) == getattr(serial, name), name
+    reference = chain(40)
+    np.testing.assert_allclose(system.run([0, 5]).Y,
+                               reference.run([0, 5]).Y)
+    phases = set([phase for (phase, done, total) in reports])
+    assert 'parse' in phases
+    for phase in phases:
+        done = [d for (p, d, total) in reports if p == phase]
+        total = [t for (p, d, t) in reports if p == phase]
+        assert done == sorted(done)
+        assert done[-1] == total[-1]
+
+
+## Results are merged in the order of the items, whatever the number of
+#  chunks pending.
+def test_map_keeps_order():
+    compiler = Compiler(workers=2, chunk_size=3)
+    items = list(range(0, 50))
+    assert compiler.map('test', _scaled, 2, items) == [2 * i for i in items]
+    assert compiler.map('test', _scaled, 2, []) == []
+    with pytest.raises(ValueError):
+        Compiler(chunk_size=0)
+
+
+## Chunk function multiplying every item by the context.
+def _scaled(context, items):
+    return [context * i for i in items]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from Biosystem import BioSystem
+from Part import Part
+from Rate import Rate
+
+
+## Decay A -k> B.
+def decay():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', 0.3)
+    A = system.addCompositor('A', 10)
+    B = system.addCompositor('B', 0)
+    system.addPart(Part('A -k> B', [A, B], [Rate('-k * A'), Rate('k * A')]))
+    return system
+
+
+## Members run in worker processes equal run_with in this process, in
+#  the order of the members.
+def test_ensemble_matches_run_with():
+    system = decay()
+    constants = [{'k': k} for k in (0.1, 0.2, 0.5, 1.0)]
+    initial = [{'A': a} for a in (1.0, 5.0, 10.0, 20.0)]
+    results = system.run_ensemble([0, 5], initial, constants, workers=2)
+    assert len(results) == 4
+    for (result, i, c) in zip(results, initial, constants):
+        reference = system.run_with([0, 5], i, c)
+        np.testing.assert_allclose(result.T, reference.T)
+        np.testing.assert_allclose(result.Y, reference.Y)
+    assert system.constants[0].value == 0.3
+
+
+## With one worker the members run in this process.
+def test_ensemble_single_worker():
+    system = decay()
+    results = system.run_ensemble([0, 5], [[2.0, 1.0]], workers=1)
+    np.testing.assert_allclose(results[0].Y[:, 0] + results[0].Y[:, 1],
+                               3.0)
+
+
+## Member lists must be given and match in length.
+def test_ensemble_invalid_members():
+    system = decay()
+    with pytest.raises(ValueError):
+        system.run_ensemble([0, 5])
+    with pytest.raises(ValueError):
+        system.run_ensemble([0, 5], [None], [None, None])
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from Biosystem import BioSystem
+from FitProblem import FitProblem
+from Part import Part
+from Rate import Rate
+
+
+## A -k> B -kd> 0 with the given Constant values.
+def pathway(k=0.3, kd=0.1):
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', k)
+    system.addConstant('kd', kd)
+    A = system.addCompositor('A', 10)
+    B = system.addCompositor('B', 0)
+    system.addPart(Part('A -k> B', [A, B], [Rate('-k * A'), Rate('k * A')]))
+    system.addPart(Part('B -kd>', [B], [Rate('-kd * B')]))
+    system.setSolver('odeint', rtol=1e-10, atol=1e-12)
+    return system
+
+
+## Measurements of A and B simulated with k = 0.3 and kd = 0.1.
+def measurements():
+    times = np.linspace(0.5, 20, 15)
+    result = pathway().run([0, 20], output=list(times))
+    return {'A': (times, result['A']),
+            'B': (times, result['B'], np.full(15, 0.5))}
+
+
+## Fits from wrong values recover the Constants of the data, with the
+#  analytic gradient or finite differences, and set them.
+@pytest.mark.parametrize('gradient', [True, False])
+def test_fit_recovers_constants(gradient):
+    system = pathway(k=1.0, kd=0.5)
+    fit = system.fit(measurements(), ['k', 'kd'], ([0, 0], [5, 5]),
+                     workers=1, gradient=gradient)
+    assert fit.cost < 1e-10
+    np.testing.assert_allclose(fit.x, [0.3, 0.1], rtol=1e-5)
+    assert fit.constants['k'] == pytest.approx(0.3, rel=1e-5)
+    assert system.constants[1].value == pytest.approx(0.1, rel=1e-5)
+
+
+## Several starts in worker processes find the same optimum.
+def test_fit_multistart():
+    system = pathway(k=2.0, kd=0.01)
+    fit = system.fit(measurements(), ['k', 'kd'], ([1e-3, 1e-3], [10, 10]),
+                     starts=4, workers=2, seed=1)
+    assert len(fit.starts) == 4
+    np.testing.assert_allclose(fit.x, [0.3, 0.1], rtol=1e-5)
+
+
+## The analytic Jacobian of the residuals equals finite differences.
+def test_residual_jacobian():
+    system = pathway(k=0.5, kd=0.2)
+    system.determine_jacobian()
+    system.determine_parameter_jacobian()
+    problem = FitProblem(system, measurements(), ['k', 'kd'])
+    x = np.array([0.5, 0.2])
+    J = problem.jacobian(x)
+    for j in range(0, 2):
+        step = np.zeros(2)
+        step[j] = 1e-6
+        expected = (problem.residuals(x + step) -
+                    problem.residuals(x - step)) / 2e-6
+        np.testing.assert_allclose(J[:, j], expected, rtol=1e-4, atol=1e-6)
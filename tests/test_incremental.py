@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import CompiledModel
+from Biosystem import BioSystem
+from Part import Part
+from Rate import Rate
+
+
+## Chain X0 -> X1 -> ... of saturable conversions.
+def chain(n):
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', 0.3)
+    X = [system.addCompositor('X%d' % i, 1.0) for i in range(0, n)]
+    for i in range(0, n - 1):
+        rate = 'k * X%d / (1 + X%d**2)' % (i, i)
+        system.addPart(Part('p%d' % i, [X[i], X[i + 1]],
+                            [Rate('-' + rate), Rate(rate)]))
+    return (system, X)
+
+
+## The reaction X2 + X4 -> X5 of a chain.
+def extra(X):
+    return Part('q', [X[2], X[4], X[5]],
+                [Rate('-X2 * X4'), Rate('-X2 * X4'), Rate('X2 * X4')])
+
+
+## After a Part is added only the chunks it touches are generated again,
+#  and the source equals the one of a system built at once.
+def test_only_changed_chunks_regenerated(monkeypatch):
+    (system, X) = chain(20)
+    system.run([0, 1])
+    generated = []
+    original = CompiledModel._chunk_sources
+
+    def counting(renames, chunks):
+        generated.extend(chunks)
+        return original(renames, chunks)
+
+    monkeypatch.setattr(CompiledModel, '_chunk_sources', counting)
+    system.addPart(extra(X))
+    result = system.run([0, 1])
+    # The rates of X2 and the Jacobian rows of X2, X4 and X5.
+    assert len(generated) == 4
+    (fresh, Y) = chain(20)
+    fresh.addPart(extra(Y))
+    np.testing.assert_allclose(result.Y, fresh.run([0, 1]).Y)
+    assert system.model.source == fresh.model.source
+    assert system.model.jac_source == fresh.model.jac_source
+
+
+## Chunks moved by an earlier change keep their source, with their
+#  temporaries renamed for their new position.
+def test_moved_chunks_renamed():
+    (system, X) = chain(6)
+    system.run([0, 1])
+    system.addCompositor('Z', 2.0)
+    system.addPart(Part('z', [X[0], system.compositors[-1]],
+                        [Rate('-k * X0 / (1 + X0**2) * Z'),
+                         Rate('k * X0 / (1 + X0**2) * Z')]))
+    result = system.run([0, 1])
+    (fresh, Y) = chain(6)
+    fresh.addCompositor('Z', 2.0)
+    fresh.addPart(Part('z', [Y[0], fresh.compositors[-1]],
+                       [Rate('-k * X0 / (1 + X0**2) * Z'),
+                        Rate('k * X0 / (1 + X0**2) * Z')]))
+    np.testing.assert_allclose(result.Y, fresh.run([0, 1]).Y)
+    assert system.model.source == fresh.model.source
+
+
+## Changing a Constant after a run keeps the compiled model and gives the
+#  results of a system built with the new value.
+def test_changed_constant_not_recompiled():
+    (system, X) = chain(5)
+    system.run([0, 1])
+    model = system.model
+    system.changeConstantValue('k', 0.9)
+    result = system.run([0, 1])
+    assert system.model is model
+    (fresh, Y) = chain(5)
+    fresh.changeConstantValue('k', 0.9)
+    np.testing.assert_allclose(result.Y, fresh.run([0, 1]).Y)
+
+
+## A Constant and a Part using it added after a run give the Jacobian and
+#  the sensitivities of a system built at once.
+def test_added_constant_and_part():
+    (system, X) = chain(5)
+    system.run_sensitivities([0, 1])
+    system.addConstant('j', 0.5)
+    system.addPart(Part('j', [X[4], X[0]],
+                        [Rate('-j * X4'), Rate('j * X4')]))
+    result = system.run_sensitivities([0, 2])
+    (fresh, Y) = chain(5)
+    fresh.addConstant('j', 0.5)
+    fresh.addPart(Part('j', [Y[4], Y[0]],
+                       [Rate('-j * X4'), Rate('j * X4')]))
+    reference = fresh.run_sensitivities([0, 2])
+    np.testing.assert_allclose(result.Y, reference.Y)
+    for name in ('k', 'j'):
+        np.testing.assert_allclose(result.sensitivities[name],
+                                   reference.sensitivities[name])
+    y = np.linspace(0.5, 1.5, 5)
+    p = system.constantValues()
+    np.testing.assert_allclose(system.model.jacobian(0.0, y, p),
+                               fresh.model.jacobian(0.0, y, p))
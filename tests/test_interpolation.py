@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from Biosystem import BioSystem
+
+
+## time_to_index of earlier versions: a linear scan.
+def scan_time_to_index(T, t):
+    i = 0
+    while i < len(T):
+        if T[i] >= t:
+            break
+        i = i + 1
+    if T[i] == t:
+        return [i]
+    return [i - 1]
+
+
+## Interpolation of earlier versions: a forward scan per point, returning
+#  the interpolated values of the less dense trace.
+def scan_interpolate(X1, X2, Y2):
+    interpolated = np.zeros(len(X1))
+    max_j = len(X2) - 1
+    j = 0
+    for i in range(0, len(X1)):
+        x1 = X1[i]
+        x_diff = abs(x1 - X2[j])
+        while (j < max_j - 1) and (abs(x1 - X2[j + 1]) < x_diff):
+            x_diff = min(x_diff, abs(x1 - X2[j + 1]))
+            j = j + 1
+        (a, b, c, d) = (X2[j], Y2[j], X2[j + 1], Y2[j + 1])
+        if x1 < X2[j] and j > 1:
+            (a, b, c, d) = (X2[j - 1], Y2[j - 1], X2[j], Y2[j])
+        A = 0 if (a - c) == 0 else (b - d) / (a - c)
+        interpolated[i] = A * x1 + (b - A * a)
+    return interpolated
+
+
+## Sorted random times starting at 0, optionally with repeated values.
+def times(rng, n, stop, repeats=False):
+    T = np.concatenate(([0.0], np.sort(rng.uniform(0, stop, n - 1))))
+    if repeats:
+        T[n // 2] = T[n // 2 - 1]
+    return T
+
+
+## time_to_index gives the indices of the linear scan, for single times
+#  and for arrays of times.
+def test_time_to_index_matches_scan():
+    system = BioSystem()
+    rng = np.random.default_rng(4)
+    T = times(rng, 200, 50.0)
+    queries = np.concatenate((T[:-1], rng.uniform(0, T[-1], 100)))
+    expected = [scan_time_to_index(T, t)[0] for t in queries]
+    assert [system.time_to_index(T, t)[0] for t in queries] == expected
+    assert list(system.time_to_index(T, queries)) == expected
+    assert system.time_to_index(list(T), T[-1]) == [199]
+    with pytest.raises(IndexError):
+        system.time_to_index(T, T[-1] + 1)
+
+
+## interpolate_traces gives the values of the scan, whichever trace is
+#  denser, also with repeated times and times past the sparse trace.
+@pytest.mark.parametrize('repeats', [False, True])
+def test_interpolate_traces_matches_scan(repeats):
+    system = BioSystem()
+    rng = np.random.default_rng(5)
+    X1 = times(rng, 300, 12.0)
+    Y1 = np.sin(X1)
+    X2 = times(rng, 40, 10.0, repeats)
+    Y2 = np.cos(X2)
+    expected = scan_interpolate(X1, X2, Y2)
+    (x1, y1, x2, y2) = system.interpolate_traces(X1, Y1, X2, Y2)
+    np.testing.assert_array_equal(x1, X1)
+    np.testing.assert_array_equal(y1, Y1)
+    np.testing.assert_array_equal(x2, X1)
+    np.testing.assert_allclose(y2, expected, rtol=1e-12, atol=1e-12)
+    (x1, y1, x2, y2) = system.interpolate_traces(X2, Y2, X1, Y1)
+    np.testing.assert_allclose(y1, expected, rtol=1e-12, atol=1e-12)
+    np.testing.assert_array_equal(y2, Y1)
+
+
+## Columns of a matrix are interpolated like single traces.
+def test_interpolate_matrix_columns():
+    system = BioSystem()
+    rng = np.random.default_rng(6)
+    X1 = times(rng, 100, 5.0)
+    X2 = times(rng, 30, 5.0)
+    Y2 = rng.uniform(0, 1, (30, 3))
+    (x1, y1, x2, y2) = system.interpolate_traces(X1, np.zeros(100), X2, Y2)
+    assert y2.shape == (100, 3)
+    for i in range(0, 3):
+        np.testing.assert_allclose(y2[:, i],
+                                   scan_interpolate(X1, X2, Y2[:, i]),
+                                   rtol=1e-12, atol=1e-12)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from Biosystem import BioSystem
+from Part import Part
+from Rate import Rate, MassAction
+
+
+## Stiff Robertson kinetics, with a saturable loss of C and a mass-action
+#  dimerization handled by the rate kernel.
+def robertson():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k1', 0.04)
+    system.addConstant('k2', 3e7)
+    system.addConstant('k3', 1e4)
+    system.addConstant('kd', 0.1)
+    A = system.addCompositor('A', 1.0)
+    B = system.addCompositor('B', 0.0)
+    C = system.addCompositor('C', 0.0)
+    D = system.addCompositor('D', 0.0)
+    system.addPart(Part('r1', [A, B], [Rate('-k1 * A'), Rate('k1 * A')]))
+    system.addPart(Part('r2', [B, C], [Rate('-k2 * B**2'),
+                                       Rate('k2 * B**2')]))
+    system.addPart(Part('r3', [B, A, C],
+                        [Rate('-k3 * B * C'), Rate('k3 * B * C'),
+                         Rate('0')]))
+    system.addPart(Part('loss', [C], [Rate('-C / (1 + C)')]))
+    system.addPart(Part('dim', [A, D],
+                        [MassAction('kd', {'A': 2}, -2),
+                         MassAction('kd', {'A': 2}, 1)]))
+    return system
+
+
+## Central finite-difference Jacobian of the compiled right-hand side.
+def finite_differences(model, y, p, h=1e-6):
+    n = len(y)
+    J = np.zeros((n, n))
+    for j in range(0, n):
+        step = h * max(1.0, abs(y[j]))
+        up = np.array(y, dtype=float)
+        down = np.array(y, dtype=float)
+        up[j] += step
+        down[j] -= step
+        J[:, j] = (model.rhs(0.0, up, p) - model.rhs(0.0, down, p)) / \
+            (2 * step)
+    return J
+
+
+## The analytic Jacobian, dense and sparse, equals finite differences.
+def test_jacobian_matches_finite_differences():
+    system = robertson()
+    system.determine_jacobian()
+    model = system.model
+    p = system.constantValues()
+    rng = np.random.default_rng(3)
+    for y in rng.uniform(0.1, 2.0, (5, 4)):
+        expected = finite_differences(model, y, p)
+        scale = np.abs(expected).max()
+        np.testing.assert_allclose(model.jacobian(0.0, y, p), expected,
+                                   rtol=1e-6, atol=1e-7 * scale)
+        np.testing.assert_allclose(
+            model.jacobian(0.0, y, p, sparse=True).toarray(),
+            model.jacobian(0.0, y, p))
+
+
+## The stiff solvers, with the dense or the sparse analytic Jacobian or
+#  without it, agree with odeint.
+@pytest.mark.parametrize('method,jacobian,sparse', [
+    ('BDF', True, False), ('BDF', True, True), ('Radau', True, False),
+    ('LSODA', True, False), ('BDF', False, False)])
+def test_stiff_solvers_agree(method, jacobian, sparse):
+    reference = robertson().run([0, 40]).Y
+    system = robertson()
+    system.setSolver(method, jacobian, sparse, rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(system.run([0, 40]).Y, reference,
+                               rtol=1e-4, atol=1e-7)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from Biosystem import BioSystem
+from Part import Part
+from Rate import Rate
+import MatlabModel
+
+
+## Enzymatic conversion of A to B and a slow decay of B.
+def model():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', 0.05)
+    system.addConstant('d', 1.5e-3)
+    A = system.addCompositor('A', 10)
+    B = system.addCompositor('B', 0)
+    E = system.addCompositor('E', 1)
+    system.addPart(Part('A + E -k> B + E', [A, B, E],
+                        [Rate('-k * A * E'), Rate('k * A * E'), Rate('0')]))
+    system.addPart(Part('B -d>', [B], [Rate('-d * B**2')]))
+    return system
+
+
+## A system exported as a MATLAB script and imported again is the same.
+def test_round_trip(tmp_path):
+    system = model()
+    path = str(tmp_path / 'model.m')
+    system.exportMatlab(path)
+    copy = BioSystem.importMatlab(path)
+    assert [(c.name, c.value) for c in copy.constants] == \
+        [(c.name, c.value) for c in system.constants]
+    assert [(k.name, k.init_value) for k in copy.compositors] == \
+        [(k.name, k.init_value) for k in system.compositors]
+    assert [p.name for p in copy.parts] == [p.name for p in system.parts]
+    (T, Y) = system.run([0, 25])
+    (T2, Y2) = copy.run([0, 25])
+    np.testing.assert_allclose(T2, T)
+    np.testing.assert_allclose(Y2, Y, rtol=1e-10, atol=1e-12)
+
+
+## The script of an imported system is the script it was imported from.
+def test_script_is_stable():
+    text = MatlabModel.script(model())
+    assert MatlabModel.script(MatlabModel.parse(text)) == text
+
+
+## Statements building the model must be understood.
+def test_unknown_name_in_model_statement():
+    with pytest.raises(ValueError):
+        MatlabModel.parse("sys = BioSystem();\nsys.AddConstant('k', foo);")
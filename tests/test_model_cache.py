@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from Biosystem import BioSystem
+from ModelCache import ModelCache
+from Part import Part
+from Rate import Rate
+
+
+## Decay A -k> B sharing the model cache @p cache.
+def decay(cache, k=0.3, rate='k * A'):
+    system = BioSystem()
+    system.model_cache = cache
+    system.addConstant('k', k)
+    A = system.addCompositor('A', 10)
+    B = system.addCompositor('B', 0)
+    system.addPart(Part('A -k> B', [A, B], [Rate('-' + rate), Rate(rate)]))
+    return system
+
+
+## A system of the same structure reuses the compiled model without
+#  parsing, even with other Constant values, and its results are its own.
+def test_hit_with_other_values():
+    cache = ModelCache()
+    first = decay(cache)
+    first.run([0, 5])
+    second = decay(cache, k=0.6)
+    result = second.run([0, 5])
+    assert second.model is first.model
+    assert all([k.expr is None for k in second.compositors])
+    np.testing.assert_allclose(result.Y[:, 0], 10 * np.exp(-0.6 * result.T),
+                               rtol=1e-5)
+    assert len(cache.models) == 1
+
+
+## Whitespace in rate strings does not change the key.
+def test_hit_ignores_whitespace():
+    cache = ModelCache()
+    decay(cache).run([0, 1])
+    second = decay(cache, rate='k*A')
+    second.determine_rates()
+    assert len(cache.models) == 1
+
+
+## A changed rate, an added Part, an added Constant or another backend
+#  is a miss.
+def test_miss_on_changed_structure():
+    cache = ModelCache()
+    first = decay(cache)
+    first.run([0, 1])
+    assert decay(cache, rate='k * A**2').run([0, 1]) is not None
+    assert len(cache.models) == 2
+    system = decay(cache)
+    system.addConstant('j', 1.0)
+    system.determine_rates()
+    assert system.model is not first.model
+    assert len(cache.models) == 3
+    first.addPart(Part('B ->', [first.compositors[1]], [Rate('-B')]))
+    first.run([0, 1])
+    assert len(cache.models) == 4
+    numpy_key = first.model_key
+    first.setBackend('numba')
+    first.determine_rates()
+    assert first.model_key != numpy_key
+
+
+## Least recently used models are evicted beyond @p maxsize.
+def test_eviction():
+    cache = ModelCache(maxsize=2)
+    keys = []
+    for rate in ('k * A', 'k * A**2', 'k * A**3'):
+        system = decay(cache, rate=rate)
+        system.determine_rates()
+        keys.append(system.model_key)
+    assert list(cache.models.keys()) == keys[1:]
+    assert cache.get(keys[0]) is None
+
+
+## Models stored in a directory are loaded by another cache, unreadable
+#  files are misses.
+def test_directory(tmp_path):
+    first = decay(ModelCache(directory=str(tmp_path)))
+    reference = first.run([0, 5])
+    cache = ModelCache(directory=str(tmp_path))
+    second = decay(cache)
+    np.testing.assert_allclose(second.run([0, 5]).Y, reference.Y)
+    assert all([k.expr is None for k in second.compositors])
+    cache.clear()
+    with open(cache.path(first.model_key), 'wb') as f:
+        f.write(b'broken')
+    assert cache.get(first.model_key) is None
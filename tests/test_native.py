@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import numpy as np
+import pytest
+from Biosystem import BioSystem
+from ModelCache import ModelCache
+from Part import Part
+from Rate import Rate, MassAction
+
+
+## Enzyme reaction with a Hill-type inflow, a time dependent outflow and a
+#  mass-action dimerization evaluated by the rate kernel.
+def enzyme(directory):
+    system = BioSystem()
+    system.model_cache = ModelCache(directory=directory)
+    system.addConstant('kf', 2.0)
+    system.addConstant('kc', 1.5)
+    system.addConstant('kd', 0.2)
+    A = system.addCompositor('A', 3.0)
+    E = system.addCompositor('E', 1.0)
+    C = system.addCompositor('C', 0.0)
+    B = system.addCompositor('B', 0.0)
+    D = system.addCompositor('D', 0.0)
+    system.addPart(Part('bind', [A, E, C], [Rate('-kf * A * E'),
+                                            Rate('-kf * A * E'),
+                                            Rate('kf * A * E')]))
+    system.addPart(Part('cat', [C, E, B], [Rate('-kc * C'), Rate('kc * C'),
+                                           Rate('kc * C')]))
+    system.addPart(Part('in', [A], [Rate('1 / (1 + B**2)')]))
+    system.addPart(Part('out', [B], [Rate('-exp(-t) * sqrt(B + 1)')]))
+    system.addPart(Part('dim', [B, D], [MassAction('kd', {'B': 2}, -2),
+                                        MassAction('kd', {'B': 2}, 1)]))
+    return system
+
+
+## Skip a backend that is not available here.
+def require(backend):
+    if backend == 'c' and shutil.which('cc') is None:
+        pytest.skip('No C compiler')
+    if backend == 'numba':
+        pytest.importorskip('numba')
+
+
+## The native right-hand side, Jacobian and batch functions and the runs
+#  agree with the numpy backend.
+@pytest.mark.parametrize('backend', ['c', 'numba'])
+def test_backend_matches_numpy(backend, tmp_path):
+    require(backend)
+    reference = enzyme(str(tmp_path))
+    reference.determine_jacobian()
+    system = enzyme(str(tmp_path))
+    system.setBackend(backend)
+    system.determine_jacobian()
+    assert system.model.native is not None
+    p = system.constantValues()
+    Y = np.random.default_rng(8).uniform(0.0, 3.0, (5, 4))
+    for (t, y) in zip([0.0, 0.5, 1.0, 2.0], Y.T):
+        np.testing.assert_allclose(system.model.rhs(t, y, p),
+                                   reference.model.rhs(t, y, p),
+                                   rtol=1e-12, atol=1e-14)
+        np.testing.assert_allclose(system.model.jacobian(t, y, p),
+                                   reference.model.jacobian(t, y, p),
+                                   rtol=1e-12, atol=1e-14)
+    np.testing.assert_allclose(system.model.rhs_batch(0.5, Y, p),
+                               reference.model.rhs_batch(0.5, Y, p),
+                               rtol=1e-12, atol=1e-14)
+    np.testing.assert_allclose(
+        system.model.jacobian_batch(0.5, Y, p).toarray(),
+        reference.model.jacobian_batch(0.5, Y, p).toarray(),
+        rtol=1e-12, atol=1e-14)
+    np.testing.assert_allclose(system.run([0, 5]).Y,
+                               reference.run([0, 5]).Y, rtol=1e-8,
+                               atol=1e-10)
+    (T, swept) = system.sweep([0, 5], {'kf': [1.0, 2.0]})
+    np.testing.assert_allclose(swept,
+                               reference.sweep([0, 5], {'kf': [1.0, 2.0]})[1],
+                               rtol=1e-8, atol=1e-10)
+
+
+## Without a C compiler or numba the numpy functions are used.
+@pytest.mark.parametrize('backend', ['c', 'numba'])
+def test_fallback_without_toolchain(backend, tmp_path, monkeypatch):
+    if backend == 'c':
+        monkeypatch.setenv('CC', 'no-such-compiler')
+    else:
+        monkeypatch.setitem(__import__('sys').modules, 'numba', None)
+    reference = enzyme(str(tmp_path))
+    system = enzyme(str(tmp_path / 'native'))
+    system.setBackend(backend)
+    result = system.run([0, 5])
+    assert system.model.native is None
+    assert system.model.backend == backend
+    np.testing.assert_allclose(result.Y, reference.run([0, 5]).Y)
+
+
+## Unknown backends are rejected.
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        BioSystem().setBackend('fortran')
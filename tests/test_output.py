@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from Biosystem import BioSystem
+from Part import Part
+from Rate import Rate
+
+
+## Decay of A into B.
+def decay():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', 0.3)
+    A = system.addCompositor('A', 10)
+    B = system.addCompositor('B', 0)
+    system.addPart(Part('A -k> B', [A, B], [Rate('-k * A'), Rate('k * A')]))
+    return system
+
+
+## Unknown output policies are rejected instead of read as 'grid'.
+def test_unknown_policy():
+    system = decay()
+    for output in ['gird', 'step', '']:
+        with pytest.raises(ValueError):
+            system.run([0, 5], output=output)
+    with pytest.raises(ValueError):
+        system.run_sensitivities([0, 5], output='steps')
+    with pytest.raises(ValueError):
+        next(system.run_stream([0, 5], output='points'))
+
+
+## Output time points must be sorted within the time span.
+def test_output_times_validated():
+    system = decay()
+    for output in [[0, 6], [-1, 2], [3, 1], [], [[1, 2]]]:
+        with pytest.raises(ValueError):
+            system.run([0, 5], output=output)
+    result = system.run([0, 5], output=[1, 2, 5])
+    np.testing.assert_allclose(result.T, [1, 2, 5])
+
+
+## Analytic trace of A.
+def exact(T):
+    return 10 * np.exp(-0.3 * np.asarray(T))
+
+
+## 'grid' reports the fixed grid of time_points.
+def test_grid_policy():
+    system = decay()
+    result = system.run([0, 100])
+    np.testing.assert_array_equal(result.T, system.time_points([0, 100]))
+    assert len(result.T) == 1700
+    np.testing.assert_allclose(result['A'], exact(result.T), atol=1e-5)
+
+
+## 'steps' reports the solver steps, far fewer than the grid over a long
+#  span, from the first to the last time of the span.
+def test_steps_policy():
+    system = decay()
+    system.setSolver('odeint', rtol=1e-8, atol=1e-10)
+    result = system.run([0, 1000], output='steps')
+    assert result.T[0] == 0 and result.T[-1] == 1000
+    assert len(result.T) < len(system.time_points([0, 1000])) // 10
+    assert np.all(np.diff(result.T) > 0)
+    np.testing.assert_allclose(result['A'], exact(result.T), atol=1e-6)
+    np.testing.assert_allclose(result['A'] + result['B'], 10)
+
+
+## A list reports exactly its time points, also without the initial time.
+def test_list_policy():
+    system = decay()
+    times = [0.5, 1.0, 2.5, 5.0]
+    result = system.run([0, 5], output=times)
+    np.testing.assert_array_equal(result.T, times)
+    np.testing.assert_allclose(result['A'], exact(times), rtol=1e-5)
+
+
+## max_points limits the grid and thins the steps, keeping both ends.
+def test_max_points():
+    system = decay()
+    result = system.run([0, 100], max_points=50)
+    assert len(result.T) == 50
+    assert result.T[0] == 0 and result.T[-1] == 100
+    np.testing.assert_allclose(result['A'], exact(result.T), atol=1e-5)
+    steps = system.run([0, 100], output='steps')
+    thinned = system.run([0, 100], output='steps', max_points=5)
+    assert len(thinned.T) <= 5
+    assert thinned.T[0] == 0 and thinned.T[-1] == 100
+    assert set(thinned.T) <= set(steps.T)
+
+
+## threshold keeps only the points where a value changed by more than the
+#  threshold since the last kept point.
+def test_threshold():
+    system = decay()
+    full = system.run([0, 20])
+    result = system.run([0, 20], threshold=0.5)
+    assert len(result.T) < len(full.T)
+    assert result.T[0] == 0 and result.T[-1] == 20
+    changes = np.abs(np.diff(result.Y[:-1], axis=0)).max(axis=1)
+    assert np.all(changes > 0.5)
+    assert set(result.T) <= set(full.T)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from Biosystem import BioSystem
+from Part import Part
+from Pulse import Pulse
+from Rate import Rate
+
+
+## A single pulse happens once, if before the stop time.
+def test_single_pulse_times():
+    assert list(Pulse(2, 'A', 1).times(10)) == [2]
+    assert list(Pulse(10, 'A', 1).times(10)) == []
+
+
+## Periodic pulses repeat up to their count or the stop time.
+def test_periodic_pulse_times():
+    assert list(Pulse(0, 'A', 1, period=3).times(10)) == [0, 3, 6, 9]
+    assert list(Pulse(1, 'A', 1, period=2, count=3).times(100)) == [1, 3, 5]
+
+
+## Pulses which would repeat forever or never are rejected.
+@pytest.mark.parametrize('period, count', [
+    (0, None), (-1, None), (float('nan'), None), (1, 0), (None, 0),
+    (1, -2)])
+def test_invalid_pulse(period, count):
+    with pytest.raises(ValueError):
+        Pulse(0, 'A', 1, period=period, count=count)
+
+
+## Decay of A into B at rate k A.
+def decay(k=0.1):
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', k)
+    A = system.addCompositor('A', 0)
+    B = system.addCompositor('B', 0)
+    system.addPart(Part('A -k> B', [A, B], [Rate('-k * A'), Rate('k * A')]))
+    return system
+
+
+## Values of a Result at a time point.
+def at(result, t):
+    return result.Y[np.flatnonzero(result.T == t)[0]]
+
+
+## Pulses at the same time are applied in the order of the list, and the
+#  value reported at their time is the one after them.
+def test_simultaneous_pulses():
+    system = decay(k=0.0)
+    result = system.run_pulses([Pulse(0, 'A', 1), Pulse(5, 'A', 3),
+                                Pulse(5, 'A', 2, add=True),
+                                Pulse(5, 'B', 7), Pulse(10, '', 0)])
+    np.testing.assert_allclose(at(result, 0), [1, 0])
+    np.testing.assert_allclose(at(result, 5), [5, 7])
+    np.testing.assert_allclose(result.Y[-1], [5, 7])
+    assert np.sum(result.T == 5) == 1
+
+
+## Periodic pulses are applied count times, adding or setting the value.
+def test_periodic_pulses():
+    system = decay(k=0.0)
+    result = system.run_pulses([Pulse(1, 'A', 2, period=2, count=3,
+                                      add=True),
+                                Pulse(2, 'B', 4, period=3),
+                                Pulse(12, '', 0)])
+    for (t, a, b) in [(1, 2, 0), (2, 2, 4), (3, 4, 4), (5, 6, 4),
+                      (8, 6, 4), (11, 6, 4)]:
+        np.testing.assert_allclose(at(result, t), [a, b])
+    np.testing.assert_allclose(result.Y[-1], [6, 4])
+    before = result.Y[np.searchsorted(result.T, 3) - 1]
+    np.testing.assert_allclose(before, [2, 4])
+
+
+## The value at a pulse time is the value after the pulse.
+def test_post_pulse_value():
+    system = decay()
+    result = system.run_pulses([Pulse(0, 'A', 10), Pulse(4, 'A', 20),
+                                Pulse(8, '', 0)])
+    assert at(result, 4)[0] == 20
+    before = result.Y[np.searchsorted(result.T, 4) - 1]
+    assert before[0] < 10
+
+
+## Simulate pulses by restarting a run at every pulse, as run_pulses did
+#  before it used a single pass over the event queue.
+def segment_restart(system, pulses, T):
+    y = [c.value for c in system.compositors]
+    n = len(y)
+    index = dict([(c.name, i) for (i, c) in enumerate(system.compositors)])
+    times = sorted(set([t for p in pulses[:-1]
+                        for t in p.times(pulses[-1].time)] +
+                       [pulses[0].time, pulses[-1].time]))
+    Y = np.empty((len(T), n))
+    for (start, stop) in zip(times[:-1], times[1:]):
+        for p in pulses[:-1]:
+            if start in list(p.times(pulses[-1].time)) and \
+                    p.compositor_name:
+                i = index[p.compositor_name]
+                y[i] = y[i] + p.value if p.add else p.value
+        selected = (T >= start) & (T <= stop)
+        with system.replaced_values(list(y), None):
+            Y_segment = system.run([start, stop], output=T[selected]).Y
+        last = np.flatnonzero(selected)[-1]
+        y = list(Y_segment[-1])
+        Y[selected & (T < stop)] = Y_segment[T[selected] < stop]
+        if stop == times[-1]:
+            Y[last] = y
+    return Y
+
+
+## run_pulses matches the reference of restarted runs.
+def test_matches_segment_restart():
+    system = decay()
+    pulses = [Pulse(0, 'A', 10), Pulse(2.5, 'A', 4, period=6, count=3,
+                                       add=True),
+              Pulse(9, 'B', 1), Pulse(20, '', 0)]
+    result = system.run_pulses(pulses)
+    reference = segment_restart(system, pulses, result.T)
+    np.testing.assert_allclose(result.Y, reference, rtol=1e-5, atol=1e-6)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from Biosystem import BioSystem
+from Part import Part
+from Rate import Rate, MassAction, MichaelisMenten, Hill
+
+
+## Network of structured rate laws, or of their formulas if @p formulas.
+def network(formulas):
+    system = BioSystem()
+    system.model_cache = None
+    for (name, value) in (('k1', 0.7), ('k2', 0.2), ('vm', 1.3),
+                          ('km', 0.8), ('vh', 0.9), ('kh', 1.1),
+                          ('nh', 2.5)):
+        system.addConstant(name, value)
+    X = dict([(name, system.addCompositor(name, value)) for (name, value)
+              in (('A', 4.0), ('B', 3.0), ('C', 0.5), ('E', 1.0),
+                  ('P', 0.0), ('R', 0.2))])
+    parts = [
+        ('A + B -> C', ['A', 'B', 'C'],
+         [MassAction('k1', {'A': 1, 'B': 1}, c) for c in (-1, -1, 1)]),
+        ('2 C -> P', ['C', 'P'],
+         [MassAction('k2', {'C': 2}, c) for c in (-2, 1)]),
+        ('A^1.5 -> ', ['A'], [MassAction(0.05, {'A': 1.5}, -1)]),
+        ('P -E> R', ['P', 'R'],
+         [MichaelisMenten('vm', 'km', 'P', c, 'E') for c in (-1, 1)]),
+        ('-> B', ['B'], [MichaelisMenten(0.4, 2.0, 'A')]),
+        ('-> A | R', ['A'], [Hill('vh', 'kh', 'nh', 'R', 1, True)]),
+        ('R -> ', ['R'], [Hill(0.3, 1.0, 'nh', 'R', -1)])]
+    for (name, names, rates) in parts:
+        if formulas:
+            rates = [Rate(str(rate)) for rate in rates]
+        system.addPart(Part(name, [X[n] for n in names], rates))
+    return system
+
+
+## The kernel evaluates the rates, the Jacobians and the propensities of
+#  the laws like the compiled formulas. (Integer powers in formulas are
+#  read as mass action for the propensities, so the Hill law consuming its
+#  ligand has a Constant exponent.)
+def test_kernel_matches_formulas():
+    kernel = network(False)
+    formulas = network(True)
+    for system in (kernel, formulas):
+        system.determine_jacobian()
+        system.determine_parameter_jacobian()
+        system.determine_propensities()
+    assert kernel.model.kernel is not None
+    assert formulas.model.kernel is None
+    assert not kernel.symbolic()
+    p = kernel.constantValues()
+    rng = np.random.default_rng(9)
+    for y in rng.uniform(0.1, 5.0, (5, 6)):
+        for name in ('rhs', 'jacobian', 'parameter_jacobian'):
+            np.testing.assert_allclose(
+                getattr(kernel.model, name)(0.0, y, p),
+                getattr(formulas.model, name)(0.0, y, p),
+                rtol=1e-12, atol=1e-14, err_msg=name)
+    counts = np.array([5.0, 3.0, 4.0, 2.0, 7.0, 1.0])
+    a = np.sort(kernel.model.propensities(0.0, counts, p))
+    b = np.sort(formulas.model.propensities(0.0, counts, p))
+    np.testing.assert_allclose(a, b, rtol=1e-12)
+
+
+## Runs, sweeps and sensitivities agree.
+def test_runs_match_formulas():
+    kernel = network(False)
+    formulas = network(True)
+    for system in (kernel, formulas):
+        system.setSolver('BDF', rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(kernel.run([0, 10]).Y,
+                               formulas.run([0, 10]).Y, rtol=1e-7,
+                               atol=1e-9)
+    values = {'k1': [0.5, 1.0], 'nh': [1.0, 3.0]}
+    np.testing.assert_allclose(kernel.sweep([0, 10], values)[1],
+                               formulas.sweep([0, 10], values)[1],
+                               rtol=1e-7, atol=1e-9)
+    a = kernel.run_sensitivities([0, 5], ['k2', 'km', 'nh'])
+    b = formulas.run_sensitivities([0, 5], ['k2', 'km', 'nh'])
+    for name in ('k2', 'km', 'nh'):
+        np.testing.assert_allclose(a.sensitivities[name],
+                                   b.sensitivities[name], rtol=1e-6,
+                                   atol=1e-9)
+
+
+## The formula of a law is its string, with the coefficient in front.
+@pytest.mark.parametrize('rate,formula', [
+    (MassAction('k', {'A': 2, 'B': 1}, -2), '-2 * k * A**2 * B'),
+    (MichaelisMenten('vm', 'km', 'S', 1, 'E'), 'vm * E * S / (km + S)'),
+    (Hill('v', 'k', 2, 'L', 1, True), 'v * k**2 / (k**2 + L**2)')])
+def test_law_formulas(rate, formula):
+    from sympy import Symbol, sympify, simplify
+    table = dict([(name, Symbol(name)) for name in
+                  ('k', 'A', 'B', 'vm', 'km', 'S', 'E', 'v', 'L')])
+    assert simplify(sympify(str(rate), locals=table) -
+                    sympify(formula, locals=table)) == 0
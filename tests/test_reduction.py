@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from Biosystem import BioSystem
+from Part import Part
+from Rate import Rate, MassAction
+
+
+## Enzyme reaction A + E <-> C -> B + E, B + B -> D, with the totals
+#  A + C + B + 2 D and E + C conserved.
+def enzyme():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('kf', 2.0)
+    system.addConstant('kr', 0.5)
+    system.addConstant('kc', 1.5)
+    system.addConstant('kd', 0.3)
+    A = system.addCompositor('A', 3.0)
+    E = system.addCompositor('E', 1.0)
+    C = system.addCompositor('C', 0.0)
+    B = system.addCompositor('B', 0.0)
+    D = system.addCompositor('D', 0.0)
+    rate = 'kf * A * E - kr * C'
+    system.addPart(Part('bind', [A, E, C], [Rate('-(%s)' % rate),
+                                            Rate('-(%s)' % rate),
+                                            Rate(rate)]))
+    system.addPart(Part('cat', [C, E, B], [Rate('-kc * C'), Rate('kc * C'),
+                                           Rate('kc * C')]))
+    system.addPart(Part('dim', [B, D], [MassAction('kd', {'B': 2}, -2),
+                                        MassAction('kd', {'B': 2}, 1)]))
+    return system
+
+
+## The laws are independent, annihilate S and span the conserved totals.
+def test_conservation_laws():
+    system = enzyme()
+    system.determine_rates()
+    model = system.model
+    L = np.asarray(model.conservation_laws())
+    S = np.asarray(model.S)
+    assert L.shape == (2, 5)
+    np.testing.assert_allclose(L.dot(S), 0, atol=1e-12)
+    expected = np.array([[1, 0, 1, 1, 2], [0, 1, 1, 0, 0]])
+    combined = np.vstack((L, expected))
+    assert np.linalg.matrix_rank(combined) == 2
+    (independent, dependent, M) = model.reduction()
+    assert len(independent) == 3 and len(dependent) == 2
+    np.testing.assert_allclose(np.asarray(M)[:, dependent], np.eye(2))
+
+
+## reduce=True gives the values of the full system, with exactly
+#  conserved totals, for every solver and output policy.
+@pytest.mark.parametrize('method,sparse', [('odeint', False),
+                                           ('BDF', False), ('BDF', True),
+                                           ('LSODA', False)])
+def test_reduced_run_matches_full(method, sparse):
+    full = enzyme()
+    full.setSolver(method, sparse=sparse, reduce=False, rtol=1e-10,
+                   atol=1e-12)
+    system = enzyme()
+    system.setSolver(method, sparse=sparse, rtol=1e-10, atol=1e-12)
+    result = system.run([0, 20])
+    np.testing.assert_allclose(result.Y, full.run([0, 20]).Y, rtol=1e-6,
+                               atol=1e-8)
+    Y = result.Y
+    np.testing.assert_allclose(Y[:, 0] + Y[:, 2] + Y[:, 3] + 2 * Y[:, 4],
+                               3.0, rtol=1e-13)
+    np.testing.assert_allclose(Y[:, 1] + Y[:, 2], 1.0, rtol=1e-13)
+    steps = system.run([0, 20], output='steps')
+    np.testing.assert_allclose(steps.Y[-1], result.Y[-1], rtol=1e-6,
+                               atol=1e-8)
+
+
+## The reduced Jacobian equals finite differences of the reduced system.
+@pytest.mark.parametrize('sparse', [False, True])
+def test_reduced_jacobian(sparse):
+    system = enzyme()
+    system.determine_jacobian()
+    y0 = [3.0, 1.0, 0.5, 0.2, 0.1]
+    (f, jac, x0, expand) = system.reduced_system(
+        y0, system.constantValues(), sparse)
+    assert len(x0) == 3
+    np.testing.assert_allclose(expand(x0), y0)
+    J = jac(0.0, x0)
+    if sparse:
+        J = J.toarray()
+    for j in range(0, 3):
+        step = np.zeros(3)
+        step[j] = 1e-6
+        expected = (f(0.0, x0 + step) - f(0.0, x0 - step)) / 2e-6
+        np.testing.assert_allclose(J[:, j], expected, rtol=1e-6,
+                                   atol=1e-8)
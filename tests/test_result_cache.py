@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from Biosystem import BioSystem
+from Part import Part
+from Pulse import Pulse
+from Rate import Rate
+from ResultCache import ResultCache
+
+
+## Decay of A into B.
+def decay():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', 0.3)
+    A = system.addCompositor('A', 10)
+    B = system.addCompositor('B', 0)
+    system.addPart(Part('A -k> B', [A, B], [Rate('-k * A'), Rate('k * A')]))
+    return system
+
+
+## Repeated runs are hits returning copies equal to the simulation.
+def test_hit_returns_copy():
+    system = decay()
+    cache = system.enableResultCache()
+    first = system.run([0, 10])
+    assert (cache.hits, cache.misses) == (0, 1)
+    first.Y[:] = -1
+    second = system.run([0, 10])
+    assert (cache.hits, cache.misses) == (1, 1)
+    np.testing.assert_allclose(second.Y, decay().run([0, 10]).Y)
+    second.Y[:] = -1
+    assert system.run([0, 10]).Y.min() >= 0
+
+
+## A changed Constant, initial value, time span, output policy, solver
+#  or Part is a miss; restoring the values is a hit again.
+def test_changes_miss():
+    system = decay()
+    cache = system.enableResultCache()
+    system.run([0, 10])
+    changes = [
+        lambda: system.changeConstantValue('k', 0.4),
+        lambda: system.changeInitialValue('A', 5),
+        lambda: system.run([0, 11]),
+        lambda: system.run([0, 10], output=[0, 5, 10]),
+        lambda: system.run([0, 10], max_points=10),
+        lambda: system.setSolver('BDF'),
+        lambda: system.addPart(Part('B ->', [system.compositors[1]],
+                                    [Rate('-0.1 * B')]))]
+    for change in changes:
+        misses = cache.misses
+        change()
+        result = system.run([0, 10])
+        assert cache.misses > misses
+    system.disableResultCache()
+    np.testing.assert_allclose(result.Y, system.run([0, 10]).Y)
+    system.result_cache = cache
+    system.changeConstantValue('k', 0.3)
+    hits = cache.hits
+    system.run([0, 10])
+    system.changeConstantValue('k', 0.4)
+    system.run([0, 10])
+    assert cache.hits == hits + 1
+
+
+## Pulsed runs are cached by their schedule.
+def test_pulses_keyed_on_schedule():
+    system = decay()
+    cache = system.enableResultCache()
+    pulses = [Pulse(0, 'A', 10), Pulse(5, 'A', 3, add=True),
+              Pulse(10, '', 0)]
+    first = system.run_pulses(pulses)
+    assert system.run_pulses(pulses).Y.tolist() == first.Y.tolist()
+    assert cache.hits == 1
+    other = system.run_pulses(pulses[:1] + [Pulse(5, 'A', 4, add=True)] +
+                              pulses[2:])
+    assert cache.misses == 2
+    assert other.Y[-1, 0] > first.Y[-1, 0]
+
+
+## Memory is bounded by the number and the size of the results.
+def test_bounds():
+    system = decay()
+    cache = system.enableResultCache(maxsize=2)
+    for end in (10, 20, 30):
+        system.run([0, end])
+    assert len(cache.results) == 2
+    size = cache.nbytes
+    cache = system.enableResultCache(max_bytes=size // 2 + 1)
+    system.run([0, 10])
+    system.run([0, 20])
+    assert len(cache.results) == 1
+    assert cache.nbytes <= cache.max_bytes
+
+
+## Results stored in a directory are found by another cache.
+def test_directory(tmp_path):
+    system = decay()
+    system.enableResultCache(directory=str(tmp_path))
+    first = system.run([0, 10])
+    other = decay()
+    cache = other.enableResultCache(directory=str(tmp_path))
+    np.testing.assert_array_equal(other.run([0, 10]).Y, first.Y)
+    assert cache.hits == 1
+    cache.clear(stored=True)
+    other.run([0, 10])
+    assert cache.misses == 1
+
+
+## Keys distinguish items of different types and structure.
+def test_key_items():
+    cache = ResultCache()
+    keys = [cache.key(item) for item in (
+        '1', 1.0, None, True, [1.0, 2.0], [[1.0], 2.0], {'a': 1.0},
+        np.array([1.0, 2.0]), np.array([[1.0, 2.0]]))]
+    assert len(set(keys)) == len(keys)
+    assert cache.key({'a': 1.0, 'b': 2.0}) == cache.key({'b': 2.0, 'a': 1.0})
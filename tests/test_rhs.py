@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from Biosystem import BioSystem
+from Part import Part
+from Rate import Rate
+
+
+## Enzyme reaction A + E <-> C -> B + E with a saturable outflow of B.
+def enzyme():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('kf', 2.0)
+    system.addConstant('kr', 0.5)
+    system.addConstant('kc', 1.5)
+    system.addConstant('vm', 0.7)
+    A = system.addCompositor('A', 3.0)
+    E = system.addCompositor('E', 1.0)
+    C = system.addCompositor('C', 0.2)
+    B = system.addCompositor('B', 0.0)
+    system.addPart(Part('bind', [A, E, C],
+                        [Rate('-kf * A * E + kr * C'),
+                         Rate('-kf * A * E + kr * C'),
+                         Rate('kf * A * E - kr * C')]))
+    system.addPart(Part('cat', [C, E, B],
+                        [Rate('-kc * C'), Rate('kc * C'), Rate('kc * C')]))
+    system.addPart(Part('out', [B], [Rate('-vm * B / (1 + B)')]))
+    return system
+
+
+## The compositor rates, evaluated one by one by sympy.
+def reference(system, y):
+    from sympy import sympify
+    table = system.symbol_table()
+    values = dict([(c.sym, c.value) for c in system.constants] +
+                  [(k.sym, v) for (k, v) in zip(system.compositors, y)])
+    return np.array([float(sympify(k.rate, locals=table).subs(values))
+                     for k in system.compositors])
+
+
+## The compiled right-hand side, S times the reaction rates, equals the
+#  compositor rates evaluated one by one.
+def test_rhs_matches_compositor_rates():
+    system = enzyme()
+    system.determine_rates()
+    model = system.model
+    p = system.constantValues()
+    rng = np.random.default_rng(1)
+    for y in rng.uniform(0.0, 4.0, (5, len(system.compositors))):
+        expected = reference(system, y)
+        np.testing.assert_allclose(model.rhs(0.0, y, p), expected,
+                                   rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(
+            model.S.dot(model.reaction_rates(0.0, y, p)), expected,
+            rtol=1e-12, atol=1e-12)
+
+
+## The network has one reaction per distinct rate term.
+def test_reaction_network():
+    system = enzyme()
+    system.determine_rates()
+    (rates, S) = system.reaction_network()
+    assert S.shape == (4, len(rates))
+    # kf*A*E, kr*C, kc*C and vm*B/(1 + B).
+    assert len(rates) == 4
+
+
+## Evaluating a batch gives the columns of single evaluations.
+def test_rhs_batch_matches_single():
+    system = enzyme()
+    system.determine_rates()
+    model = system.model
+    Y = np.random.default_rng(2).uniform(0.0, 4.0, (4, 6))
+    p = system.constantValues()
+    expected = np.column_stack([model.rhs(0.0, Y[:, j], p)
+                                for j in range(0, Y.shape[1])])
+    np.testing.assert_allclose(model.rhs_batch(0.0, Y, p), expected,
+                               rtol=1e-12)
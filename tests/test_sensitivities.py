@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from Biosystem import BioSystem
+from Part import Part
+from Rate import Rate, MichaelisMenten
+
+
+## Enzyme kinetics A -> B with Michaelis-Menten kernel loss of B.
+def pathway():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', 0.4)
+    system.addConstant('K', 2.0)
+    system.addConstant('vm', 0.3)
+    system.addConstant('km', 1.5)
+    A = system.addCompositor('A', 5.0)
+    B = system.addCompositor('B', 0.0)
+    rate = 'k * A / (K + A)'
+    system.addPart(Part('conv', [A, B], [Rate('-' + rate), Rate(rate)]))
+    system.addPart(Part('loss', [B], [MichaelisMenten('vm', 'km', 'B',
+                                                      -1)]))
+    return system
+
+
+## Central finite differences of run with respect to a Constant.
+def finite_difference(system, name, tspan, h=1e-5):
+    value = system.constants[system.map_constants[name]].value
+    step = h * value
+    up = system.run_with(tspan, None, {name: value + step}).Y
+    down = system.run_with(tspan, None, {name: value - step}).Y
+    return (up - down) / (2 * step)
+
+
+## Sensitivities of every Constant, from formulas and from the kernel,
+#  agree with finite differences of tightly integrated runs.
+@pytest.mark.parametrize('method', ['odeint', 'BDF'])
+def test_sensitivities_match_finite_differences(method):
+    system = pathway()
+    system.setSolver(method, rtol=1e-10, atol=1e-12)
+    result = system.run_sensitivities([0, 10])
+    np.testing.assert_allclose(result.Y, system.run([0, 10]).Y,
+                               rtol=1e-7, atol=1e-9)
+    assert sorted(result.sensitivities.keys()) == ['K', 'k', 'km', 'vm']
+    for name in ('k', 'K', 'vm', 'km'):
+        expected = finite_difference(system, name, [0, 10])
+        np.testing.assert_allclose(result.sensitivities[name], expected,
+                                   rtol=1e-4, atol=1e-6)
+
+
+## Selected Constants and listed output times.
+def test_selected_constants_and_times():
+    system = pathway()
+    system.setSolver('odeint', rtol=1e-10, atol=1e-12)
+    full = system.run_sensitivities([0, 10], ['k'], output=[0, 2.5, 10])
+    part = system.run_sensitivities([0, 10], ['k'], output=[2.5, 10])
+    assert list(full.sensitivities.keys()) == ['k']
+    np.testing.assert_array_equal(full.sensitivities['k'][0], [0, 0])
+    np.testing.assert_allclose(part.sensitivities['k'],
+                               full.sensitivities['k'][1:], rtol=1e-7)
+    assert part.sensitivities['k'].shape == (2, 2)
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import os
+import stat
+import threading
+import numpy as np
+import pytest
+import ModelDescription
+from Biosystem import BioSystem
+from Part import Part
+from Rate import Rate
+import SimulationServer
+from SimulationServer import SimulationServer as Server
+from SimulationClient import SimulationClient
+
+
+## Decay of A into B.
+def model():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', 0.05)
+    A = system.addCompositor('A', 10)
+    B = system.addCompositor('B', 0)
+    system.addPart(Part('A -k> B', [A, B], [Rate('-k * A'), Rate('k * A')]))
+    return system
+
+
+## A server listening in a thread, with a long batching window.
+@pytest.fixture
+def server(tmp_path):
+    server = Server(str(tmp_path / 'server.sock'), workers=1, window=0.5)
+    started = threading.Event()
+    running = {}
+
+    async def serve():
+        running['loop'] = asyncio.get_running_loop()
+        running['stop'] = asyncio.Event()
+        await server.start()
+        started.set()
+        try:
+            await running['stop'].wait()
+        finally:
+            server.close()
+
+    thread = threading.Thread(target=asyncio.run, args=(serve(),),
+                              daemon=True)
+    thread.start()
+    assert started.wait(60)
+    yield server
+    running['loop'].call_soon_threadsafe(running['stop'].set)
+    thread.join(60)
+
+
+## Run requests of several clients at once, each with its own Constant
+#  values or None.
+def run_together(server, system, constants_list):
+    # Send the model first, so all the requests arrive within the window.
+    SimulationClient(system, server.address).close()
+    barrier = threading.Barrier(len(constants_list))
+    results = [None] * len(constants_list)
+
+    def request(i):
+        client = SimulationClient(system, server.address)
+        barrier.wait()
+        try:
+            results[i] = client.run([0, 20], constants=constants_list[i])
+        except RuntimeError as e:
+            results[i] = e
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=request, args=(i,))
+               for i in range(0, len(constants_list))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(120)
+    return results
+
+
+## Concurrent requests are integrated together and match local runs.
+def test_batching(server):
+    system = model()
+    ks = [0.02, 0.05, 0.1, 0.2]
+    results = run_together(server, system, [{'k': k} for k in ks])
+    assert server.requests == len(ks)
+    assert server.integrations == 1
+    for (k, result) in zip(ks, results):
+        local = system.run_with([0, 20], None, {'k': k})
+        np.testing.assert_allclose(result.Y, local.Y, rtol=1e-4, atol=1e-5)
+
+
+## A request with an unknown name fails alone.
+def test_error_isolation(server):
+    system = model()
+    results = run_together(server, system,
+                           [{'k': 0.1}, {'typo': 0.3}, {'k': 0.2}])
+    assert isinstance(results[1], RuntimeError)
+    assert 'typo' in str(results[1])
+    for (i, k) in [(0, 0.1), (2, 0.2)]:
+        local = system.run_with([0, 20], None, {'k': k})
+        np.testing.assert_allclose(results[i].Y, local.Y, rtol=1e-4,
+                                   atol=1e-5)
+    assert server.integrations == 1
+
+
+## If the batched integration fails, the members are run one by one and
+#  only the failing one gets an error.
+def test_failed_batch_runs_members_alone(tmp_path):
+    system = model()
+    outcomes = SimulationServer._serve_runs(
+        'test', ModelDescription.describe(system), [0, 5],
+        [(None, {'k': 0.1}), (None, {'typo': 0.3}), ({'A': 4}, None),
+         (None, {'k': 0.1})])
+    assert isinstance(outcomes[1], KeyError)
+    for (i, initial_values, constants) in [(0, None, {'k': 0.1}),
+                                           (2, {'A': 4}, None),
+                                           (3, None, {'k': 0.1})]:
+        (T, Y, names) = outcomes[i]
+        local = system.run_with([0, 5], initial_values, constants)
+        assert names == ['A', 'B']
+        np.testing.assert_allclose(Y, local.Y, rtol=1e-6, atol=1e-8)
+
+
+## The Unix socket is private to its owner.
+def test_socket_mode(server):
+    mode = os.stat(server.address).st_mode
+    assert stat.S_ISSOCK(mode)
+    assert stat.S_IMODE(mode) == 0o600
+
+
+## Only Unix socket paths are accepted, and the default one is in a
+#  directory of the user.
+def test_unix_socket_only(monkeypatch):
+    for address in [('127.0.0.1', 0), ('0.0.0.0', 0)]:
+        with pytest.raises(ValueError):
+            Server(address)
+    monkeypatch.setenv('XDG_RUNTIME_DIR', '/run/user/1234')
+    assert SimulationServer.default_address() == \
+        '/run/user/1234/biosystem.sock'
+    monkeypatch.delenv('XDG_RUNTIME_DIR')
+    assert str(os.getuid()) in SimulationServer.default_address()
+
+
+## The socket is not created in a directory other users can write to.
+def test_private_directory(tmp_path):
+    path = tmp_path / 'shared'
+    path.mkdir()
+    os.chmod(str(path), 0o777)
+    with pytest.raises(PermissionError):
+        asyncio.run(Server(str(path / 'server.sock'), workers=1).start())
+    SimulationServer.private_directory(str(tmp_path / 'new'))
+    assert stat.S_IMODE(os.stat(str(tmp_path / 'new')).st_mode) == 0o700
+
+
+## Models are descriptions of JSON values, checked before compilation.
+def test_model_description():
+    system = model()
+    description = ModelDescription.describe(system)
+    copy = ModelDescription.build(json.loads(json.dumps(description)))
+    assert ModelDescription.key(description) == \
+        ModelDescription.key(ModelDescription.describe(copy))
+    np.testing.assert_allclose(copy.run([0, 5]).Y, system.run([0, 5]).Y,
+                               rtol=1e-6, atol=1e-8)
+    description['compositors'][0][1] = 'print(1)'
+    with pytest.raises(ValueError):
+        ModelDescription.build(description)
+
+
+## A description that does not match its key is rejected.
+def test_model_key_mismatch(server):
+    description = ModelDescription.describe(model())
+    with pytest.raises(ValueError):
+        asyncio.run(server.add_model('0' * 64, description))
+
+
+## Messages with arrays other than float64, arrays exceeding the payload
+#  or frames larger than the limits are rejected.
+def test_message_limits():
+    parts = SimulationServer.message_parts({'op': 'x'},
+                                           [('a', np.arange(3.0))])
+    text = parts[0][SimulationServer.FRAME.size:]
+    payload = bytes(parts[1])
+    (header, arrays) = SimulationServer.unpack_message(text, payload)
+    np.testing.assert_array_equal(arrays['a'], np.arange(3.0))
+    bad = [('{"arrays": [["a", "|O", [3]]]}', payload),
+           ('{"arrays": [["a", "<f8", [4]]]}', payload),
+           ('{"arrays": [["a", "<f8", [2]]]}', payload),
+           ('{"arrays": [["a", "<f8", [-3]]]}', payload),
+           ('[1]', b'')]
+    for (text, payload) in bad:
+        with pytest.raises(ValueError):
+            SimulationServer.unpack_message(text.encode('utf-8'), payload)
+
+    async def read(frame):
+        reader = asyncio.StreamReader()
+        reader.feed_data(frame)
+        reader.feed_eof()
+        return await SimulationServer.read_message(reader, 1024)
+
+    with pytest.raises(ValueError):
+        asyncio.run(read(SimulationServer.FRAME.pack(2, 1 << 30)))
+    with pytest.raises(ValueError):
+        asyncio.run(read(SimulationServer.FRAME.pack(1 << 30, 0)))
+
+
+## Files at the socket path which are not sockets are left alone.
+def test_remove_socket_keeps_other_files(tmp_path):
+    path = str(tmp_path / 'not-a-socket')
+    with open(path, 'w') as f:
+        f.write('data')
+    SimulationServer.remove_socket(path)
+    assert os.path.exists(path)
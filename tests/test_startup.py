@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+import Benchmark
+
+## Directory of the modules.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+## Run code in a fresh interpreter and return its printed words.
+def fresh(code):
+    return subprocess.run([sys.executable, '-c', code], capture_output=True,
+                          text=True, check=True, cwd=ROOT).stdout.split()
+
+
+## Importing Biosystem stays within the budget and imports neither sympy
+#  nor scipy.integrate.
+def test_cold_import_budget():
+    measured = Benchmark.import_time(repeat=3)
+    assert measured['heavy_modules'] == []
+    assert measured['import_s'] < Benchmark.IMPORT_BUDGET
+
+
+## Building a system imports nothing heavy; sympy is imported for the
+#  first compilation and scipy.integrate for the first run.
+def test_heavy_modules_imported_when_needed():
+    words = fresh(
+        'import sys\n'
+        'from Biosystem import BioSystem\n'
+        'from Part import Part\n'
+        'from Rate import Rate\n'
+        'heavy = lambda: "/".join([m for m in ("sympy", "scipy.integrate")'
+        ' if m in sys.modules]) or "-"\n'
+        's = BioSystem()\n'
+        's.model_cache = None\n'
+        'A = s.addCompositor("A", 1)\n'
+        's.addConstant("k", 1)\n'
+        's.addPart(Part("p", [A], [Rate("-k * A")]))\n'
+        'print(heavy())\n'
+        's.determine_rates()\n'
+        'print(heavy())\n'
+        's.run([0, 1])\n'
+        'print(heavy())\n')
+    assert words == ['-', 'sympy', 'sympy/scipy.integrate']
+
+
+## The public names are still importable from the modules.
+def test_public_names():
+    words = fresh(
+        'from Biosystem import BioSystem\n'
+        'from Rate import Rate, MassAction, MichaelisMenten, Hill\n'
+        'from Pulse import Pulse\n'
+        'from Compositor import Compositor\n'
+        'from Const import Const\n'
+        'print("ok")\n')
+    assert words == ['ok']
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from Biosystem import BioSystem
+from Part import Part
+from Rate import Rate
+
+
+## Decay of A into B.
+def decay():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', 0.3)
+    A = system.addCompositor('A', 10)
+    B = system.addCompositor('B', 0)
+    system.addPart(Part('A -k> B', [A, B], [Rate('-k * A'), Rate('k * A')]))
+    return system
+
+
+## Streaming the solver steps records the time spent integrating.
+def test_step_chunks_timed():
+    system = decay()
+    system.enableStats()
+    chunks = list(system.run_stream([0, 50], chunk_points=5, output='steps'))
+    assert len(chunks) > 1
+    assert system.stats.times['integrate'] > 0.0
+    assert system.stats.phases['integrate'] == len(chunks)
+
+
+## The odeint option full_output does not change what the runs return,
+#  with and without statistics.
+def test_full_output_option():
+    reference = decay().run([0, 10])
+    for stats in [False, True]:
+        system = decay()
+        system.setSolver('odeint', full_output=True)
+        if stats:
+            system.enableStats()
+        np.testing.assert_allclose(system.run([0, 10]).Y, reference.Y)
+        result = system.run([0, 10], output='steps')
+        assert result.Y.shape[1] == 2
+        (T, Y) = system.sweep([0, 10], {'k': [0.3, 0.6]})
+        np.testing.assert_allclose(Y[0], reference.Y, rtol=1e-5,
+                                   atol=1e-6)
+        for chunk in system.run_stream([0, 10], output='steps'):
+            pass
+
+
+## The evaluation counters equal the evaluations the solvers report, and
+#  the compile phases are entered only while compiling.
+@pytest.mark.parametrize('method', ['odeint', 'BDF', 'Radau', 'LSODA'])
+def test_counters(method):
+    system = decay()
+    system.setSolver(method)
+    stats = system.enableStats()
+    result = system.run([0, 10])
+    assert stats.counts['rhs'] > 0
+    assert stats.counts['rhs'] == stats.solver['rhs_evaluations']
+    assert stats.counts['jacobian'] == stats.solver['jacobian_evaluations']
+    assert stats.solver['runs'] == 1
+    assert stats.phases['codegen'] == 1
+    assert stats.phases['integrate'] == 1
+    assert stats.buffers['run'] == result.Y.nbytes
+    system.run([0, 20])
+    assert stats.solver['runs'] == 2
+    assert stats.phases['codegen'] == 1
+    assert stats.phases['integrate'] == 2
+    assert stats.counts['rhs'] == stats.solver['rhs_evaluations']
+
+
+## Hooks get every phase, solver run and buffer; summary and reset.
+def test_hooks_summary_reset():
+    events = []
+    system = decay()
+    stats = system.enableStats(lambda *event: events.append(event))
+    system.run([0, 10])
+    kinds = set([event[0] for event in events])
+    assert kinds == set(['phase', 'solver', 'buffer'])
+    phases = [event[1] for event in events if event[0] == 'phase']
+    assert sorted(set(phases)) == sorted(stats.phases.keys())
+    assert len(phases) == sum(stats.phases.values())
+    summary = stats.summary()
+    assert summary['counts'] == stats.counts
+    assert 'Phases:' in str(stats)
+    stats.reset()
+    assert stats.counts == {'rhs': 0, 'jacobian': 0}
+    assert stats.times == {}
+    system.disableStats()
+    system.run([0, 5])
+    assert system.stats is None and stats.times == {}
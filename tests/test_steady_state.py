@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from Biosystem import BioSystem
+from Part import Part
+from Rate import Rate
+
+
+## Closed reversible binding A + E <-> C, with conserved totals.
+def binding():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('kf', 2.0)
+    system.addConstant('kr', 0.5)
+    A = system.addCompositor('A', 3.0)
+    E = system.addCompositor('E', 1.0)
+    C = system.addCompositor('C', 0.0)
+    rate = 'kf * A * E - kr * C'
+    system.addPart(Part('bind', [A, E, C], [Rate('-(%s)' % rate),
+                                            Rate('-(%s)' % rate),
+                                            Rate(rate)]))
+    return system
+
+
+## Production at rate k and saturable decay d A / (1 + A), with the
+#  steady state A = k / (d - k) for k < d and none for k >= d.
+def saturable():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', 0.5)
+    system.addConstant('d', 1.0)
+    A = system.addCompositor('A', 0.0)
+    system.addPart(Part('in', [A], [Rate('k')]))
+    system.addPart(Part('out', [A], [Rate('-d * A / (1 + A)')]))
+    return system
+
+
+## The steady state of a closed system has no residual, keeps the totals
+#  of the initial values and is where a long run ends.
+def test_closed_system():
+    system = binding()
+    y = system.steady_state()
+    p = system.constantValues()
+    system.determine_rates()
+    assert np.max(np.abs(system.model.rhs(0.0, y, p))) < 1e-10
+    np.testing.assert_allclose(y[0] + y[2], 3.0)
+    np.testing.assert_allclose(y[1] + y[2], 1.0)
+    np.testing.assert_allclose(y, system.run([0, 100]).Y[-1], atol=1e-6)
+    guess = system.steady_state({'A': 5.0})
+    np.testing.assert_allclose(guess[0] + guess[2], 5.0)
+
+
+## Large systems are solved with sparse matrices.
+def test_large_sparse_chain():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', 0.5)
+    X = [system.addCompositor('X%d' % i, 0.0) for i in range(0, 600)]
+    system.addPart(Part('in', [X[0]], [Rate('1')]))
+    for i in range(0, 599):
+        rate = 'k * X%d' % i
+        system.addPart(Part('p%d' % i, [X[i], X[i + 1]],
+                            [Rate('-' + rate), Rate(rate)]))
+    system.addPart(Part('out', [X[599]], [Rate('-k * X599')]))
+    np.testing.assert_allclose(system.steady_state(), 2.0)
+
+
+## A scan follows the branch of steady states, gives NaN where there is
+#  none and restores the Constant.
+def test_bifurcation_scan():
+    system = saturable()
+    values = np.array([0.1, 0.3, 0.5, 0.7, 0.9, 1.5])
+    Y = system.bifurcation_scan('k', values, {'A': 0.1})
+    k = values[:-1]
+    np.testing.assert_allclose(Y[:-1, 0], k / (1.0 - k), rtol=1e-8)
+    assert np.isnan(Y[-1, 0])
+    assert system.constants[0].value == 0.5
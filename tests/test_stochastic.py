@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from Biosystem import BioSystem
+from Part import Part
+from Rate import Rate, MassAction
+
+
+## Conversion A -> B at rate k A.
+def conversion():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', 2.0)
+    A = system.addCompositor('A', 20)
+    B = system.addCompositor('B', 0)
+    system.addPart(Part('A -k> B', [A, B], [Rate('-k * A'), Rate('k * A')]))
+    return system
+
+
+## Leaps too long for the counts are rejected and halved instead of
+#  clipped, so A + B is conserved and counts stay non-negative.
+def test_tau_leap_conserves():
+    result = conversion().run_stochastic([0, 3], 500, method='tau-leap',
+                                         tau=1.0, seed=3)
+    assert np.all(result.Y[:, :, 0] + result.Y[:, :, 1] == 20)
+    assert result.Y.min() >= 0
+
+
+## 2A -> B consumes A in pairs, so from an odd count one A is left.
+def test_tau_leap_keeps_parity():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', 0.5)
+    A = system.addCompositor('A', 5)
+    B = system.addCompositor('B', 0)
+    system.addPart(Part('2A -k> B', [A, B],
+                        [Rate('-2 * k * A**2'), Rate('k * A**2')]))
+    result = system.run_stochastic([0, 4], 200, method='tau-leap', seed=1)
+    assert np.all(result.Y[:, -1, 0] == 1)
+
+
+## 2A -> 0 as a rate formula or as a MassAction law.
+def annihilation(structured):
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', 0.5)
+    A = system.addCompositor('A', 5)
+    if structured:
+        rate = MassAction('k', {'A': 2}, -2)
+    else:
+        rate = Rate('-2 * k * A**2')
+    system.addPart(Part('2A -k> 0', [A], [rate]))
+    return system
+
+
+## Both forms remove two A per event at the propensity k A (A - 1).
+def test_string_and_structured_scaling_agree():
+    counts = np.array([5.0])
+    for structured in [False, True]:
+        system = annihilation(structured)
+        system.determine_propensities()
+        S = system.model.S
+        if not isinstance(S, np.ndarray):
+            S = S.toarray()
+        np.testing.assert_array_equal(S, [[-2.0]])
+        np.testing.assert_allclose(
+            system.model.propensities(0, counts, system.constantValues()),
+            [10.0])
+        result = system.run_stochastic([0, 10], 50, seed=2)
+        assert np.all(result.Y[:, -1, 0] == 1)
+
+
+## Integer order reactions get falling factorials even when another
+#  reaction has a fractional order, whose propensity is its rate.
+def test_integer_orders_per_reaction():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', 1.0)
+    A = system.addCompositor('A', 4)
+    B = system.addCompositor('B', 0)
+    system.addPart(Part('2A -> B', [A, B], [MassAction('k', {'A': 2}, -2),
+                                            MassAction('k', {'A': 2}, 1)]))
+    system.addPart(Part('A^1.5 -> B', [A, B],
+                        [MassAction('k', {'A': 1.5}, -1),
+                         MassAction('k', {'A': 1.5}, 1)]))
+    system.determine_propensities()
+    system.determine_reaction_functions()
+    counts = np.array([4.0, 0.0])
+    p = system.constantValues()
+    np.testing.assert_allclose(system.model.propensities(0, counts, p),
+                               [12.0, 8.0])
+    np.testing.assert_allclose(
+        [f(0, counts, p)[0] for f in system.model.reaction_functions],
+        [12.0, 8.0])
+    np.testing.assert_allclose(system.model.reaction_rates(0, counts, p),
+                               [16.0, 8.0])
+
+
+## Birth and death: 0 -kb> A -kd> 0 and a pulse adding A at t = 2.
+def birth_death():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('kb', 20.0)
+    system.addConstant('kd', 0.5)
+    A = system.addCompositor('A', 5)
+    system.addPart(Part('birth', [A], [Rate('kb')]))
+    system.addPart(Part('death', [A], [Rate('-kd * A')]))
+    return system
+
+
+## For linear kinetics the mean of the counts follows the ODE; the means
+#  of 400 trajectories of every method agree with it within 6 standard
+#  errors, also across a pulse.
+@pytest.mark.parametrize('method', ['ssa', 'nrm', 'tau-leap'])
+def test_means_match_ode(method):
+    from Pulse import Pulse
+    system = birth_death()
+    pulses = [Pulse(2, 'A', 30, add=True)]
+    result = system.run_stochastic([0, 4], 400, method=method,
+                                   pulses=pulses, tau=0.01, seed=11)
+    reference = system.run_pulses([Pulse(0, 'A', 5)] + pulses +
+                                  [Pulse(4, '', 0)])
+    T = result.T[::40]
+    ode = np.interp(T, reference.T, reference['A'])
+    mean = result['A'][:, ::40].mean(axis=0)
+    error = result['A'][:, ::40].std(axis=0) / np.sqrt(400)
+    assert np.all(np.abs(mean - ode) <= 6 * error + 0.5)
+    conversion_mean = conversion().run_stochastic(
+        [0, 1], 400, method=method, tau=0.01, seed=12)['A'].mean(axis=0)
+    np.testing.assert_allclose(conversion_mean[-1], 20 * np.exp(-2.0),
+                               atol=0.6)
+
+
+## The same seed gives the same trajectories.
+def test_seed_reproducible():
+    first = birth_death().run_stochastic([0, 2], 3, seed=7)
+    second = birth_death().run_stochastic([0, 2], 3, seed=7)
+    np.testing.assert_array_equal(first.Y, second.Y)
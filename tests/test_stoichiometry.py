@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from scipy.sparse import issparse
+from Biosystem import BioSystem
+from Part import Part
+from Rate import Rate, MassAction
+
+
+## Network with the reactions A + E -> C, C -> A + E, 2A -> 0 and
+#  C -> 2B.
+def network():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('kf', 2.0)
+    system.addConstant('kr', 0.5)
+    system.addConstant('kd', 0.1)
+    A = system.addCompositor('A', 1.0)
+    E = system.addCompositor('E', 1.0)
+    C = system.addCompositor('C', 0.0)
+    B = system.addCompositor('B', 0.0)
+    system.addPart(Part('bind', [A, E, C],
+                        [Rate('-kf * A * E + kr * C'),
+                         Rate('-kf * A * E + kr * C'),
+                         Rate('kf * A * E - kr * C')]))
+    system.addPart(Part('dimer', [A], [Rate('-2 * kd * A**2')]))
+    system.addPart(Part('split', [C, B], [Rate('-kr * C'),
+                                          Rate('2 * kr * C')]))
+    return system
+
+
+## Columns of S by their rate expressions.
+def columns(system):
+    (rates, S) = system.reaction_network()
+    S = S.toarray()
+    return dict([(str(rates[j]), list(S[:, j]))
+                 for j in range(0, len(rates))])
+
+
+## Equal rate terms form one reaction, consumed species of integer order
+#  lose their order, others the smallest coefficient.
+def test_network_columns():
+    system = network()
+    system.determine_rates()
+    assert columns(system) == {
+        'A*E*kf': [-1, -1, 1, 0],
+        'C*kr': [1, 1, -2, 2],
+        'A**2*kd': [-2, 0, 0, 0]}
+
+
+## The reactions of the rate kernel follow those of the rate formulas.
+def test_kernel_columns():
+    system = network()
+    A = system.compositors[0]
+    D = system.addCompositor('D', 0.0)
+    system.addPart(Part('dim', [A, D], [MassAction('kd', {'A': 2}, -2),
+                                        MassAction('kd', {'A': 2}, 1)]))
+    system.determine_rates()
+    S = system.model.S
+    assert S.shape == (5, 4)
+    np.testing.assert_array_equal(S[:, 3], [-2, 0, 0, 0, 1])
+
+
+## Large networks keep S sparse, with as many entries as stoichiometric
+#  coefficients.
+def test_large_network_sparse():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', 0.1)
+    X = [system.addCompositor('X%d' % i, 1.0) for i in range(0, 300)]
+    for i in range(0, 299):
+        rate = 'k * X%d' % i
+        system.addPart(Part('p%d' % i, [X[i], X[i + 1]],
+                            [Rate('-' + rate), Rate(rate)]))
+    system.determine_rates()
+    S = system.model.S
+    assert issparse(S)
+    assert S.shape == (300, 299)
+    assert S.nnz == 598
+    y = np.linspace(1.0, 2.0, 300)
+    expected = np.zeros(300)
+    expected[:-1] -= 0.1 * y[:-1]
+    expected[1:] += 0.1 * y[:-1]
+    np.testing.assert_allclose(system.model.rhs(0.0, y, [0.1]), expected)
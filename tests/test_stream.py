@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from Biosystem import BioSystem
+from Part import Part
+from Pulse import Pulse
+from Rate import Rate
+from TrajectoryStore import load_trajectory
+
+
+## Decay of A into B.
+def decay():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('k', 0.1)
+    A = system.addCompositor('A', 0)
+    B = system.addCompositor('B', 0)
+    system.addPart(Part('A -k> B', [A, B], [Rate('-k * A'), Rate('k * A')]))
+    return system
+
+
+## Joined chunks of a stream.
+def joined(chunks):
+    chunks = list(chunks)
+    return (np.concatenate([c.T for c in chunks]),
+            np.concatenate([c.Y for c in chunks]), len(chunks))
+
+
+## Streamed pulsed runs match run_pulses, also with pulses at chunk ends.
+def test_pulses_stream_matches_run_pulses(tmp_path):
+    system = decay()
+    pulses = [Pulse(0, 'A', 10), Pulse(3.3, 'A', 5, period=7.1, count=9,
+                                       add=True),
+              Pulse(20, 'B', 1), Pulse(20, 'A', 2, add=True),
+              Pulse(100, '', 0)]
+    reference = system.run_pulses(pulses)
+    for chunk_points in [50, 333, 100000]:
+        (T, Y, count) = joined(system.run_pulses_stream(pulses,
+                                                        chunk_points))
+        assert count == -(-1700 // chunk_points)
+        np.testing.assert_array_equal(T, reference.T)
+        np.testing.assert_allclose(Y, reference.Y, rtol=1e-5, atol=1e-5)
+    store = str(tmp_path / 'pulses')
+    for chunk in system.run_pulses_stream(pulses, 500, store=store):
+        pass
+    (T, Y) = load_trajectory(store)
+    np.testing.assert_array_equal(T, reference.T)
+
+
+## Streamed grid runs match run, whatever the chunk size.
+def test_grid_stream_matches_run():
+    system = decay()
+    system.changeInitialValue('A', 10)
+    system.setSolver('odeint', rtol=1e-10, atol=1e-12)
+    reference = system.run([0, 100])
+    for chunk_points in [1, 64, 1000, 10000]:
+        (T, Y, count) = joined(system.run_stream([0, 100], chunk_points))
+        assert count == -(-1700 // chunk_points)
+        np.testing.assert_allclose(T, reference.T, rtol=1e-13)
+        np.testing.assert_allclose(Y, reference.Y, rtol=1e-7, atol=1e-9)
+
+
+## Streamed solver steps are the steps of run with the 'steps' output.
+def test_steps_stream_matches_run():
+    system = decay()
+    system.changeInitialValue('A', 10)
+    system.setSolver('BDF', rtol=1e-8, atol=1e-10)
+    reference = system.run([0, 200], output='steps')
+    (T, Y, count) = joined(system.run_stream([0, 200], 7, output='steps'))
+    assert count == -(-len(reference.T) // 7)
+    np.testing.assert_allclose(T, reference.T)
+    np.testing.assert_allclose(Y, reference.Y, rtol=1e-8, atol=1e-10)
+
+
+## Chunks appended to a store are read back memory-mapped, also from a
+#  store the caller keeps open.
+def test_stream_store(tmp_path):
+    from TrajectoryStore import TrajectoryStore
+    system = decay()
+    system.changeInitialValue('A', 10)
+    (T, Y, count) = joined(system.run_stream([0, 30], 100,
+                                             store=str(tmp_path / 'a')))
+    result = load_trajectory(str(tmp_path / 'a'))
+    assert isinstance(result.Y, np.memmap)
+    assert result.names == ['A', 'B']
+    np.testing.assert_array_equal(result.T, T)
+    np.testing.assert_array_equal(result.Y, Y)
+    store = TrajectoryStore(str(tmp_path / 'b'), system.compositors)
+    for chunk in system.run_stream([0, 30], 100, store=store):
+        pass
+    assert store.count == len(T)
+    np.testing.assert_array_equal(store.load().Y, Y)
+    store.close()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from Biosystem import BioSystem
+from Part import Part
+from Rate import Rate
+
+
+## Reversible conversion A <-> B with a saturable loss of B.
+def reversible():
+    system = BioSystem()
+    system.model_cache = None
+    system.addConstant('kf', 0.3)
+    system.addConstant('kr', 0.1)
+    A = system.addCompositor('A', 10)
+    B = system.addCompositor('B', 0)
+    system.addPart(Part('conv', [A, B], [Rate('-kf * A + kr * B'),
+                                         Rate('kf * A - kr * B')]))
+    system.addPart(Part('loss', [B], [Rate('-0.2 * B / (1 + B)')]))
+    return system
+
+
+## Every set of a sweep agrees with run_with on its own.
+@pytest.mark.parametrize('method', ['odeint', 'BDF'])
+def test_sweep_matches_run_with(method):
+    system = reversible()
+    system.setSolver(method, rtol=1e-9, atol=1e-11)
+    kf = np.linspace(0.05, 1.0, 6)
+    A = np.linspace(1.0, 12.0, 6)
+    (T, Y) = system.sweep([0, 10], {'kf': kf, 'A': A})
+    assert Y.shape == (6, len(T), 2)
+    for i in range(0, len(kf)):
+        result = system.run_with([0, 10], {'A': A[i]}, {'kf': kf[i]})
+        np.testing.assert_allclose(T, result.T)
+        np.testing.assert_allclose(Y[i], result.Y, rtol=1e-6, atol=1e-8)
+    # The values of the system are not changed.
+    assert system.constants[0].value == 0.3
+    assert system.compositors[0].value == 10
+
+
+## Values are broadcast against each other and unknown names raise.
+def test_sweep_broadcast_and_unknown_name():
+    system = reversible()
+    (T, Y) = system.sweep([0, 5], {'kf': [0.1, 0.2, 0.4], 'kr': 0.0})
+    assert Y.shape[0] == 3
+    reference = system.run_with([0, 5], None, {'kf': 0.4, 'kr': 0.0})
+    np.testing.assert_allclose(Y[2], reference.Y, rtol=1e-5, atol=1e-7)
+    with pytest.raises(KeyError):
+        system.sweep([0, 5], {'nothing': [1.0]})